@@ -7,8 +7,19 @@ from flask import Flask
 from flask_login import LoginManager
 from flask_mail import Mail
 from werkzeug.security import generate_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
 from database import db
+from file_delivery import parse_accel_map
+from assets import init_assets
+from compression import CompressionMiddleware
+from data_versions import track_data_versions
+from fragment_cache import FragmentCacheExtension
+from lookups import track_lookups
+from db_engine import engine_options, init_db_engine
+from replicas import replica_bind, track_replica_writes
+from identity import load_identity, track_identity_changes
 from sqlalchemy import text
+from sqlalchemy.schema import CreateIndex
 import os
 
 # Initialize Flask app
@@ -23,8 +34,41 @@ if database_url.startswith('postgres://'):
     database_url = database_url.replace('postgres://', 'postgresql://', 1)
 app.config['SQLALCHEMY_DATABASE_URI'] = database_url
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Engine profile (see db_engine.py); the pool size defaults to the worker's concurrency + 1 (at most 10)
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE') or 0)
+app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 5))
+app.config['DB_POOL_TIMEOUT'] = 30  # Seconds a request waits for a free connection
+app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', 280))  # Seconds; below the server's idle cutoff
+app.config['DB_STATEMENT_TIMEOUT'] = int(os.environ.get('DB_STATEMENT_TIMEOUT', 15))  # Seconds, learner/parent pages
+app.config['DB_REPORT_STATEMENT_TIMEOUT'] = int(os.environ.get('DB_REPORT_STATEMENT_TIMEOUT', 120))  # Seconds, staff and jobs
+app.config['SQLITE_MMAP_MB'] = int(os.environ.get('SQLITE_MMAP_MB', 256))
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+# Optional read replica for report pages and background report jobs (see replicas.py)
+app.config['DATABASE_REPLICA_URL'] = os.environ.get('DATABASE_REPLICA_URL', '')
+app.config['REPLICA_STICKY_SECONDS'] = int(os.environ.get('REPLICA_STICKY_SECONDS', 5))  # Primary-only after a write
+if app.config['DATABASE_REPLICA_URL']:
+    app.config['SQLALCHEMY_BINDS'] = {'replica': replica_bind(app.config)}
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+# Upload storage: 'local' (UPLOAD_FOLDER) or 's3' (any S3-compatible bucket, e.g. MinIO, R2)
+app.config['STORAGE_BACKEND'] = os.environ.get('STORAGE_BACKEND', 'local')
+app.config['S3_BUCKET'] = os.environ.get('S3_BUCKET', '')
+app.config['S3_PREFIX'] = os.environ.get('S3_PREFIX', '')
+app.config['S3_ENDPOINT_URL'] = os.environ.get('S3_ENDPOINT_URL', '')  # Leave empty for AWS
+app.config['S3_REGION'] = os.environ.get('S3_REGION', '')
+app.config['S3_ACCESS_KEY_ID'] = os.environ.get('S3_ACCESS_KEY_ID', '')
+app.config['S3_SECRET_ACCESS_KEY'] = os.environ.get('S3_SECRET_ACCESS_KEY', '')
+app.config['S3_URL_EXPIRY'] = int(os.environ.get('S3_URL_EXPIRY', 3600))  # Signed URL lifetime (seconds)
+app.config['STORAGE_CACHE_FOLDER'] = os.environ.get('STORAGE_CACHE_FOLDER', 'storage_cache')  # Local copies for PDFs
+# File downloads handed to the reverse proxy: '' (served by the app), 'x-accel-redirect' (nginx) or 'x-sendfile'
+app.config['FILE_DELIVERY'] = os.environ.get('FILE_DELIVERY', '')
+app.config['USE_X_SENDFILE'] = app.config['FILE_DELIVERY'] == 'x-sendfile'
+app.config['X_ACCEL_REDIRECT_MAPPINGS'] = parse_accel_map(os.environ.get('X_ACCEL_REDIRECT_MAP', ''))
+# gzip/brotli compression of text responses (turn off when the reverse proxy already compresses)
+app.config['COMPRESSION_ENABLED'] = os.environ.get('COMPRESSION_ENABLED', 'true').lower() == 'true'
+app.config['COMPRESSION_MIN_SIZE'] = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))  # Bytes
+app.config['COMPRESSION_GZIP_LEVEL'] = int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6))
+app.config['COMPRESSION_BROTLI_QUALITY'] = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 4))
 
 # App Settings (defaults)
 app.config['SCHOOL_NAME'] = 'Wajina International School'
@@ -105,7 +149,13 @@ app.config['NOTIFY_ATTENDANCE'] = False
 app.config['MIN_PASSWORD_LENGTH'] = 6
 app.config['REQUIRE_PASSWORD_COMPLEXITY'] = False
 app.config['SESSION_TIMEOUT_MINUTES'] = 60
-app.config['MAX_LOGIN_ATTEMPTS'] = 5
+app.config['MAX_LOGIN_ATTEMPTS'] = 5  # Failed logins per account per LOGIN_ATTEMPT_WINDOW (0 = unlimited)
+app.config['MAX_LOGIN_ATTEMPTS_PER_IP'] = int(os.environ.get('MAX_LOGIN_ATTEMPTS_PER_IP', 50))  # Schools often share one IP
+app.config['LOGIN_ATTEMPT_WINDOW'] = int(os.environ.get('LOGIN_ATTEMPT_WINDOW', 900))  # Seconds
+# Stored password hashes using another method or cost are upgraded at the next successful login
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+# Reverse proxies in front of the app whose X-Forwarded-For is trusted for client IPs (Render: 1)
+app.config['TRUSTED_PROXY_COUNT'] = int(os.environ.get('TRUSTED_PROXY_COUNT', 0))
 
 # System Settings (defaults)
 app.config['AUTO_BACKUP_ENABLED'] = False
@@ -153,6 +203,31 @@ app.config['FLUTTERWAVE_SECRET_KEY'] = ''  # Set in settings or environment vari
 app.config['FLUTTERWAVE_ENCRYPTION_KEY'] = ''  # Set in settings or environment variable
 app.config['FLUTTERWAVE_ENVIRONMENT'] = 'sandbox'  # sandbox or live
 
+# Report card rendering: runs with more learners than REPORT_CARD_SYNC_LIMIT become background jobs
+app.config['REPORT_JOBS_FOLDER'] = os.environ.get('REPORT_JOBS_FOLDER', 'report_jobs')
+app.config['REPORT_CARD_SYNC_LIMIT'] = 60
+app.config['REPORT_CARD_CHUNK_SIZE'] = 50
+app.config['REPORT_CARD_WORKERS'] = int(os.environ.get('REPORT_CARD_WORKERS', 0)) or None  # None = up to 4 CPUs
+# Rendered report cards are cached per learner on disk (least recently used evicted above the limit)
+app.config['REPORT_CARD_CACHE_FOLDER'] = os.environ.get('REPORT_CARD_CACHE_FOLDER', 'report_cache')
+app.config['REPORT_CARD_CACHE_MAX_BYTES'] = int(os.environ.get('REPORT_CARD_CACHE_MAX_MB', 200)) * 1024 * 1024
+# Batch ID card sheets: cards per A4 page (CR80 cards, clamped to what fits)
+app.config['ID_CARD_SHEET_COLUMNS'] = 2
+app.config['ID_CARD_SHEET_ROWS'] = 5
+# ID card QR codes are cached on disk by content hash
+app.config['QR_CODE_CACHE_FOLDER'] = os.environ.get('QR_CODE_CACHE_FOLDER', 'qr_cache')
+# Application cache (template fragments, lookups): 'sqlite' is one file shared by all workers, 'local' is per process
+app.config['CACHE_BACKEND'] = os.environ.get('CACHE_BACKEND', 'sqlite')
+app.config['CACHE_DEFAULT_TTL'] = 300  # Seconds
+app.config['SHARED_CACHE_PATH'] = os.environ.get('SHARED_CACHE_PATH', os.path.join('app_cache', 'shared_cache.sqlite3'))
+app.config['SHARED_CACHE_MAX_ENTRIES'] = 10000
+app.config['SHARED_CACHE_MAX_BYTES'] = int(os.environ.get('SHARED_CACHE_MAX_MB', 64)) * 1024 * 1024
+app.config['LOCAL_CACHE_MAX_ENTRIES'] = 1024
+app.config['FRAGMENT_CACHE_TTL'] = 3600  # Seconds, for {% cache %} blocks without their own ttl
+app.config['LOOKUP_CACHE_TTL'] = 3600  # Seconds; filter dropdown values are also updated on every write
+# Seconds the logged-in user and its profile are reused across requests (0 = load them on every request)
+app.config['IDENTITY_CACHE_TTL'] = int(os.environ.get('IDENTITY_CACHE_TTL', 60))
+
 # Create upload folders
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], 'profiles'), exist_ok=True)
@@ -161,28 +236,56 @@ os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], 'passports'), exist_ok=Tru
 os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], 'logo'), exist_ok=True)
 os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], 'login'), exist_ok=True)
 os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], 'receipts'), exist_ok=True)
+os.makedirs(app.config['REPORT_JOBS_FOLDER'], exist_ok=True)
+os.makedirs(app.config['REPORT_CARD_CACHE_FOLDER'], exist_ok=True)
+os.makedirs(app.config['QR_CODE_CACHE_FOLDER'], exist_ok=True)
 
 # Initialize extensions
 db.init_app(app)
+# Pool metrics, SQLite pragmas and per-role PostgreSQL statement timeouts
+init_db_engine(app)
+if app.config['DATABASE_REPLICA_URL']:
+    # Browsers that just wrote keep reading from the primary for a few seconds
+    track_replica_writes()
+# Version counters behind the ETags of portal pages, bumped on every flush
+track_data_versions()
+# Cached filter dropdown values, updated as rows are committed
+track_lookups()
+# Cached logged-in users, dropped when the user or its profile is edited
+track_identity_changes()
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 login_manager.login_message = 'Please log in to access this page.'
 mail = Mail(app)
+# url_for('static', ...) returns fingerprinted files once build_assets.py has run
+init_assets(app)
+# {% cache key, ttl %} blocks in templates
+app.jinja_env.add_extension(FragmentCacheExtension)
+if app.config['COMPRESSION_ENABLED']:
+    app.wsgi_app = CompressionMiddleware(
+        app.wsgi_app,
+        min_size=app.config['COMPRESSION_MIN_SIZE'],
+        gzip_level=app.config['COMPRESSION_GZIP_LEVEL'],
+        brotli_quality=app.config['COMPRESSION_BROTLI_QUALITY'],
+    )
+if app.config['TRUSTED_PROXY_COUNT']:
+    # request.remote_addr becomes the client's IP, which login throttling counts per
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXY_COUNT'])
 
 # Import models (must be after db is created)
 # Import routes (must be after models are imported)
 # These imports are done at the end to avoid circular imports
 
 # Import models and routes after db is created (to avoid circular imports)
-from models import User, Learner, Staff, Class, Subject, Attendance, Fee, Exam, ExamResult, AcademicRecord, StoreItem, StoreTransaction, Expenditure, Assignment, AssignmentResult, Test, TestResult, AdmissionApplication, PaymentTransaction, Salary, SalaryAdvance, SchoolTimetable, ExamTimetable
+from models import User, Learner, Staff, Class, Subject, Attendance, Fee, Exam, ExamResult, AcademicRecord, StoreItem, StoreTransaction, Expenditure, Assignment, AssignmentResult, Test, TestResult, AdmissionApplication, PaymentTransaction, Salary, SalaryAdvance, SchoolTimetable, ExamTimetable, DataVersion, EWalletTransaction, EWalletDailyTotal
 from routes import *
 
 # Setup login manager
 @login_manager.user_loader
 def load_user(user_id):
-    from models import User
-    return User.query.get(int(user_id))
+    # One joined query for the user and its learner/staff profile; current_user keeps it for the request
+    return load_identity(int(user_id))
 
 
 # Context processor to make theme available in all templates
@@ -197,6 +300,39 @@ def initialize_database():
         # Check if tables exist by trying to query
         User.query.first()
         print("Database already initialized.")
+        # data_versions is written on every flush, so make sure it exists before serving requests
+        DataVersion.__table__.create(db.engine, checkfirst=True)
+        # Login lookup and list ordering indexes added after these tables were created (IF NOT
+        # EXISTS: SQLite does not reflect expression indexes, so checkfirst would try to create them again)
+        with db.engine.begin() as conn:
+            for model in (User, Fee, StoreTransaction, Expenditure, PaymentTransaction, Salary, EWalletTransaction):
+                for index in model.__table__.indexes:
+                    conn.execute(CreateIndex(index, if_not_exists=True))
+        
+        # E-wallet running totals added after the ewallets table was created: add the columns and
+        # the daily totals table, then backfill both once from the transaction history
+        try:
+            from sqlalchemy import inspect
+            inspector = inspect(db.engine)
+            wallet_columns = [col['name'] for col in inspector.get_columns('ewallets')]
+            added = not inspector.has_table(EWalletDailyTotal.__tablename__)
+            EWalletDailyTotal.__table__.create(db.engine, checkfirst=True)
+            
+            for column in ('total_deposits', 'total_withdrawals', 'total_payments'):
+                if column not in wallet_columns:
+                    print(f"Adding {column} column to ewallets table...")
+                    with db.engine.begin() as conn:
+                        conn.execute(text(f'ALTER TABLE ewallets ADD COLUMN {column} NUMERIC(12, 2) DEFAULT 0 NOT NULL'))
+                    added = True
+            
+            if added:
+                from ewallet_service import rebuild_wallet_totals
+                rebuild_wallet_totals()
+                db.session.commit()
+                print("E-wallet totals backfilled from transaction history.")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Note: Could not add e-wallet total columns automatically: {str(e)}")
     except Exception:
         # Tables don't exist, initialize database
         print("Initializing database...")
@@ -317,6 +453,29 @@ if __name__ == '__main__':
         except Exception as e:
             print(f"Note: Could not add password reset columns automatically: {str(e)}")
         
+        # Add e-wallet running total columns if they don't exist, then backfill them
+        try:
+            from sqlalchemy import inspect
+            inspector = inspect(db.engine)
+            wallet_columns = [col['name'] for col in inspector.get_columns('ewallets')]
+            added = False
+            
+            for column in ('total_deposits', 'total_withdrawals', 'total_payments'):
+                if column not in wallet_columns:
+                    print(f"Adding {column} column to ewallets table...")
+                    with db.engine.begin() as conn:
+                        conn.execute(text(f'ALTER TABLE ewallets ADD COLUMN {column} NUMERIC(12, 2) DEFAULT 0 NOT NULL'))
+                    added = True
+            
+            if added:
+                from ewallet_service import rebuild_wallet_totals
+                rebuild_wallet_totals()
+                db.session.commit()
+                print("E-wallet totals backfilled from transaction history.")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Note: Could not add e-wallet total columns automatically: {str(e)}")
+        
         # Create default admin user if it doesn't exist
         admin = User.query.filter_by(username='admin').first()
         if not admin:
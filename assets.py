@@ -0,0 +1,176 @@
+"""
+Static Asset Fingerprinting for Wajina Suite
+Copies static assets to content-hashed filenames with gzip/brotli variants at build time, and
+rewrites url_for('static', ...) to the hashed files so browsers can cache them forever
+"""
+
+from flask import request
+import gzip
+import hashlib
+import json
+import os
+import shutil
+
+
+# Output folder inside the static folder, and the manifest of logical name -> hashed name
+ASSET_DIST_FOLDER = 'dist'
+ASSET_MANIFEST_NAME = 'assets-manifest.json'
+
+# Static subfolders that are not build inputs
+ASSET_EXCLUDED_FOLDERS = {'uploads', ASSET_DIST_FOLDER}
+
+FINGERPRINT_EXTENSIONS = {
+    '.css', '.js', '.json', '.webmanifest', '.svg', '.png', '.jpg', '.jpeg', '.gif', '.webp', '.ico',
+    '.woff', '.woff2', '.ttf', '.eot', '.map',
+}
+# Text formats worth precompressing (images and fonts are already compressed)
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.json', '.webmanifest', '.svg', '.map', '.ttf', '.eot'}
+# Variants smaller than this are not worth an extra file
+MIN_COMPRESS_SIZE = 512
+
+# Hashed files never change, so browsers may keep them for a year without revalidating
+ASSET_MAX_AGE = 365 * 24 * 60 * 60
+
+SERVICE_WORKER_SOURCE = 'js/service-worker.js'
+
+# Content-Encoding -> file suffix, in order of preference
+PRECOMPRESSED_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def fingerprinted_name(relative_path, digest):
+    """css/style.css -> css/style.<digest>.css"""
+    stem, ext = os.path.splitext(relative_path)
+    return f'{stem}.{digest}{ext}'
+
+
+def _file_digest(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            sha.update(block)
+    return sha.hexdigest()[:12]
+
+
+def _compress_variants(path):
+    """Write .gz (and .br when the brotli package is installed) next to a built file"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < MIN_COMPRESS_SIZE:
+        return
+    
+    # mtime=0 keeps the output identical between builds
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    
+    try:
+        import brotli
+    except ImportError:
+        return
+    with open(path + '.br', 'wb') as f:
+        f.write(brotli.compress(data, quality=11))
+
+
+def iter_asset_sources(static_folder):
+    """Relative paths (with / separators) of the static files that get fingerprinted"""
+    for root, folders, files in os.walk(static_folder):
+        relative_root = os.path.relpath(root, static_folder)
+        if relative_root == '.':
+            folders[:] = [folder for folder in folders if folder not in ASSET_EXCLUDED_FOLDERS]
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in FINGERPRINT_EXTENSIONS:
+                relative = os.path.normpath(os.path.join(relative_root, name)).replace(os.sep, '/')
+                if relative != SERVICE_WORKER_SOURCE:
+                    yield relative
+
+
+def build_assets(static_folder, static_url_path='/static'):
+    """
+    Fingerprint every static asset into static/dist, precompress the text ones, write the
+    manifest and a service worker whose precache list comes from the same manifest.
+    Returns the manifest.
+    """
+    dist_folder = os.path.join(static_folder, ASSET_DIST_FOLDER)
+    if os.path.isdir(dist_folder):
+        shutil.rmtree(dist_folder)
+    os.makedirs(dist_folder)
+    
+    manifest = {}
+    for relative in iter_asset_sources(static_folder):
+        source = os.path.join(static_folder, relative)
+        hashed = fingerprinted_name(relative, _file_digest(source))
+        target = os.path.join(dist_folder, hashed)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copy2(source, target)
+        if os.path.splitext(relative)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+            _compress_variants(target)
+        manifest[relative] = f'{ASSET_DIST_FOLDER}/{hashed}'
+    
+    with open(os.path.join(dist_folder, ASSET_MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    
+    _build_service_worker(static_folder, dist_folder, manifest, static_url_path)
+    return manifest
+
+
+def _build_service_worker(static_folder, dist_folder, manifest, static_url_path):
+    """Prefix the service worker with the precache list and a version that changes with any asset"""
+    source = os.path.join(static_folder, SERVICE_WORKER_SOURCE)
+    if not os.path.exists(source):
+        return
+    
+    precache_urls = [f"{static_url_path}/{hashed}" for logical, hashed in sorted(manifest.items())
+                     if not logical.endswith('.map')]
+    version = hashlib.sha256(json.dumps(precache_urls).encode('utf-8')).hexdigest()[:12]
+    with open(source, 'r', encoding='utf-8') as f:
+        worker_source = f.read()
+    
+    target = os.path.join(dist_folder, SERVICE_WORKER_SOURCE)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'w', encoding='utf-8') as f:
+        f.write('// Generated by build_assets.py from the asset manifest; do not edit\n')
+        f.write(f"const PRECACHE_VERSION = '{version}';\n")
+        f.write(f"const PRECACHE_URLS = {json.dumps(precache_urls, indent=2)};\n\n")
+        f.write(worker_source)
+    _compress_variants(target)
+
+
+def load_asset_manifest(static_folder):
+    """The manifest written by build_assets, or {} when assets have not been built"""
+    try:
+        with open(os.path.join(static_folder, ASSET_DIST_FOLDER, ASSET_MANIFEST_NAME), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def init_assets(app):
+    """
+    Load the asset manifest and make url_for('static', filename=...) return the hashed file
+    for every built asset; anything else (e.g. uploads) is left as it is.
+    """
+    manifest = load_asset_manifest(app.static_folder)
+    app.extensions['asset_manifest'] = manifest
+    
+    @app.url_defaults
+    def fingerprint_static_urls(endpoint, values):
+        if endpoint == 'static' and manifest:
+            filename = values.get('filename')
+            if filename in manifest:
+                values['filename'] = manifest[filename]
+    
+    return manifest
+
+
+def built_service_worker(static_folder):
+    """The generated service worker if assets have been built, otherwise the source file"""
+    built = os.path.join(static_folder, ASSET_DIST_FOLDER, SERVICE_WORKER_SOURCE)
+    return built if os.path.isfile(built) else os.path.join(static_folder, SERVICE_WORKER_SOURCE)
+
+
+def precompressed_variant(path):
+    """(path, Content-Encoding) of the best precompressed variant the client accepts, or (path, None)"""
+    accepted = request.accept_encodings
+    for encoding, suffix in PRECOMPRESSED_ENCODINGS:
+        if accepted[encoding] and os.path.isfile(path + suffix):
+            return path + suffix, encoding
+    return path, None
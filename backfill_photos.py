@@ -0,0 +1,41 @@
+"""
+Photo variant backfill script
+Generates the thumbnail, ID card and print variants (JPEG and WebP) for photos in the local upload folder
+that were uploaded before upload processing was added. Original files are left untouched.
+
+Usage:
+    python backfill_photos.py              # photos without variants, one worker per CPU
+    python backfill_photos.py --force      # regenerate every variant
+    python backfill_photos.py --workers 2  # limit the worker pool
+"""
+import sys
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from image_uploads import find_photos, generate_photo_variants
+
+
+def main(argv):
+    from app import app
+    
+    force = '--force' in argv
+    workers = os.cpu_count() or 1
+    if '--workers' in argv:
+        workers = max(1, int(argv[argv.index('--workers') + 1]))
+    
+    photos = list(find_photos(app.config['UPLOAD_FOLDER']))
+    print(f"Found {len(photos)} photo(s) under {app.config['UPLOAD_FOLDER']}; processing with {workers} worker(s)...")
+    
+    written = 0
+    processed = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for count in executor.map(partial(generate_photo_variants, force=force), photos, chunksize=8):
+            written += count
+            processed += 1 if count else 0
+    
+    print(f"Done: variants written for {processed} photo(s) ({written} file(s)).")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
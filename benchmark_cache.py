@@ -0,0 +1,97 @@
+"""
+Cache backend benchmark
+Times get (hit and miss) and set on a plain dict, LocalCache and the shared SQLiteCache for a small
+value and a 20 KB HTML fragment, then runs several processes against the SQLite file at once to
+show throughput when every gunicorn worker shares it.
+
+Usage:
+    python benchmark_cache.py                  # 20,000 operations per test, 4 processes
+    python benchmark_cache.py --ops 5000 --processes 8
+"""
+import sys
+import os
+import tempfile
+import time
+from multiprocessing import get_context
+from cache import LocalCache, SQLiteCache
+
+
+class DictCache:
+    """Baseline: an unbounded dict without TTL"""
+    
+    def __init__(self):
+        self._entries = {}
+    
+    def get(self, key, default=None):
+        return self._entries.get(key, default)
+    
+    def set(self, key, value, ttl=None):
+        self._entries[key] = value
+
+
+VALUES = {
+    'small': {'sessions': ['2023/2024', '2024/2025'], 'terms': ['First Term', 'Second Term', 'Third Term']},
+    'fragment': '<tr><td>Learner</td><td>78.5</td><td>B</td></tr>' * 420,  # ~20 KB
+}
+
+
+def time_ops(cache, value, ops):
+    """Microseconds per set, per hit and per miss"""
+    keys = [f'bench:{i % 1000}' for i in range(ops)]
+    start = time.perf_counter()
+    for key in keys:
+        cache.set(key, value)
+    set_us = (time.perf_counter() - start) * 1e6 / ops
+    
+    start = time.perf_counter()
+    for key in keys:
+        cache.get(key)
+    hit_us = (time.perf_counter() - start) * 1e6 / ops
+    
+    start = time.perf_counter()
+    for i in range(ops):
+        cache.get(f'missing:{i}')
+    miss_us = (time.perf_counter() - start) * 1e6 / ops
+    return set_us, hit_us, miss_us
+
+
+def _worker(path, ops, seed):
+    """One process doing 90% reads and 10% writes on the shared file; returns operations per second"""
+    cache = SQLiteCache(path)
+    value = VALUES['small']
+    start = time.perf_counter()
+    for i in range(ops):
+        key = f'bench:{(i * 7 + seed) % 1000}'
+        if i % 10 == 0:
+            cache.set(key, value)
+        else:
+            cache.get(key)
+    return ops / (time.perf_counter() - start)
+
+
+def main(argv):
+    ops = 20000
+    processes = 4
+    if '--ops' in argv:
+        ops = max(100, int(argv[argv.index('--ops') + 1]))
+    if '--processes' in argv:
+        processes = max(1, int(argv[argv.index('--processes') + 1]))
+    
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'bench_cache.sqlite3')
+        print(f"{'Backend':<12} {'Value':<9} {'set us':>8} {'hit us':>8} {'miss us':>8}")
+        for name, factory in (('dict', DictCache), ('local', LocalCache), ('sqlite', lambda: SQLiteCache(path))):
+            for value_name, value in VALUES.items():
+                set_us, hit_us, miss_us = time_ops(factory(), value, ops)
+                print(f"{name:<12} {value_name:<9} {set_us:>8.1f} {hit_us:>8.1f} {miss_us:>8.1f}")
+        
+        print(f"\nSQLiteCache shared by {processes} process(es), 90% reads / 10% writes:")
+        with get_context('spawn').Pool(processes) as pool:
+            rates = pool.starmap(_worker, [(path, ops, seed) for seed in range(processes)])
+        print(f"  {sum(rates):,.0f} ops/s in total ({sum(rates) / processes:,.0f} per process)")
+    
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
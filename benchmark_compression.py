@@ -0,0 +1,84 @@
+"""
+Response compression benchmark
+Requests report pages and downloads as an admin through the full app (compression middleware
+included) with each Accept-Encoding, and prints bytes on the wire and CPU time per request, so
+COMPRESSION_GZIP_LEVEL / COMPRESSION_BROTLI_QUALITY can be tuned against the real data.
+
+Usage:
+    python benchmark_compression.py                           # default report routes, 5 rounds
+    python benchmark_compression.py --rounds 20 /reports/fees  # chosen routes
+"""
+import sys
+import time
+from compression import brotli
+
+
+DEFAULT_ROUTES = [
+    '/reports/learners',
+    '/reports/attendance',
+    '/reports/academic',
+    '/reports/report-cards',
+    '/reports/learners/download-csv',
+    '/reports/attendance/download-csv',
+    '/reports/fees/download-csv',
+    '/reports/report-cards/download-csv',
+]
+
+
+def measure(client, route, accept_encoding, rounds):
+    """(status, Content-Encoding, body bytes, CPU ms per request, wall ms per request)"""
+    headers = {'Accept-Encoding': accept_encoding}
+    response = None
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    for _ in range(rounds):
+        response = client.get(route, headers=headers)
+        body = response.get_data()
+    cpu = (time.process_time() - cpu_start) * 1000 / rounds
+    wall = (time.perf_counter() - wall_start) * 1000 / rounds
+    return response.status_code, response.headers.get('Content-Encoding', '-'), len(body), cpu, wall
+
+
+def main(argv):
+    from app import app
+    from models import User
+    
+    rounds = 5
+    if '--rounds' in argv:
+        index = argv.index('--rounds')
+        rounds = max(1, int(argv[index + 1]))
+        argv = argv[:index] + argv[index + 2:]
+    routes = argv or DEFAULT_ROUTES
+    
+    encodings = ['identity', 'gzip'] + (['br'] if brotli is not None else [])
+    if brotli is None:
+        print("brotli is not installed; measuring gzip only.")
+    
+    with app.app_context():
+        admin = User.query.filter_by(role='admin').first()
+        if admin is None:
+            print("No admin user found; run init_db.py first.")
+            return 1
+        admin_id = admin.id
+    
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(admin_id)
+        session['_fresh'] = True
+    
+    print(f"{'Route':<40} {'Encoding':<9} {'Status':>6} {'Bytes':>10} {'Ratio':>6} {'CPU ms':>8} {'+CPU ms':>8} {'Wall ms':>8}")
+    for route in routes:
+        client.get(route)  # warm up caches and imports
+        baseline = None
+        for encoding in encodings:
+            status, content_encoding, size, cpu, wall = measure(client, route, encoding, rounds)
+            if baseline is None:
+                baseline = (size, cpu)
+            ratio = size / baseline[0] if baseline[0] else 1
+            print(f"{route:<40} {content_encoding:<9} {status:>6} "
+                  f"{size:>10} {ratio:>6.2f} {cpu:>8.1f} {cpu - baseline[1]:>8.1f} {wall:>8.1f}")
+    
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,218 @@
+"""
+Worker model benchmark
+Starts gunicorn (gunicorn_config.py) once per WORKER_PROFILE against the configured database,
+drives it with logged-in clients for a fixed time and prints requests per second and p50/p99
+latency per route, so the sync, gthread and gevent profiles can be compared on the same data.
+Clients are split between the admin (report routes) and a parent and a learner (portal routes);
+the benchmark parent and learner accounts and their class are created if they do not exist.
+Requests follow a seeded random order, so runs with the same options send the same mix.
+
+Usage:
+    python benchmark_workers.py                                   # sync/gthread/gevent, 32 clients, 20 s each
+    python benchmark_workers.py --profiles gthread --threads 8 --clients 64
+    python benchmark_workers.py --username admin --password admin123 /dashboard /reports/fees   # admin only
+"""
+import sys
+import os
+import random
+import subprocess
+import threading
+import time
+import requests
+
+
+# Role -> routes its clients request; {class_id} is the benchmark learner's class
+DEFAULT_ROUTES = {
+    'admin': [
+        '/dashboard',
+        '/reports/academic',
+        '/reports/attendance',
+        '/reports/fees',
+        '/reports/analytics',
+        '/reports/fees/download-csv',
+        '/reports/report-cards/download-csv',
+    ],
+    'parent': [
+        '/parent',
+        '/timetables/view/{class_id}',
+    ],
+    'learner': [
+        '/learner/results',
+        '/learner/report-card',
+        '/timetables/view/{class_id}',
+    ],
+}
+
+# Accounts seeded for the portal clients
+PORTAL_USERS = {
+    'parent': ('bench_parent', 'bench_parent@example.invalid'),
+    'learner': ('bench_learner', 'bench_learner@example.invalid'),
+}
+PORTAL_PASSWORD = 'benchmark123'
+
+
+def option(argv, name, default):
+    """Remove '--name value' from argv and return the value converted like default"""
+    if name not in argv:
+        return default
+    index = argv.index(name)
+    value = argv.pop(index + 1)
+    argv.pop(index)
+    if isinstance(default, list):
+        return value.split(',')
+    return type(default)(value)
+
+
+def seed_portal_accounts():
+    """
+    Create the benchmark parent and learner (the parent's child) and a class for the learner
+    if they do not exist yet. Returns ({role: (username, password)}, class id).
+    """
+    from datetime import date
+    from app import app, db
+    from models import User, Learner, Class
+    
+    with app.app_context():
+        class_obj = Class.query.filter_by(status='active').order_by(Class.id).first()
+        if class_obj is None:
+            class_obj = Class(name='Benchmark Class', level='JSS 1')
+            db.session.add(class_obj)
+        
+        users = {}
+        for role, (username, email) in PORTAL_USERS.items():
+            user = User.query.filter_by(username=username).first()
+            if user is None:
+                user = User(username=username, email=email, role=role,
+                            first_name='Benchmark', last_name=role.title())
+                user.set_password(PORTAL_PASSWORD)
+                db.session.add(user)
+                db.session.flush()
+            users[role] = user
+        
+        if Learner.query.filter_by(user_id=users['learner'].id).first() is None:
+            db.session.add(Learner(
+                user_id=users['learner'].id, admission_number='BENCH-0001', date_of_birth=date(2012, 1, 1),
+                gender='Female', current_class=class_obj.name, status='active',
+                parent_name='Benchmark Parent', parent_email=users['parent'].email,
+            ))
+        db.session.commit()
+        return {role: (username, PORTAL_PASSWORD) for role, (username, _) in PORTAL_USERS.items()}, class_obj.id
+
+
+def start_server(profile, port, workers, threads):
+    """gunicorn with one worker profile; returns the process once it answers requests"""
+    env = dict(os.environ, PORT=str(port), WORKER_PROFILE=profile, WEB_CONCURRENCY=str(workers),
+               GUNICORN_THREADS=str(threads))
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn_config.py', 'app:app'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with code {process.returncode}')
+        try:
+            requests.get(f'http://127.0.0.1:{port}/login', timeout=2)
+            return process
+        except requests.RequestException:
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError('gunicorn did not start within 60 seconds')
+
+
+def client(base_url, username, password, routes, seed, stop_at, record_after, results):
+    """One logged-in browser requesting routes (labels and paths) in a seeded random order until stop_at"""
+    session = requests.Session()
+    try:
+        session.post(f'{base_url}/login', data={'username': username, 'password': password}, timeout=30)
+    except requests.RequestException:
+        pass  # Its requests are counted as errors
+    rng = random.Random(seed)
+    while time.perf_counter() < stop_at:
+        label, path = rng.choice(routes)
+        start = time.perf_counter()
+        try:
+            ok = session.get(f'{base_url}{path}', timeout=120).status_code == 200
+        except requests.RequestException:
+            ok = False
+        if start >= record_after:
+            results.append((label, time.perf_counter() - start, ok))
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def run_profile(profile, args, routes, logins):
+    process = start_server(profile, args['port'], args['workers'], args['threads'])
+    results = []
+    try:
+        base_url = f"http://127.0.0.1:{args['port']}"
+        record_after = time.perf_counter() + args['warmup']
+        stop_at = record_after + args['duration']
+        roles = list(routes)
+        clients = []
+        for seed in range(args['clients']):
+            # Clients take the roles in turn
+            role = roles[seed % len(roles)]
+            username, password = logins[role]
+            clients.append(threading.Thread(target=client, args=(base_url, username, password, routes[role],
+                                                                 seed, stop_at, record_after, results)))
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    
+    print(f"\n{profile} ({args['workers']} workers, {args['clients']} clients, {args['duration']} s)")
+    print(f"{'Route':<40} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    labels = list(dict.fromkeys(label for role_routes in routes.values() for label, _ in role_routes))
+    for route in labels + ['all']:
+        rows = [row for row in results if route in ('all', row[0])]
+        latencies = [row[1] * 1000 for row in rows]
+        errors = sum(1 for row in rows if not row[2])
+        print(f"{route:<40} {len(rows) / args['duration']:>8.1f} {percentile(latencies, 0.5):>8.1f} "
+              f"{percentile(latencies, 0.99):>8.1f} {errors:>7}")
+
+
+def main(argv):
+    argv = list(argv)
+    args = {
+        'profiles': option(argv, '--profiles', ['sync', 'gthread', 'gevent']),
+        'workers': option(argv, '--workers', 4),
+        'threads': option(argv, '--threads', 4),
+        'clients': option(argv, '--clients', 32),
+        'duration': option(argv, '--duration', 20),
+        'warmup': option(argv, '--warmup', 3),
+        'port': option(argv, '--port', 5055),
+        'username': option(argv, '--username', 'admin'),
+        'password': option(argv, '--password', 'admin123'),
+    }
+    logins = {'admin': (args['username'], args['password'])}
+    if argv:
+        routes = {'admin': argv}
+    else:
+        portal_logins, class_id = seed_portal_accounts()
+        logins.update(portal_logins)
+        routes = {role: [route.format(class_id=class_id) for route in role_routes]
+                  for role, role_routes in DEFAULT_ROUTES.items()}
+    # (label, path) per role; portal routes are labelled with their role
+    routes = {role: [(path if role == 'admin' else f'{role} {path}', path) for path in role_routes]
+              for role, role_routes in routes.items()}
+    
+    for profile in args['profiles']:
+        if profile == 'gevent':
+            try:
+                import gevent  # noqa: F401
+            except ImportError:
+                print('\ngevent: skipped (pip install gevent psycogreen)')
+                continue
+        run_profile(profile, args, routes, logins)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
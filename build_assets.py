@@ -0,0 +1,25 @@
+"""
+Static asset build script
+Copies CSS, JS, fonts and images from static/ to static/dist/ under content-hashed names,
+precompresses text assets (gzip, and brotli when the brotli package is installed), writes
+static/dist/assets-manifest.json and the service worker with its precache list.
+Run on every deploy, before starting the app; url_for('static', ...) falls back to the
+unhashed files when the build has not been run.
+
+Usage:
+    python build_assets.py
+"""
+import sys
+from assets import build_assets, ASSET_DIST_FOLDER
+
+
+def main():
+    from app import app
+    
+    manifest = build_assets(app.static_folder, app.static_url_path)
+    print(f"Built {len(manifest)} asset(s) into {app.static_folder}/{ASSET_DIST_FOLDER}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
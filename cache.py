@@ -0,0 +1,276 @@
+"""
+Application Cache for Wajina Suite
+A small get/set/delete cache interface with per-entry TTL and namespaces ('fragment:...',
+'lookup:...'). LocalCache lives in one process; SQLiteCache is one file shared by every gunicorn
+worker on the machine, for deployments where Redis is not available.
+"""
+
+from flask import current_app
+from collections import OrderedDict
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+
+def key_namespace(key):
+    """Namespace of a key: the part before the first ':'"""
+    return key.split(':', 1)[0] if ':' in key else ''
+
+
+class LocalCache:
+    """
+    In-process LRU cache with per-entry TTL. Each gunicorn worker keeps its own copy, so it suits
+    values keyed by data versions (a stale copy is simply never asked for again).
+    """
+    
+    def __init__(self, max_entries=1024, default_ttl=300):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.RLock()
+    
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return entry[1]
+    
+    def set(self, key, value, ttl=None):
+        """Store value for ttl seconds (default_ttl if None, forever if 0)"""
+        ttl = self.default_ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def add(self, key, value, ttl=None):
+        """Store value only if key is not cached yet; True if it was stored"""
+        with self._lock:
+            if self.get(key) is not None:
+                return False
+            self.set(key, value, ttl)
+            return True
+    
+    def incr(self, key, ttl=None):
+        """Add 1 to a counter, starting it at 1 for ttl seconds if missing; returns the new count"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (entry[0] is not None and entry[0] < time.monotonic()):
+                self.set(key, 1, ttl)
+                return 1
+            # The counter keeps the expiry of its first increment
+            self._entries[key] = (entry[0], entry[1] + 1)
+            return entry[1] + 1
+    
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+    
+    def delete_namespace(self, namespace):
+        """Drop every key in a namespace"""
+        with self._lock:
+            for key in [key for key in self._entries if key_namespace(key) == namespace]:
+                del self._entries[key]
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCache:
+    """
+    Cache shared by all worker processes through one SQLite file in WAL mode, so readers never
+    block each other or the writer. Values are pickled. Entries expire after their TTL and the
+    least recently used are evicted above max_entries / max_bytes. Database errors (e.g. a lock
+    held too long) count as a miss, so the cache can never fail a request.
+    """
+    
+    # Evict (and purge expired entries) once every this many sets per process
+    CULL_EVERY = 64
+    # A hot key's last-access stamp is refreshed at most this often, to keep reads read-only
+    ACCESS_RESOLUTION = 30
+    
+    def __init__(self, path, max_entries=10000, max_bytes=64 * 1024 * 1024, default_ttl=300):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self._local = threading.local()
+        self._sets = 0
+    
+    def _connection(self):
+        """One connection per thread and process (connections must not cross a fork)"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=2, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS cache_entries ('
+                'key TEXT PRIMARY KEY, namespace TEXT NOT NULL, value BLOB NOT NULL, '
+                'size INTEGER NOT NULL, expires_at REAL, accessed_at REAL NOT NULL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_cache_namespace ON cache_entries (namespace)')
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_cache_accessed ON cache_entries (accessed_at)')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+    
+    def get(self, key, default=None):
+        try:
+            connection = self._connection()
+            row = connection.execute(
+                'SELECT value, expires_at, accessed_at FROM cache_entries WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return default
+            now = time.time()
+            if row[1] is not None and row[1] < now:
+                connection.execute('DELETE FROM cache_entries WHERE key = ? AND expires_at < ?', (key, now))
+                return default
+            if now - row[2] > self.ACCESS_RESOLUTION:
+                connection.execute('UPDATE cache_entries SET accessed_at = ? WHERE key = ?', (now, key))
+            return pickle.loads(row[0])
+        except sqlite3.Error:
+            return default
+    
+    def _row(self, key, value, ttl):
+        ttl = self.default_ttl if ttl is None else ttl
+        now = time.time()
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        return (key, key_namespace(key), data, len(data), now + ttl if ttl else None, now)
+    
+    def set(self, key, value, ttl=None):
+        """Store value for ttl seconds (default_ttl if None, until evicted if 0)"""
+        try:
+            self._connection().execute(
+                'INSERT OR REPLACE INTO cache_entries (key, namespace, value, size, expires_at, accessed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)', self._row(key, value, ttl)
+            )
+        except sqlite3.Error:
+            return
+        self._sets += 1
+        if self._sets % self.CULL_EVERY == 0:
+            self.cull()
+    
+    def add(self, key, value, ttl=None):
+        """Store value only if key is not cached (or has expired), atomically across processes"""
+        try:
+            connection = self._connection()
+            connection.execute('DELETE FROM cache_entries WHERE key = ? AND expires_at < ?', (key, time.time()))
+            cursor = connection.execute(
+                'INSERT OR IGNORE INTO cache_entries (key, namespace, value, size, expires_at, accessed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)', self._row(key, value, ttl)
+            )
+            return cursor.rowcount == 1
+        except sqlite3.Error:
+            return False
+    
+    def incr(self, key, ttl=None):
+        """
+        Add 1 to a counter shared by all processes, starting it at 1 for ttl seconds if missing or
+        expired; returns the new count (0 if the database could not be reached)
+        """
+        try:
+            connection = self._connection()
+            # Write-locked from the read on, so concurrent increments are never lost
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                row = connection.execute('SELECT value, expires_at FROM cache_entries WHERE key = ?', (key,)).fetchone()
+                now = time.time()
+                if row is None or (row[1] is not None and row[1] < now):
+                    count = 1
+                    connection.execute(
+                        'INSERT OR REPLACE INTO cache_entries (key, namespace, value, size, expires_at, accessed_at) '
+                        'VALUES (?, ?, ?, ?, ?, ?)', self._row(key, count, ttl)
+                    )
+                else:
+                    count = pickle.loads(row[0]) + 1
+                    data = pickle.dumps(count, protocol=pickle.HIGHEST_PROTOCOL)
+                    connection.execute(
+                        'UPDATE cache_entries SET value = ?, size = ?, accessed_at = ? WHERE key = ?',
+                        (data, len(data), now, key)
+                    )
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+            return count
+        except sqlite3.Error:
+            return 0
+    
+    def delete(self, key):
+        try:
+            self._connection().execute('DELETE FROM cache_entries WHERE key = ?', (key,))
+        except sqlite3.Error:
+            pass
+    
+    def delete_namespace(self, namespace):
+        """Drop every key in a namespace, in every process"""
+        try:
+            self._connection().execute('DELETE FROM cache_entries WHERE namespace = ?', (namespace,))
+        except sqlite3.Error:
+            pass
+    
+    def clear(self):
+        try:
+            self._connection().execute('DELETE FROM cache_entries')
+        except sqlite3.Error:
+            pass
+    
+    def cull(self):
+        """Purge expired entries, then evict the least recently used down to 90% of the limits"""
+        try:
+            connection = self._connection()
+            connection.execute('DELETE FROM cache_entries WHERE expires_at < ?', (time.time(),))
+            count, total_bytes = connection.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries').fetchone()
+            if count <= self.max_entries and total_bytes <= self.max_bytes:
+                return
+            excess_entries = count - int(self.max_entries * 0.9)
+            excess_bytes = total_bytes - int(self.max_bytes * 0.9)
+            evict = []
+            for key, size in connection.execute('SELECT key, size FROM cache_entries ORDER BY accessed_at'):
+                if excess_entries <= 0 and excess_bytes <= 0:
+                    break
+                evict.append((key,))
+                excess_entries -= 1
+                excess_bytes -= size
+            connection.executemany('DELETE FROM cache_entries WHERE key = ?', evict)
+        except sqlite3.Error:
+            pass
+
+
+def create_cache(config):
+    """Cache backend for an app config (CACHE_BACKEND = 'sqlite' (shared) or 'local' (per process))"""
+    if config.get('CACHE_BACKEND', 'sqlite') == 'sqlite':
+        return SQLiteCache(
+            config.get('SHARED_CACHE_PATH', os.path.join('app_cache', 'shared_cache.sqlite3')),
+            max_entries=config.get('SHARED_CACHE_MAX_ENTRIES', 10000),
+            max_bytes=config.get('SHARED_CACHE_MAX_BYTES', 64 * 1024 * 1024),
+            default_ttl=config.get('CACHE_DEFAULT_TTL', 300),
+        )
+    return LocalCache(
+        max_entries=config.get('LOCAL_CACHE_MAX_ENTRIES', 1024),
+        default_ttl=config.get('CACHE_DEFAULT_TTL', 300),
+    )
+
+
+def get_cache():
+    """Cache of the current app, created once per process"""
+    cache = current_app.extensions.get('cache')
+    if cache is None:
+        cache = create_cache(current_app.config)
+        current_app.extensions['cache'] = cache
+    return cache
@@ -0,0 +1,174 @@
+"""
+Read replica routing check
+Builds a primary and a replica SQLite database in a temporary folder, with the same learner under
+different names and admission numbers in each, starts the app with DATABASE_REPLICA_URL pointing at
+the replica and checks from the data that comes back which database each read went to:
+- a @replica_reads() view (the fee Excel export) reads from the replica
+- a streamed export (the learners CSV, through replica_iter) reads from the replica
+- a background report card job reads from the replica
+- a write inside replica_reads() sends the rest of the block back to the primary
+- a browser that has just written reads from the primary for REPLICA_STICKY_SECONDS
+
+Usage:
+    python check_replicas.py
+    python check_replicas.py --keep     # leave the temporary databases in place
+"""
+import sys
+import os
+import io
+import shutil
+import sqlite3
+import tempfile
+import time
+import zipfile
+from datetime import date
+
+
+PRIMARY = ('Primary', 'P-001')
+REPLICA = ('Replica', 'R-001')
+
+
+def seen(text):
+    """Which database's copy of the learner appears in text"""
+    if REPLICA[1] in text:
+        return 'replica'
+    if PRIMARY[1] in text:
+        return 'primary'
+    return 'neither'
+
+
+def xlsx_text(data):
+    """All the XML of an .xlsx file, for searching cell values"""
+    with zipfile.ZipFile(io.BytesIO(data)) as workbook:
+        return ''.join(workbook.read(name).decode('utf-8', 'replace') for name in workbook.namelist()
+                       if name.endswith('.xml'))
+
+
+def main(argv):
+    keep = '--keep' in argv
+    folder = tempfile.mkdtemp(prefix='replica_check_')
+    primary_path = os.path.join(folder, 'primary.db')
+    replica_path = os.path.join(folder, 'replica.db')
+    
+    # The app reads its database URLs when it is imported
+    os.environ['DATABASE_URL'] = f'sqlite:///{primary_path}'
+    os.environ['DATABASE_REPLICA_URL'] = f'sqlite:///{replica_path}'
+    os.environ['SHARED_CACHE_PATH'] = os.path.join(folder, 'cache.sqlite3')
+    os.environ['REPORT_JOBS_FOLDER'] = os.path.join(folder, 'report_jobs')
+    os.environ['REPORT_CARD_CACHE_FOLDER'] = os.path.join(folder, 'report_cache')
+    
+    from app import app, db
+    import routes  # noqa: F401  (registers the views)
+    from flask import session as flask_session
+    from models import User, Learner, Fee, Subject, ReportJob
+    from replicas import replica_reads, replica_enabled
+    from report_cards import start_report_card_job
+    
+    problems = []
+    
+    def check(name, actual, expected):
+        print(f"{name:<52} {actual}")
+        if actual != expected:
+            problems.append(f'{name}: read from {actual}, expected {expected}')
+    
+    try:
+        with app.app_context():
+            if not replica_enabled():
+                print("FAILED: the replica bind is not configured")
+                return 1
+            user = User(username='replica_check', email='replica_check@example.invalid', role='learner',
+                        first_name=PRIMARY[0], last_name='Learner')
+            user.set_password('replica-check')
+            db.session.add(user)
+            db.session.flush()
+            learner = Learner(user_id=user.id, admission_number=PRIMARY[1], date_of_birth=date(2012, 1, 1),
+                              gender='Female', current_class='JSS 1')
+            db.session.add(learner)
+            db.session.flush()
+            db.session.add(Fee(learner_id=learner.id, fee_type='Tuition', amount=1000, due_date=date.today()))
+            db.session.commit()
+            learner_id, admin_id = learner.id, User.query.filter_by(username='admin').first().id
+            for engine in db.engines.values():
+                engine.dispose()
+        
+        # The replica starts as a copy of the primary, then differs in the learner's name and number
+        source = sqlite3.connect(primary_path)
+        target = sqlite3.connect(replica_path)
+        source.backup(target)
+        target.execute('UPDATE users SET first_name = ? WHERE username = ?', (REPLICA[0], 'replica_check'))
+        target.execute('UPDATE learners SET admission_number = ? WHERE id = ?', (REPLICA[1], learner_id))
+        target.commit()
+        target.close()
+        source.close()
+        
+        client = app.test_client()
+        response = client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        if response.status_code != 302:
+            print("FAILED: could not log in as the default admin")
+            return 1
+        
+        response = client.get('/reports/fees/download-xlsx')
+        check('@replica_reads() view (fee Excel export)', seen(xlsx_text(response.get_data())), 'replica')
+        
+        response = client.get('/reports/learners/download-csv')
+        check('replica_iter stream (learners CSV)', seen(response.get_data(as_text=True)), 'replica')
+        
+        with app.app_context():
+            job = start_report_card_job({'class': 'JSS 1', 'session': '', 'term': ''}, {}, admin_id, 'zip')
+            job_id = job.id
+            deadline = time.time() + 120
+            while True:
+                db.session.expire_all()
+                job = db.session.get(ReportJob, job_id)
+                if job.status in ('completed', 'failed') or time.time() > deadline:
+                    break
+                time.sleep(0.5)
+            if job.status == 'completed':
+                with zipfile.ZipFile(job.file_path) as archive:
+                    check('background report card job (ZIP)', seen(' '.join(archive.namelist())), 'replica')
+            else:
+                problems.append(f'background report card job did not complete: {job.status} {job.error_message or ""}')
+        
+        with app.app_context():
+            with replica_reads():
+                before = seen(db.session.get(Learner, learner_id).admission_number)
+                db.session.expunge_all()
+                db.session.add(Subject(name='Replica Check', code='RCHK'))
+                db.session.flush()
+                after = seen(db.session.get(Learner, learner_id).admission_number)
+            db.session.rollback()
+        check('replica_reads() block before a write', before, 'replica')
+        check('replica_reads() block after a write', after, 'primary')
+        
+        with app.test_request_context():
+            db.session.add(Subject(name='Replica Check', code='RCHK'))
+            db.session.commit()
+            sticky = flask_session.get('_primary_until', 0) > time.time()
+            Subject.query.filter_by(code='RCHK').delete()
+            db.session.commit()
+        check('commit in a request sets _primary_until', 'set' if sticky else 'not set', 'set')
+        with client.session_transaction() as browser_session:
+            browser_session['_primary_until'] = time.time() + app.config.get('REPLICA_STICKY_SECONDS', 5)
+        response = client.get('/reports/learners/download-csv')
+        check('stream inside the sticky window', seen(response.get_data(as_text=True)), 'primary')
+        
+        with app.app_context():
+            db.session.remove()
+            for engine in db.engines.values():
+                engine.dispose()
+    finally:
+        if keep:
+            print(f"Databases kept in {folder}")
+        else:
+            shutil.rmtree(folder, ignore_errors=True)
+    
+    if problems:
+        for problem in problems:
+            print(f"FAILED: {problem}")
+        return 1
+    print("OK: reads were routed as expected")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,171 @@
+"""
+Response Compression for Wajina Suite
+WSGI middleware that gzip- or brotli-compresses text responses (HTML report pages, CSV and JSON
+downloads) for clients that accept it. Small bodies and already-compressed formats (PDF, images,
+ZIP, XLSX) are passed through, and streamed responses are compressed chunk by chunk.
+"""
+
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_accept_header
+import zlib
+
+try:
+    import brotli
+except ImportError:  # optional; gzip only without it
+    brotli = None
+
+
+# Bodies smaller than this are sent as they are; compression would save little and cost a round of CPU
+MIN_COMPRESS_SIZE = 1024
+
+COMPRESSIBLE_TYPES = {
+    'application/javascript', 'application/json', 'application/manifest+json', 'application/xml',
+    'application/xhtml+xml', 'image/svg+xml',
+}
+
+# Statuses without a body to compress
+NO_BODY_STATUSES = {'204', '206', '304'}
+
+
+def choose_encoding(accept_encoding, brotli_available=None):
+    """'br', 'gzip' or None for an Accept-Encoding header (brotli wins a tie)"""
+    if brotli_available is None:
+        brotli_available = brotli is not None
+    accepted = parse_accept_header(accept_encoding)
+    candidates = [('br', accepted['br'])] if brotli_available else []
+    candidates.append(('gzip', accepted['gzip']))
+    encoding, quality = max(candidates, key=lambda candidate: candidate[1])
+    return encoding if quality > 0 else None
+
+
+def is_compressible(status, headers):
+    """True if a response (status line and Headers) should be compressed"""
+    if status.split(' ', 1)[0] in NO_BODY_STATUSES:
+        return False
+    if 'Content-Encoding' in headers or 'Content-Range' in headers:
+        return False
+    # Bodies handed to the proxy (X-Accel-Redirect / X-Sendfile) are not ours to compress
+    if 'X-Accel-Redirect' in headers or 'X-Sendfile' in headers:
+        return False
+    if 'no-transform' in headers.get('Cache-Control', ''):
+        return False
+    mimetype = headers.get('Content-Type', '').split(';', 1)[0].strip().lower()
+    return mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES
+
+
+class _GzipCompressor:
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    
+    def compress(self, data):
+        # A sync flush after each chunk lets streamed CSV rows reach the client as they are produced
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+    
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class _BrotliCompressor:
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+    
+    def compress(self, data):
+        return self._compressor.process(data) + self._compressor.flush()
+    
+    def finish(self):
+        return self._compressor.finish()
+
+
+class CompressionMiddleware:
+    """
+    Wrap a WSGI app (app.wsgi_app) to compress its text responses.
+    
+    The body is buffered only until min_size bytes have been produced: shorter responses go out
+    unchanged, longer ones (including streamed ones, which have no Content-Length) are compressed
+    incrementally. Compressed responses get Vary: Accept-Encoding and a weak ETag.
+    """
+    
+    def __init__(self, app, min_size=MIN_COMPRESS_SIZE, gzip_level=6, brotli_quality=4):
+        self.app = app
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+    
+    def compressor(self, encoding):
+        if encoding == 'br':
+            return _BrotliCompressor(self.brotli_quality)
+        return _GzipCompressor(self.gzip_level)
+    
+    def __call__(self, environ, start_response):
+        encoding = choose_encoding(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None or environ.get('REQUEST_METHOD') == 'HEAD':
+            return self.app(environ, start_response)
+        
+        response = {'written': []}
+        
+        def capture_start_response(status, headers, exc_info=None):
+            response.update(status=status, headers=headers, exc_info=exc_info)
+            return response['written'].append
+        
+        app_iter = self.app(environ, capture_start_response)
+        if ('status' in response and not response['written']
+                and not is_compressible(response['status'], Headers(response['headers']))):
+            # Returned as is, so file downloads keep the server's wsgi.file_wrapper (sendfile)
+            start_response(response['status'], response['headers'], response['exc_info'])
+            return app_iter
+        return self._iter_response(app_iter, response, encoding, start_response)
+    
+    def _iter_response(self, app_iter, response, encoding, start_response):
+        try:
+            chunks = iter(app_iter)
+            pending = response['written']
+            if 'status' not in response:
+                # Apps may call start_response lazily, when the first chunk is produced
+                pending.append(next(chunks, b''))
+            status, headers = response['status'], Headers(response['headers'])
+            
+            if not is_compressible(status, headers):
+                start_response(status, headers.to_wsgi_list(), response['exc_info'])
+                yield from pending
+                yield from chunks
+                return
+            
+            vary = headers.get('Vary', '')
+            if 'accept-encoding' not in vary.lower():
+                headers['Vary'] = f'{vary}, Accept-Encoding' if vary else 'Accept-Encoding'
+            
+            # Read ahead until the body is known to reach min_size (Content-Length settles it up front)
+            size = sum(len(chunk) for chunk in pending)
+            content_length = headers.get('Content-Length', type=int)
+            finished = content_length is not None and content_length < self.min_size
+            while size < self.min_size and not finished:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    finished = True
+                else:
+                    pending.append(chunk)
+                    size += len(chunk)
+            
+            if size < self.min_size:
+                start_response(status, headers.to_wsgi_list(), response['exc_info'])
+                yield from pending
+                yield from chunks
+                return
+            
+            compressor = self.compressor(encoding)
+            headers.remove('Content-Length')
+            headers['Content-Encoding'] = encoding
+            etag = headers.get('ETag')
+            if etag and not etag.startswith('W/'):
+                # The compressed bytes differ from the original, so the validator can no longer be strong
+                headers['ETag'] = 'W/' + etag
+            start_response(status, headers.to_wsgi_list(), response['exc_info'])
+            
+            yield compressor.compress(b''.join(pending))
+            for chunk in chunks:
+                if chunk:
+                    yield compressor.compress(chunk)
+            yield compressor.finish()
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
@@ -0,0 +1,145 @@
+"""
+Data Version Stamps for Wajina Suite
+Version counters per data scope ('learner:12', 'class:3', 'academics'), bumped in the same
+transaction as every ORM change to the rows they cover. Pages hash the counters they depend on
+into an ETag, so a repeated request can be answered with 304 before any heavy query runs.
+"""
+
+from database import db
+from models import DataVersion
+from sqlalchemy import event, inspect as sa_inspect, select, update
+from functools import lru_cache
+import hashlib
+import os
+
+
+# Model name -> (scope prefix, attribute) pairs; a change bumps '<prefix>:<attribute value>'
+SCOPED_MODELS = {
+    'Learner': (('learner', 'id'),),
+    'User': (('user', 'id'),),
+    'Fee': (('learner', 'learner_id'),),
+    'Attendance': (('learner', 'learner_id'),),
+    'ExamResult': (('learner', 'learner_id'),),
+    'TestResult': (('learner', 'learner_id'),),
+    'AssignmentResult': (('learner', 'learner_id'),),
+    'AcademicRecord': (('learner', 'learner_id'),),
+    'Class': (('class', 'id'),),
+    'SchoolTimetable': (('class', 'class_id'),),
+}
+
+# Models shown across many pages (subject names, assessment titles, teachers) share one scope each
+GLOBAL_SCOPES = {
+    'Subject': 'academics',
+    'Exam': 'academics',
+    'Test': 'academics',
+    'Assignment': 'academics',
+    'Staff': 'staff',
+}
+
+
+def scopes_for(obj):
+    """Scopes affected by a change to obj, including the old ones when a foreign key was changed"""
+    name = type(obj).__name__
+    if name in GLOBAL_SCOPES:
+        return {GLOBAL_SCOPES[name]}
+    scopes = set()
+    state = sa_inspect(obj)
+    for prefix, attribute in SCOPED_MODELS.get(name, ()):
+        for value in state.attrs[attribute].history.sum():
+            if value is not None:
+                scopes.add(f'{prefix}:{value}')
+    return scopes
+
+
+def bump_versions(connection, scopes):
+    """Increment the counters of scopes, creating missing ones, on the flushing connection"""
+    if not scopes:
+        return
+    table = DataVersion.__table__
+    # Sorted so concurrent transactions lock the rows in the same order
+    rows = [{'scope': scope, 'version': 1} for scope in sorted(scopes)]
+    dialect = connection.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(table).values(rows)
+        stmt = stmt.on_conflict_do_update(index_elements=['scope'], set_={'version': table.c.version + 1})
+        connection.execute(stmt)
+        return
+    
+    for row in rows:
+        result = connection.execute(
+            update(table).where(table.c.scope == row['scope']).values(version=table.c.version + 1)
+        )
+        if not result.rowcount:
+            connection.execute(table.insert().values(**row))
+
+
+def _after_flush(session, flush_context):
+    # new/dirty/deleted and attribute history still describe the flush that just ran
+    scopes = set()
+    for obj in session.new:
+        scopes |= scopes_for(obj)
+    for obj in session.deleted:
+        scopes |= scopes_for(obj)
+    for obj in session.dirty:
+        if session.is_modified(obj, include_collections=False):
+            scopes |= scopes_for(obj)
+    bump_versions(session.connection(), scopes)
+
+
+def track_data_versions(session=None):
+    """Bump data versions on every flush of session (db.session by default)"""
+    event.listen(session if session is not None else db.session, 'after_flush', _after_flush)
+
+
+def get_versions(scopes):
+    """Current counter of each scope (0 for scopes that have never changed), in order"""
+    scopes = list(scopes)
+    if not scopes:
+        return []
+    found = dict(db.session.execute(
+        select(DataVersion.scope, DataVersion.version).where(DataVersion.scope.in_(scopes))
+    ).all())
+    return [found.get(scope, 0) for scope in scopes]
+
+
+@lru_cache(maxsize=None)
+def code_version(root_path):
+    """
+    Identifies the deployed code and templates, so pages revalidate after a deploy.
+    APP_VERSION (or Render's RENDER_GIT_COMMIT) if set, otherwise a hash of the file stamps,
+    which every worker process computes the same way.
+    """
+    version = os.environ.get('APP_VERSION') or os.environ.get('RENDER_GIT_COMMIT')
+    if version:
+        return version
+    sha = hashlib.sha1()
+    folders = [(root_path, False), (os.path.join(root_path, 'templates'), True)]
+    for folder, recursive in folders:
+        for current, subfolders, files in os.walk(folder):
+            subfolders.sort()
+            for name in sorted(files):
+                if recursive or name.endswith('.py'):
+                    path = os.path.join(current, name)
+                    stat = os.stat(path)
+                    sha.update(f'{os.path.relpath(path, root_path)}:{stat.st_mtime_ns}:{stat.st_size};'.encode('utf-8'))
+            if not recursive:
+                break
+    manifest = os.path.join(root_path, 'static', 'dist', 'assets-manifest.json')
+    if os.path.exists(manifest):
+        sha.update(str(os.stat(manifest).st_mtime_ns).encode('utf-8'))
+    return sha.hexdigest()[:16]
+
+
+def versions_etag(scopes, *parts):
+    """ETag value for a page built from the data in scopes plus any other identifying parts"""
+    scopes = sorted(set(scopes))
+    sha = hashlib.sha1()
+    for part in parts:
+        sha.update(f'{part}\n'.encode('utf-8'))
+    for scope, version in zip(scopes, get_versions(scopes)):
+        sha.update(f'{scope}={version}\n'.encode('utf-8'))
+    return sha.hexdigest()
@@ -3,7 +3,27 @@ Database initialization for Wajina Suite
 """
 
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
 
-# Create db instance that will be shared across modules
-db = SQLAlchemy()
 
+class RoutingSession(Session):
+    """
+    Session that sends SELECTs to the 'replica' bind (DATABASE_REPLICA_URL) while
+    session.info['replica_reads'] is set (see replicas.replica_reads). Flushes and any other
+    statement go to the primary, and switch the session back to it for the rest of the block.
+    """
+    
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.info.get('replica_reads'):
+            if self._flushing or (clause is not None and not getattr(clause, 'is_select', False)):
+                # Read this session's own writes from the primary from now on
+                self.info['replica_reads'] = False
+            elif clause is not None:
+                replica = self._db.engines.get('replica')
+                if replica is not None:
+                    return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+# Create db instance that will be shared across modules
+db = SQLAlchemy(session_options={'class_': RoutingSession})
@@ -0,0 +1,158 @@
+"""
+Database Engine Profile for Wajina Suite
+Engine options matched to the gunicorn worker model (gunicorn_config.py). PostgreSQL gets a pool
+sized to the requests one worker serves at once, with pre-ping and recycling so connections the
+server dropped while idle are replaced before use. It also gets a statement timeout that is short
+for public pages and longer for staff pages and background report jobs. SQLite gets WAL,
+synchronous=NORMAL and memory-mapped reads. Pool checkout counters are kept per worker process.
+"""
+
+from database import db
+from flask import current_app, has_request_context, request
+from flask_login import current_user
+from sqlalchemy import event
+import os
+import threading
+import time
+
+
+# Roles whose requests get DB_STATEMENT_TIMEOUT; everyone else gets DB_REPORT_STATEMENT_TIMEOUT
+PUBLIC_ROLES = ('learner', 'parent')
+
+
+def engine_options(config):
+    """SQLALCHEMY_ENGINE_OPTIONS for the app config's database URL"""
+    database_url = config['SQLALCHEMY_DATABASE_URI']
+    if database_url.startswith('sqlite'):
+        # Seconds a write waits for another process's lock before failing
+        return {'connect_args': {'timeout': 15}}
+    
+    # Set by gunicorn_config.py: threads (gthread), greenlets (gevent) or 1 (sync) per worker
+    concurrency = int(os.environ.get('WORKER_CONCURRENCY', 1))
+    options = {
+        'pool_size': config.get('DB_POOL_SIZE') or min(concurrency + 1, 10),
+        'max_overflow': config.get('DB_MAX_OVERFLOW', 5),
+        'pool_timeout': config.get('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': config.get('DB_POOL_RECYCLE', 280),
+        'pool_pre_ping': True,
+    }
+    if database_url.startswith('postgresql') and config.get('DB_STATEMENT_TIMEOUT'):
+        options['connect_args'] = {'options': f"-c statement_timeout={int(config['DB_STATEMENT_TIMEOUT'] * 1000)}"}
+    return options
+
+
+class PoolMetrics:
+    """Checkout counters of one process's connection pool"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidated = 0
+        self.peak_checked_out = 0
+        self.held_seconds = 0.0
+        self._checked_out_at = {}
+    
+    def on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connects += 1
+    
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.checkouts += 1
+            self._checked_out_at[id(connection_record)] = time.perf_counter()
+            self.peak_checked_out = max(self.peak_checked_out, len(self._checked_out_at))
+    
+    def on_checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.checkins += 1
+            started = self._checked_out_at.pop(id(connection_record), None)
+            if started is not None:
+                self.held_seconds += time.perf_counter() - started
+    
+    def on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.invalidated += 1
+    
+    def snapshot(self, pool):
+        """Counters plus the pool's current state, as a dict"""
+        with self._lock:
+            data = {
+                'pid': os.getpid(),
+                'connects': self.connects,
+                'checkouts': self.checkouts,
+                'checkins': self.checkins,
+                'invalidated': self.invalidated,
+                'checked_out': len(self._checked_out_at),
+                'peak_checked_out': self.peak_checked_out,
+                'avg_held_ms': round(self.held_seconds * 1000 / self.checkins, 2) if self.checkins else 0.0,
+            }
+        for name in ('size', 'checkedin', 'overflow'):
+            if hasattr(pool, name):
+                data[f'pool_{name}'] = getattr(pool, name)()
+        return data
+
+
+def _sqlite_pragmas(mmap_size):
+    """connect listener setting the per-connection SQLite pragmas"""
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            # WAL lets readers run while a worker writes; NORMAL only syncs at checkpoints in WAL mode
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
+            cursor.execute(f'PRAGMA mmap_size={int(mmap_size)}')
+        finally:
+            cursor.close()
+    return set_pragmas
+
+
+def _apply_statement_timeout(session, transaction, connection):
+    if connection.dialect.name != 'postgresql':
+        return
+    if has_request_context():
+        timeout = session.info.get('statement_timeout')
+    else:
+        # Background jobs and scripts run reports
+        timeout = current_app.config.get('DB_REPORT_STATEMENT_TIMEOUT')
+    if timeout:
+        connection.exec_driver_sql(f'SET LOCAL statement_timeout = {int(timeout * 1000)}')
+
+
+def _staff_statement_timeout():
+    if request.endpoint in ('static', 'fingerprinted_asset') or not current_user.is_authenticated:
+        return
+    if current_user.role in PUBLIC_ROLES:
+        return
+    timeout = current_app.config.get('DB_REPORT_STATEMENT_TIMEOUT')
+    db.session.info['statement_timeout'] = timeout
+    # Loading current_user may already have begun the request's transaction
+    if timeout and db.session.in_transaction():
+        db.session.connection().exec_driver_sql(f'SET LOCAL statement_timeout = {int(timeout * 1000)}')
+
+
+def init_db_engine(app):
+    """Install the engine event hooks; call after db.init_app(app)"""
+    with app.app_context():
+        engine = db.engine
+        engines = list(db.engines.values())
+    for bind_engine in engines:
+        # The primary and any read replica
+        if bind_engine.dialect.name == 'sqlite':
+            event.listen(bind_engine, 'connect', _sqlite_pragmas(app.config.get('SQLITE_MMAP_MB', 256) * 1024 * 1024))
+    if any(bind_engine.dialect.name == 'postgresql' for bind_engine in engines):
+        event.listen(db.session, 'after_begin', _apply_statement_timeout)
+        app.before_request(_staff_statement_timeout)
+    
+    metrics = PoolMetrics()
+    event.listen(engine, 'connect', metrics.on_connect)
+    event.listen(engine, 'checkout', metrics.on_checkout)
+    event.listen(engine, 'checkin', metrics.on_checkin)
+    event.listen(engine, 'invalidate', metrics.on_invalidate)
+    app.extensions['pool_metrics'] = metrics
+
+
+def pool_metrics():
+    """Pool counters of the current worker process"""
+    return current_app.extensions['pool_metrics'].snapshot(db.engine.pool)
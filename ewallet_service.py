@@ -0,0 +1,298 @@
+"""
+E-Wallet Ledger Service for Wajina Suite
+Applies wallet balance movements atomically in the database
+"""
+
+from database import db
+from models import EWallet, EWalletTransaction, EWalletDailyTotal
+from sqlalchemy import update
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
+
+
+# Transaction types with a running total column on EWallet
+WALLET_TOTAL_COLUMNS = {
+    'deposit': 'total_deposits',
+    'withdrawal': 'total_withdrawals',
+    'payment': 'total_payments',
+}
+
+
+class InsufficientFundsError(Exception):
+    """Raised when a debit would take a wallet balance below zero"""
+    pass
+
+
+class TransactionAlreadyProcessedError(Exception):
+    """Raised when a pending wallet transaction has already been settled"""
+    pass
+
+
+def to_amount(value):
+    """Convert a float/str/Decimal amount to a 2dp Decimal"""
+    return Decimal(str(value)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def _apply_balance_change(ewallet_id, delta, require_funds=False, completed_type=None, amount=None):
+    """
+    Move a wallet balance by delta in a single UPDATE statement and return the new balance.
+    With require_funds, the update only matches when the balance covers the debit, so two
+    concurrent debits can never both succeed against the same funds.
+    completed_type bumps the matching running total column by amount in the same statement.
+    """
+    values = {
+        'balance': EWallet.balance + delta,
+        'updated_at': datetime.utcnow()
+    }
+    total_column = WALLET_TOTAL_COLUMNS.get(completed_type)
+    if total_column:
+        values[total_column] = getattr(EWallet, total_column) + amount
+
+    stmt = update(EWallet).where(EWallet.id == ewallet_id)
+    if require_funds:
+        stmt = stmt.where(EWallet.balance >= -delta)
+    stmt = stmt.values(**values).execution_options(synchronize_session=False)
+
+    if db.engine.dialect.update_returning:
+        new_balance = db.session.execute(stmt.returning(EWallet.balance)).scalar()
+    else:
+        # Older SQLite without RETURNING - the UPDATE already holds the row/write lock
+        # for this transaction, so reading it back straight away is still consistent
+        result = db.session.execute(stmt)
+        new_balance = None
+        if result.rowcount:
+            new_balance = db.session.execute(
+                db.select(EWallet.balance).where(EWallet.id == ewallet_id)
+            ).scalar()
+
+    if new_balance is None:
+        if require_funds:
+            raise InsufficientFundsError('Insufficient wallet balance')
+        raise ValueError(f'E-wallet {ewallet_id} not found')
+
+    new_balance = to_amount(new_balance)
+
+    # Keep any EWallet already loaded in this session in step with the database
+    cached = db.session.identity_map.get(identity_key(EWallet, ewallet_id))
+    if cached is not None:
+        set_committed_value(cached, 'balance', new_balance)
+        if total_column:
+            db.session.expire(cached, [total_column])
+
+    return new_balance
+
+
+def _add_to_daily_total(day, transaction_type, amount):
+    """Upsert the school-wide daily total for a completed transaction"""
+    dialect = db.engine.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(EWalletDailyTotal).values(
+            day=day, transaction_type=transaction_type,
+            total_amount=amount, transaction_count=1
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['day', 'transaction_type'],
+            set_={
+                'total_amount': EWalletDailyTotal.total_amount + stmt.excluded.total_amount,
+                'transaction_count': EWalletDailyTotal.transaction_count + 1
+            }
+        )
+        db.session.execute(stmt)
+        return
+
+    result = db.session.execute(
+        update(EWalletDailyTotal)
+        .where(EWalletDailyTotal.day == day, EWalletDailyTotal.transaction_type == transaction_type)
+        .values(
+            total_amount=EWalletDailyTotal.total_amount + amount,
+            transaction_count=EWalletDailyTotal.transaction_count + 1
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if not result.rowcount:
+        db.session.add(EWalletDailyTotal(day=day, transaction_type=transaction_type,
+                                         total_amount=amount, transaction_count=1))
+
+
+def _record_transaction(ewallet_id, user_id, transaction_type, amount, balance_after, delta, **fields):
+    """Add the ledger row for a balance movement to the current session"""
+    transaction = EWalletTransaction(
+        ewallet_id=ewallet_id,
+        user_id=user_id,
+        transaction_type=transaction_type,
+        amount=amount,
+        balance_before=balance_after - delta,
+        balance_after=balance_after,
+        currency=fields.pop('currency', 'NGN'),
+        status=fields.pop('status', 'completed'),
+        **fields
+    )
+    db.session.add(transaction)
+    return transaction
+
+
+def credit_wallet(ewallet, amount, transaction_type='deposit', **fields):
+    """
+    Credit a wallet and record the transaction in the current database transaction.
+    The caller is responsible for committing.
+    """
+    amount = to_amount(amount)
+    if amount <= 0:
+        raise ValueError('Amount must be greater than zero')
+
+    completed = fields.get('status', 'completed') == 'completed'
+    balance_after = _apply_balance_change(ewallet.id, amount,
+                                          completed_type=transaction_type if completed else None,
+                                          amount=amount)
+    transaction = _record_transaction(ewallet.id, ewallet.user_id, transaction_type, amount,
+                                      balance_after, amount, **fields)
+    if completed:
+        _add_to_daily_total(datetime.utcnow().date(), transaction_type, amount)
+    return transaction
+
+
+def debit_wallet(ewallet, amount, transaction_type='payment', **fields):
+    """
+    Debit a wallet if it has enough funds and record the transaction in the current
+    database transaction. Raises InsufficientFundsError otherwise. The caller commits.
+    """
+    amount = to_amount(amount)
+    if amount <= 0:
+        raise ValueError('Amount must be greater than zero')
+
+    completed = fields.get('status', 'completed') == 'completed'
+    balance_after = _apply_balance_change(ewallet.id, -amount, require_funds=True,
+                                          completed_type=transaction_type if completed else None,
+                                          amount=amount)
+    transaction = _record_transaction(ewallet.id, ewallet.user_id, transaction_type, amount,
+                                      balance_after, -amount, **fields)
+    if completed:
+        _add_to_daily_total(datetime.utcnow().date(), transaction_type, amount)
+    return transaction
+
+
+def complete_pending_deposit(transaction, amount, flutterwave_tx_id=None):
+    """
+    Settle a pending gateway deposit exactly once.
+    The pending -> completed transition is claimed with a conditional UPDATE so the
+    webhook and the verify-payment redirect cannot both credit the same deposit.
+    """
+    amount = to_amount(amount)
+    claim = db.session.execute(
+        update(EWalletTransaction)
+        .where(EWalletTransaction.id == transaction.id, EWalletTransaction.status == 'pending')
+        .values(status='completed', updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    if claim.rowcount != 1:
+        raise TransactionAlreadyProcessedError(f'Transaction {transaction.transaction_reference} already processed')
+
+    balance_after = _apply_balance_change(transaction.ewallet_id, amount,
+                                          completed_type=transaction.transaction_type, amount=amount)
+    created_day = transaction.created_at.date() if transaction.created_at else datetime.utcnow().date()
+    _add_to_daily_total(created_day, transaction.transaction_type, amount)
+
+    set_committed_value(transaction, 'status', 'completed')
+    transaction.amount = amount
+    transaction.balance_before = balance_after - amount
+    transaction.balance_after = balance_after
+    if flutterwave_tx_id:
+        transaction.flutterwave_tx_id = str(flutterwave_tx_id)
+
+    return transaction
+
+
+def _as_date(value):
+    """func.date() returns a string on SQLite and a date on PostgreSQL"""
+    if isinstance(value, str):
+        return datetime.strptime(value[:10], '%Y-%m-%d').date()
+    return value
+
+
+def compute_wallet_totals():
+    """Recompute per-wallet and daily totals from the transaction history"""
+    wallet_totals = {}
+    rows = db.session.query(
+        EWalletTransaction.ewallet_id,
+        EWalletTransaction.transaction_type,
+        db.func.sum(EWalletTransaction.amount)
+    ).filter(
+        EWalletTransaction.status == 'completed',
+        EWalletTransaction.transaction_type.in_(list(WALLET_TOTAL_COLUMNS))
+    ).group_by(EWalletTransaction.ewallet_id, EWalletTransaction.transaction_type).all()
+    for ewallet_id, transaction_type, total in rows:
+        wallet_totals.setdefault(ewallet_id, {})[WALLET_TOTAL_COLUMNS[transaction_type]] = to_amount(total or 0)
+
+    day_column = db.func.date(EWalletTransaction.created_at)
+    daily_totals = {}
+    rows = db.session.query(
+        day_column,
+        EWalletTransaction.transaction_type,
+        db.func.sum(EWalletTransaction.amount),
+        db.func.count(EWalletTransaction.id)
+    ).filter(
+        EWalletTransaction.status == 'completed'
+    ).group_by(day_column, EWalletTransaction.transaction_type).all()
+    for day, transaction_type, total, count in rows:
+        daily_totals[(_as_date(day), transaction_type)] = (to_amount(total or 0), count)
+
+    return wallet_totals, daily_totals
+
+
+def verify_wallet_totals():
+    """Compare maintained totals against the transaction history and return a list of mismatches"""
+    wallet_totals, daily_totals = compute_wallet_totals()
+    mismatches = []
+
+    for ewallet in EWallet.query.all():
+        expected = wallet_totals.get(ewallet.id, {})
+        for column in WALLET_TOTAL_COLUMNS.values():
+            stored = to_amount(getattr(ewallet, column) or 0)
+            computed = expected.get(column, Decimal('0.00'))
+            if stored != computed:
+                mismatches.append(f'EWallet {ewallet.id} {column}: stored {stored}, computed {computed}')
+
+    stored_daily = {
+        (row.day, row.transaction_type): (to_amount(row.total_amount or 0), row.transaction_count or 0)
+        for row in EWalletDailyTotal.query.all()
+    }
+    for key in sorted(set(stored_daily) | set(daily_totals), key=lambda k: (k[0], k[1])):
+        stored = stored_daily.get(key, (Decimal('0.00'), 0))
+        computed = daily_totals.get(key, (Decimal('0.00'), 0))
+        if stored != computed:
+            mismatches.append(f'Daily total {key[0]} {key[1]}: stored {stored}, computed {computed}')
+
+    return mismatches
+
+
+def rebuild_wallet_totals():
+    """Rewrite all maintained totals from the transaction history. The caller commits."""
+    wallet_totals, daily_totals = compute_wallet_totals()
+
+    for ewallet in EWallet.query.with_for_update().all():
+        expected = wallet_totals.get(ewallet.id, {})
+        for column in WALLET_TOTAL_COLUMNS.values():
+            setattr(ewallet, column, expected.get(column, Decimal('0.00')))
+
+    EWalletDailyTotal.query.delete(synchronize_session=False)
+    for (day, transaction_type), (total, count) in daily_totals.items():
+        db.session.add(EWalletDailyTotal(day=day, transaction_type=transaction_type,
+                                         total_amount=total, transaction_count=count))
+
+
+def get_wallet_totals_summary(since=None):
+    """Sum the daily totals table by transaction type, optionally from a start date"""
+    query = db.session.query(
+        EWalletDailyTotal.transaction_type,
+        db.func.sum(EWalletDailyTotal.total_amount)
+    )
+    if since:
+        query = query.filter(EWalletDailyTotal.day >= since)
+    return {transaction_type: float(total or 0)
+            for transaction_type, total in query.group_by(EWalletDailyTotal.transaction_type).all()}
@@ -0,0 +1,70 @@
+"""
+File Delivery for Wajina Suite
+Hands file downloads to the reverse proxy (nginx X-Accel-Redirect, Apache/lighttpd X-Sendfile)
+once the view has checked permissions, so web workers are not tied up streaming bytes to slow clients
+"""
+
+from flask import current_app, send_file
+from werkzeug.exceptions import NotFound
+from urllib.parse import quote
+import mimetypes
+import os
+
+
+def parse_accel_map(value):
+    """
+    Parse X_ACCEL_REDIRECT_MAP: comma-separated 'local folder=internal URI prefix' pairs,
+    e.g. '/app/static=/_static,/app/report_jobs=/_protected/report_jobs'
+    """
+    mappings = []
+    for item in (value or '').split(','):
+        if '=' not in item:
+            continue
+        folder, uri = item.split('=', 1)
+        folder, uri = folder.strip(), uri.strip()
+        if folder and uri:
+            mappings.append((os.path.abspath(folder), '/' + uri.strip('/')))
+    # Longest folder first, so nested folders win over their parents
+    return sorted(mappings, key=lambda mapping: len(mapping[0]), reverse=True)
+
+
+def accel_redirect_uri(path, mappings):
+    """Internal nginx URI for an absolute path, or None if no mapped folder contains it"""
+    for folder, uri in mappings:
+        if os.path.commonpath([path, folder]) == folder:
+            relative = os.path.relpath(path, folder).replace(os.sep, '/')
+            return f'{uri}/{quote(relative)}'
+    return None
+
+
+def send_local_file(path, mimetype=None, as_attachment=False, download_name=None, max_age=None):
+    """
+    Send a file from local disk (404 if it does not exist).
+    
+    With FILE_DELIVERY = 'x-accel-redirect' and the file inside a folder listed in
+    X_ACCEL_REDIRECT_MAP, only headers are returned and nginx serves the file from an internal
+    location. With 'x-sendfile', Werkzeug's X-Sendfile support (USE_X_SENDFILE) is used.
+    Otherwise the file is streamed by send_file with conditional and Range request support.
+    """
+    path = os.path.abspath(path)
+    if not os.path.isfile(path):
+        raise NotFound()
+    mimetype = mimetype or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    
+    if current_app.config.get('FILE_DELIVERY') == 'x-accel-redirect':
+        uri = accel_redirect_uri(path, current_app.config.get('X_ACCEL_REDIRECT_MAPPINGS', []))
+        if uri:
+            # nginx keeps Content-Type, Content-Disposition and Cache-Control from this response
+            response = current_app.response_class(mimetype=mimetype)
+            response.headers['X-Accel-Redirect'] = uri
+            response.headers.set('Content-Disposition', 'attachment' if as_attachment else 'inline',
+                                 filename=download_name or os.path.basename(path))
+            if max_age:
+                response.cache_control.public = True
+                response.cache_control.max_age = max_age
+            else:
+                response.cache_control.no_cache = True
+            return response
+    
+    return send_file(path, mimetype=mimetype, as_attachment=as_attachment, download_name=download_name,
+                     max_age=max_age, conditional=True)
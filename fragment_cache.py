@@ -0,0 +1,56 @@
+"""
+Template Fragment Cache for Wajina Suite
+A {% cache key, ttl %} ... {% endcache %} Jinja tag that stores the rendered HTML of a template
+section in the app cache. Keys should include the data versions the section is built from:
+
+    {% cache ('timetable-grid', timetable_cache_key) %}
+        ... timetable table ...
+    {% endcache %}
+
+The deployed code version is added to every key, so template changes never serve old HTML.
+"""
+
+from cache import get_cache
+from data_versions import code_version, versions_etag
+from flask import current_app
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+import hashlib
+
+
+def fragment_key(key):
+    """Cache key of a fragment: the template's key (any repr-able value) plus the code version"""
+    digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+    return f'fragment:{code_version(current_app.root_path)}:{digest}'
+
+
+def version_key(*scopes):
+    """Stamp of the data versions of scopes, for fragment keys: {% cache ('grid', version_key('class:3')) %}"""
+    return versions_etag(scopes)
+
+
+class FragmentCacheExtension(Extension):
+    """{% cache key[, ttl] %}...{% endcache %}; ttl defaults to FRAGMENT_CACHE_TTL seconds"""
+    
+    tags = {'cache'}
+    
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        if parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        else:
+            args.append(nodes.Const(None))
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render_cached', args), [], [], body).set_lineno(lineno)
+    
+    def _render_cached(self, key, ttl, caller):
+        cache = get_cache()
+        cache_key = fragment_key(key)
+        html = cache.get(cache_key)
+        if html is None:
+            html = str(caller())
+            cache.set(cache_key, html, ttl if ttl is not None else current_app.config.get('FRAGMENT_CACHE_TTL'))
+        # The body was escaped when it was rendered
+        return Markup(html)
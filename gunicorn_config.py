@@ -8,10 +8,32 @@ backlog = 2048
 
 # Worker processes
 # Use 2-4 workers for most applications, adjust based on load
-workers = min(multiprocessing.cpu_count() * 2 + 1, 4)
-worker_class = 'sync'
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 4)))
+
+# Worker model (WORKER_PROFILE), compare them with: python benchmark_workers.py
+#   gthread - several threads per process, so slow SMTP/payment calls and PDF builds don't block
+#             the worker's other requests (default)
+#   gevent  - green threads for many concurrent I/O-bound requests; needs gevent and psycogreen
+#   sync    - one request per process at a time
+worker_profile = os.environ.get('WORKER_PROFILE', 'gthread')
+threads = 1
 worker_connections = 1000
-timeout = 120  # Increased for file uploads and long-running requests
+if worker_profile == 'gevent':
+    worker_class = 'gevent'
+    worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+    worker_concurrency = worker_connections
+elif worker_profile == 'gthread':
+    worker_class = 'gthread'
+    threads = int(os.environ.get('GUNICORN_THREADS', 4))
+    worker_concurrency = threads
+else:
+    worker_class = 'sync'
+    worker_concurrency = 1
+# Read by app.py to size each worker's database connection pool
+os.environ['WORKER_PROFILE'] = worker_profile
+os.environ['WORKER_CONCURRENCY'] = str(worker_concurrency)
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))  # Increased for file uploads and long-running requests
 keepalive = 5
 
 # Logging
@@ -31,6 +53,19 @@ user = None
 group = None
 tmp_upload_dir = None
 
+
+def post_fork(server, worker):
+    """Let psycopg2 yield to other greenlets while it waits on PostgreSQL"""
+    if worker_class != 'gevent':
+        return
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        server.log.warning('psycogreen is not installed; database queries will block the whole gevent worker')
+        return
+    patch_psycopg()
+
+
 # SSL (if needed)
 # keyfile = None
 # certfile = None
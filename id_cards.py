@@ -0,0 +1,393 @@
+"""
+Batch ID Card Sheets for Wajina Suite
+Draws print-ready A4 sheets of CR80 ID cards for a class or department with ReportLab
+"""
+
+from database import db
+from models import Learner, Staff, User
+from pdf_theme import get_logo
+from qr_codes import get_qr_png
+from image_uploads import photo_path
+from report_utils import render_pool, merge_pdfs, REPORT_CARD_MAX_WORKERS
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas as pdf_canvas
+from concurrent.futures import as_completed
+from functools import lru_cache
+from io import BytesIO
+import os
+
+
+# CR80 (credit card) size, landscape
+CARD_WIDTH = 85.6 * mm
+CARD_HEIGHT = 53.98 * mm
+# Space between cards on the sheet, for cutting
+CARD_GAP = 4 * mm
+SHEET_MARGIN = 8 * mm
+CROP_MARK_LENGTH = 3 * mm
+
+# Cards per rendering task: whole pages, so every task draws full sheets
+ID_CARD_PAGES_PER_CHUNK = 10
+
+# Photos and QR codes are decoded at print resolution, not at the uploaded size
+PRINT_DPI = 300
+
+# Decoded images kept per process; a sheet run touches each learner's photo and QR once,
+# so these mostly pay off when the same class is printed again
+PHOTO_CACHE_SIZE = 512
+QR_CACHE_SIZE = 2048
+
+
+def sheet_layout(columns=2, rows=5):
+    """Card grid for one A4 sheet, clamped to what fits on the page"""
+    page_width, page_height = A4
+    max_columns = int((page_width - 2 * SHEET_MARGIN + CARD_GAP) // (CARD_WIDTH + CARD_GAP))
+    max_rows = int((page_height - 2 * SHEET_MARGIN + CARD_GAP) // (CARD_HEIGHT + CARD_GAP))
+    columns = max(1, min(int(columns), max_columns))
+    rows = max(1, min(int(rows), max_rows))
+    
+    grid_width = columns * CARD_WIDTH + (columns - 1) * CARD_GAP
+    grid_height = rows * CARD_HEIGHT + (rows - 1) * CARD_GAP
+    return {
+        'columns': columns,
+        'rows': rows,
+        'left': (page_width - grid_width) / 2,
+        'top': page_height - (page_height - grid_height) / 2,
+    }
+
+
+def _pixels(points):
+    return max(1, int(round(points * PRINT_DPI / 72.0)))
+
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def get_qr_image(data, folder=None):
+    """QR code for data as a decoded ImageReader, from the QR code cache in folder"""
+    from PIL import Image as PILImage
+    
+    # Greyscale keeps the embedded image a third of the size of the RGB default
+    image = PILImage.open(BytesIO(get_qr_png(data, folder=folder))).convert('L')
+    reader = ImageReader(image)
+    reader.getRGBData()
+    return reader
+
+
+@lru_cache(maxsize=PHOTO_CACHE_SIZE)
+def _load_photo(path, mtime, width_px, height_px):
+    """Photo cropped to the card's photo box and scaled to print resolution"""
+    from PIL import Image as PILImage, ImageOps
+    
+    with PILImage.open(path) as image:
+        # Let the JPEG decoder skip straight to a reduced scale; phone photos are far larger than needed
+        image.draft('RGB', (width_px, height_px))
+        image = ImageOps.exif_transpose(image)
+        image = ImageOps.fit(image.convert('RGB'), (width_px, height_px), PILImage.LANCZOS)
+    reader = ImageReader(image)
+    reader.getRGBData()
+    return reader
+
+
+def get_photo(storage, key, width, height):
+    """ImageReader for a stored photo drawn at width x height points, or None if it cannot be read"""
+    if not key or storage is None:
+        return None
+    try:
+        # Remote backends download the file once into their local cache
+        path = storage.local_path(key)
+        if not path:
+            return None
+        mtime = os.stat(path).st_mtime
+        return _load_photo(path, mtime, _pixels(width), _pixels(height))
+    except Exception as e:
+        print(f"Error loading ID card photo {key}: {e}")
+        return None
+
+
+def _fit_font_size(text, font_name, font_size, max_width, min_size=5):
+    """Largest font size up to font_size at which text fits max_width"""
+    width = stringWidth(text, font_name, font_size)
+    if width <= max_width:
+        return font_size
+    return max(min_size, font_size * max_width / width)
+
+
+def _truncate(text, font_name, font_size, max_width):
+    if stringWidth(text, font_name, font_size) <= max_width:
+        return text
+    while text and stringWidth(text + '...', font_name, font_size) > max_width:
+        text = text[:-1]
+    return text + '...'
+
+
+def _draw_card(c, x, y, card, school_info, card_settings, title, qr_folder=None, storage=None):
+    """Draw one card with its bottom-left corner at (x, y)"""
+    # Card settings are in CSS pixels for the on-screen card; scale them to the printed width
+    scale = CARD_WIDTH / float(card_settings.get('width') or 500)
+    padding = 2.5 * mm
+    radius = min(card_settings.get('border_radius', 15) * scale, 4 * mm)
+    border_width = card_settings.get('border_width', 3) * scale
+    
+    c.saveState()
+    path = c.beginPath()
+    path.roundRect(x, y, CARD_WIDTH, CARD_HEIGHT, radius)
+    c.clipPath(path, stroke=0)
+    c.setFillColor(colors.HexColor(card_settings.get('bg_color', '#ffffff')))
+    c.rect(x, y, CARD_WIDTH, CARD_HEIGHT, stroke=0, fill=1)
+    
+    # Header band: logo, school name and card title
+    title_size = card_settings.get('header_title_size', 21) * scale
+    subtitle_size = card_settings.get('header_subtitle_size', 14) * scale
+    logo = get_logo(school_info.get('logo_path', ''))
+    logo_size = card_settings.get('logo_height', 60) * scale
+    header_height = max(logo_size if logo else 0, title_size + subtitle_size + 1 * mm) + 2 * mm
+    header_bottom = y + CARD_HEIGHT - header_height
+    c.setFillColor(colors.HexColor(card_settings.get('header_bg_color', '#32CD32')))
+    c.rect(x, header_bottom, CARD_WIDTH, header_height, stroke=0, fill=1)
+    
+    text_left = x + padding
+    if logo:
+        c.drawImage(logo, x + padding, header_bottom + (header_height - logo_size) / 2,
+                    width=logo_size, height=logo_size, preserveAspectRatio=True, mask='auto')
+        text_left += logo_size + 1.5 * mm
+    header_text_width = x + CARD_WIDTH - padding - text_left
+    header_center = text_left + header_text_width / 2
+    school_name = school_info.get('school_name', 'Wajina International School').upper()
+    title_size = _fit_font_size(school_name, 'Helvetica-Bold', title_size, header_text_width)
+    c.setFillColor(colors.HexColor(card_settings.get('header_text_color', '#ffffff')))
+    c.setFont('Helvetica-Bold', title_size)
+    title_y = header_bottom + header_height / 2 + 0.5 * mm
+    c.drawCentredString(header_center, title_y, school_name)
+    c.setFont('Helvetica', subtitle_size)
+    c.drawCentredString(header_center, title_y - subtitle_size - 0.5 * mm, title)
+    
+    # Footer band: school address and phone
+    footer_size = card_settings.get('footer_font_size', 12) * scale
+    footer_height = footer_size + 2 * mm
+    c.setFillColor(colors.HexColor(card_settings.get('footer_bg_color', '#f8f9fa')))
+    c.rect(x, y, CARD_WIDTH, footer_height, stroke=0, fill=1)
+    footer_text = school_info.get('school_address', '')
+    if school_info.get('school_phone'):
+        footer_text += f" | {school_info['school_phone']}"
+    c.setFillColor(colors.HexColor(card_settings.get('footer_text_color', '#666666')))
+    c.setFont('Helvetica', footer_size)
+    c.drawCentredString(x + CARD_WIDTH / 2, y + 1 * mm + footer_size * 0.2,
+                        _truncate(footer_text, 'Helvetica', footer_size, CARD_WIDTH - 2 * padding))
+    
+    # Body: photo on the left, QR code on the right, details in between
+    body_top = header_bottom - 1.5 * mm
+    body_bottom = y + footer_height + 1.5 * mm
+    body_height = body_top - body_bottom
+    
+    photo_width = card_settings.get('photo_width', 150) * scale
+    photo_height = card_settings.get('photo_height', 180) * scale
+    if photo_height > body_height:
+        photo_width *= body_height / photo_height
+        photo_height = body_height
+    photo_x = x + padding
+    photo_y = body_bottom + (body_height - photo_height) / 2
+    photo = get_photo(storage, card.get('photo_key'), photo_width, photo_height)
+    if photo:
+        c.drawImage(photo, photo_x, photo_y, width=photo_width, height=photo_height)
+    else:
+        c.setFillColor(colors.HexColor('#eeeeee'))
+        c.rect(photo_x, photo_y, photo_width, photo_height, stroke=0, fill=1)
+        c.setFillColor(colors.HexColor(card_settings.get('label_color', '#666666')))
+        c.setFont('Helvetica', 6)
+        c.drawCentredString(photo_x + photo_width / 2, photo_y + photo_height / 2, 'No Photo')
+    c.setStrokeColor(colors.HexColor(card_settings.get('photo_border_color', '#32CD32')))
+    c.setLineWidth(card_settings.get('photo_border_width', 3) * scale)
+    c.rect(photo_x, photo_y, photo_width, photo_height, stroke=1, fill=0)
+    
+    text_right = x + CARD_WIDTH - padding
+    if card_settings.get('show_qr', True) and card.get('qr_data'):
+        qr_size = min(card_settings.get('qr_size', 120) * scale, body_height)
+        c.drawImage(get_qr_image(card['qr_data'], qr_folder), text_right - qr_size, body_bottom + (body_height - qr_size) / 2,
+                    width=qr_size, height=qr_size)
+        text_right -= qr_size + 1.5 * mm
+    
+    text_x = photo_x + photo_width + 2 * mm
+    text_width = text_right - text_x
+    name_size = _fit_font_size(card['name'], 'Helvetica-Bold', card_settings.get('name_font_size', 18) * scale,
+                               text_width)
+    label_size = card_settings.get('label_font_size', 14) * scale
+    value_size = card_settings.get('value_font_size', 16) * scale
+    
+    text_y = body_top - name_size
+    c.setFillColor(colors.HexColor(card_settings.get('text_color', '#000000')))
+    c.setFont('Helvetica-Bold', name_size)
+    c.drawString(text_x, text_y, _truncate(card['name'], 'Helvetica-Bold', name_size, text_width))
+    text_y -= 1.5 * mm
+    for label, value in card.get('fields', []):
+        text_y -= label_size
+        if text_y - value_size < body_bottom:
+            break
+        c.setFillColor(colors.HexColor(card_settings.get('label_color', '#666666')))
+        c.setFont('Helvetica', label_size)
+        c.drawString(text_x, text_y, label)
+        text_y -= value_size + 0.3 * mm
+        c.setFillColor(colors.HexColor(card_settings.get('text_color', '#000000')))
+        c.setFont('Helvetica-Bold', value_size)
+        c.drawString(text_x, text_y, _truncate(str(value or 'N/A'), 'Helvetica-Bold', value_size, text_width))
+        text_y -= 0.8 * mm
+    c.restoreState()
+    
+    # Border is drawn outside the clip so it is not cut in half
+    c.saveState()
+    c.setStrokeColor(colors.HexColor(card_settings.get('border_color', '#32CD32')))
+    c.setLineWidth(border_width)
+    c.roundRect(x, y, CARD_WIDTH, CARD_HEIGHT, radius, stroke=1, fill=0)
+    c.restoreState()
+
+
+def _draw_crop_marks(c, layout):
+    """Short marks in the margins at every card edge, for guillotine cutting"""
+    page_width, page_height = A4
+    xs = []
+    for column in range(layout['columns']):
+        left = layout['left'] + column * (CARD_WIDTH + CARD_GAP)
+        xs += [left, left + CARD_WIDTH]
+    ys = []
+    for row in range(layout['rows']):
+        top = layout['top'] - row * (CARD_HEIGHT + CARD_GAP)
+        ys += [top, top - CARD_HEIGHT]
+    grid_bottom = ys[-1]
+    grid_right = xs[-1]
+    
+    c.saveState()
+    c.setStrokeColor(colors.grey)
+    c.setLineWidth(0.25)
+    for mark_x in xs:
+        c.line(mark_x, layout['top'] + 1 * mm, mark_x, layout['top'] + 1 * mm + CROP_MARK_LENGTH)
+        c.line(mark_x, grid_bottom - 1 * mm, mark_x, grid_bottom - 1 * mm - CROP_MARK_LENGTH)
+    for mark_y in ys:
+        c.line(layout['left'] - 1 * mm, mark_y, layout['left'] - 1 * mm - CROP_MARK_LENGTH, mark_y)
+        c.line(grid_right + 1 * mm, mark_y, grid_right + 1 * mm + CROP_MARK_LENGTH, mark_y)
+    c.restoreState()
+
+
+def render_id_card_sheets_chunk(cards, school_info, card_settings, title, layout, qr_folder=None, storage=None):
+    """Draw cards onto as many A4 sheets as needed and return the PDF bytes"""
+    buffer = BytesIO()
+    c = pdf_canvas.Canvas(buffer, pagesize=A4)
+    c.setTitle(title)
+    per_page = layout['columns'] * layout['rows']
+    
+    for page_start in range(0, max(len(cards), 1), per_page):
+        page_cards = cards[page_start:page_start + per_page]
+        for index, card in enumerate(page_cards):
+            row, column = divmod(index, layout['columns'])
+            card_x = layout['left'] + column * (CARD_WIDTH + CARD_GAP)
+            card_y = layout['top'] - row * (CARD_HEIGHT + CARD_GAP) - CARD_HEIGHT
+            _draw_card(c, card_x, card_y, card, school_info, card_settings, title, qr_folder, storage)
+        if page_cards:
+            _draw_crop_marks(c, layout)
+        c.showPage()
+    
+    c.save()
+    return buffer.getvalue()
+
+
+def render_id_card_sheets(cards, school_info, card_settings, title, output, layout=None, max_workers=None,
+                          qr_folder=None, storage=None):
+    """
+    Render cards onto A4 sheets and write one PDF to output (a path or binary file object).
+    
+    Cards are split into runs of whole pages that are drawn in parallel across a process pool,
+    then merged; the school logo is embedded once in the merged file. qr_folder is the QR code
+    disk cache (see qr_codes) and storage the upload storage holding the photos (see storage);
+    both are shared with the worker processes.
+    """
+    layout = layout or sheet_layout()
+    chunk_size = layout['columns'] * layout['rows'] * ID_CARD_PAGES_PER_CHUNK
+    chunks = [cards[i:i + chunk_size] for i in range(0, len(cards), chunk_size)]
+    
+    if len(chunks) <= 1:
+        pdf_bytes = render_id_card_sheets_chunk(cards, school_info, card_settings, title, layout, qr_folder,
+                                                storage)
+        if isinstance(output, str):
+            with open(output, 'wb') as f:
+                f.write(pdf_bytes)
+        else:
+            output.write(pdf_bytes)
+        return
+    
+    rendered = [None] * len(chunks)
+    executor = render_pool(min(max_workers or REPORT_CARD_MAX_WORKERS, len(chunks)))
+    if executor is None:
+        for index, chunk in enumerate(chunks):
+            rendered[index] = render_id_card_sheets_chunk(chunk, school_info, card_settings, title, layout,
+                                                          qr_folder, storage)
+    else:
+        try:
+            futures = {
+                executor.submit(render_id_card_sheets_chunk, chunk, school_info, card_settings, title, layout,
+                                qr_folder, storage): index
+                for index, chunk in enumerate(chunks)
+            }
+            for future in as_completed(futures):
+                rendered[futures[future]] = future.result()
+        finally:
+            executor.shutdown()
+    
+    merge_pdfs(rendered, output)
+
+
+def build_learner_cards(class_filter=''):
+    """Card data for active learners (optionally one class) as plain dicts, ordered by name"""
+    query = db.session.query(
+        User.first_name,
+        User.last_name,
+        Learner.admission_number,
+        Learner.current_class,
+        Learner.current_session,
+        Learner.passport_photograph
+    ).join(User, Learner.user_id == User.id).filter(Learner.status == 'active')
+    
+    if class_filter:
+        query = query.filter(Learner.current_class == class_filter)
+    
+    cards = []
+    for row in query.order_by(Learner.current_class, User.last_name, User.first_name):
+        cards.append({
+            'name': f"{row.first_name} {row.last_name}",
+            'fields': [
+                ('Admission No', row.admission_number),
+                ('Class', row.current_class),
+                ('Session', row.current_session),
+            ],
+            'photo_key': photo_path(row.passport_photograph, 'print'),
+            'qr_data': row.admission_number,
+        })
+    return cards
+
+
+def build_staff_cards(department=''):
+    """Card data for active staff (optionally one department) as plain dicts, ordered by name"""
+    query = db.session.query(
+        User.first_name,
+        User.last_name,
+        User.profile_picture,
+        Staff.staff_id,
+        Staff.department,
+        Staff.designation
+    ).join(User, Staff.user_id == User.id).filter(Staff.status == 'active')
+    
+    if department:
+        query = query.filter(Staff.department == department)
+    
+    cards = []
+    for row in query.order_by(User.last_name, User.first_name):
+        cards.append({
+            'name': f"{row.first_name} {row.last_name}",
+            'fields': [
+                ('Staff ID', row.staff_id),
+                ('Designation', row.designation),
+                ('Department', row.department),
+            ],
+            'photo_key': photo_path(row.profile_picture, 'print'),
+            'qr_data': row.staff_id,
+        })
+    return cards
@@ -0,0 +1,126 @@
+"""
+Request Identity for Wajina Suite
+Loads the logged-in user together with its learner or staff profile in one joined query.
+Flask-Login keeps the result as current_user for the rest of the request, so portal pages read
+the profile from current_learner() / current_staff() instead of querying it again. With
+IDENTITY_CACHE_TTL set, the row values are also kept briefly in the app cache across requests
+and dropped as soon as the user or one of its profiles is changed.
+"""
+
+from cache import get_cache
+from database import db
+from flask import current_app, has_app_context
+from flask_login import current_user
+from models import User, Learner, Staff
+from sqlalchemy import event, inspect as sa_inspect, select
+from sqlalchemy.orm import joinedload, make_transient_to_detached
+
+
+# Never copied into the cache; loaded from the database when a password is checked or changed
+UNCACHED_COLUMNS = {'password_hash', 'reset_token', 'reset_token_expiry'}
+
+PROFILES = (('learner_profile', Learner), ('staff_profile', Staff))
+
+
+def identity_key(user_id):
+    return f'identity:{user_id}'
+
+
+def _snapshot(obj):
+    """Column values of a loaded row (None for no row)"""
+    if obj is None:
+        return None
+    return {
+        attr.key: getattr(obj, attr.key)
+        for attr in sa_inspect(type(obj)).column_attrs
+        if attr.key not in UNCACHED_COLUMNS
+    }
+
+
+def _restore(model, values):
+    """A detached instance holding values, as if it had just been loaded"""
+    obj = sa_inspect(model).class_manager.new_instance()
+    for key, value in values.items():
+        setattr(obj, key, value)
+    return obj
+
+
+def _from_cache(entry):
+    user = _restore(User, entry['user'])
+    for name, model in PROFILES:
+        setattr(user, name, _restore(model, entry[name]) if entry[name] is not None else None)
+        profile = getattr(user, name)
+        if profile is not None:
+            make_transient_to_detached(profile)
+    make_transient_to_detached(user)
+    # Attached to this request's session without a query; skipped columns load on first use
+    return db.session.merge(user, load=False)
+
+
+def load_identity(user_id):
+    """User with learner_profile and staff_profile already loaded, or None"""
+    ttl = current_app.config.get('IDENTITY_CACHE_TTL')
+    cache = get_cache() if ttl else None
+    if cache is not None:
+        entry = cache.get(identity_key(user_id))
+        if entry is not None:
+            return _from_cache(entry)
+
+    user = db.session.execute(
+        select(User)
+        .options(joinedload(User.learner_profile), joinedload(User.staff_profile))
+        .where(User.id == user_id)
+    ).scalar_one_or_none()
+    if user is not None and cache is not None:
+        entry = {'user': _snapshot(user)}
+        for name, model in PROFILES:
+            entry[name] = _snapshot(getattr(user, name))
+        cache.set(identity_key(user_id), entry, ttl)
+    return user
+
+
+def current_learner():
+    """Learner profile of the logged-in user, or None"""
+    return getattr(current_user, 'learner_profile', None)
+
+
+def current_staff():
+    """Staff profile of the logged-in user, or None"""
+    return getattr(current_user, 'staff_profile', None)
+
+
+def _user_ids(obj):
+    """Users whose cached identity includes obj (old and new owner when a profile is moved)"""
+    if isinstance(obj, User):
+        return {obj.id}
+    if isinstance(obj, (Learner, Staff)):
+        return {value for value in sa_inspect(obj).attrs.user_id.history.sum() if value is not None}
+    return set()
+
+
+def _after_flush(session, flush_context):
+    changed = session.info.setdefault('identity_changes', set())
+    for obj in list(session.new) + list(session.deleted) + list(session.dirty):
+        changed |= _user_ids(obj)
+
+
+def _after_commit(session):
+    changed = session.info.pop('identity_changes', None)
+    if not changed or not has_app_context() or not current_app.config.get('IDENTITY_CACHE_TTL'):
+        return
+    cache = get_cache()
+    for user_id in changed:
+        cache.delete(identity_key(user_id))
+
+
+def _after_rollback(session, previous_transaction):
+    if not previous_transaction.nested:
+        session.info.pop('identity_changes', None)
+
+
+def track_identity_changes(session=None):
+    """Drop cached identities when users or their profiles change through session (db.session by default)"""
+    session = session if session is not None else db.session
+    event.listen(session, 'after_flush', _after_flush)
+    event.listen(session, 'after_commit', _after_commit)
+    event.listen(session, 'after_soft_rollback', _after_rollback)
@@ -0,0 +1,210 @@
+"""
+Photo Upload Processing for Wajina Suite
+Normalises uploaded passports and profile photos with Pillow and writes downscaled
+JPEG/WebP variants for thumbnails, ID cards and printing
+"""
+
+from storage import get_storage
+from io import BytesIO
+import os
+import tempfile
+import time
+
+
+# Longest edge of the stored photo; phone photos are far larger than anything we display or print
+MAX_PHOTO_EDGE = 1600
+
+# Variant name -> longest edge in pixels
+PHOTO_VARIANTS = {
+    'thumb': 160,   # list pages, avatars
+    'card': 400,    # on-screen ID cards and profiles
+    'print': 1000,  # ID card sheets and printed documents
+}
+
+# Extension -> (Pillow format, save options); every variant is written in each format
+PHOTO_FORMATS = {
+    'jpg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+}
+
+# Upload subfolders that hold photos (documents and receipts are left alone)
+PHOTO_FOLDERS = ('passports', 'profiles', 'admissions')
+PHOTO_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'webp'}
+
+# Variant keys known to exist; uploads are never rewritten under the same name, so a hit stays valid
+# and templates do not ask the storage backend (a HEAD request on S3) on every page
+_existing_variants = set()
+
+# Seconds a variant found missing is not looked up again. Variants missing until backfill_photos.py
+# runs would otherwise cost one lookup per photo on every list page; after the backfill they are
+# used once this expires
+MISSING_VARIANT_TTL = 300
+
+# Variant key -> time.monotonic() until which it is treated as missing
+_missing_variants = {}
+
+
+def photo_variant_path(relative_path, variant, fmt='jpg'):
+    """Relative path of a photo variant: passports/abc.jpg -> passports/abc_thumb.jpg"""
+    stem = os.path.splitext(relative_path)[0]
+    return f'{stem}_{variant}.{fmt}'
+
+
+def is_variant_file(filename):
+    """True for files written by this module as variants of another photo"""
+    stem, ext = os.path.splitext(filename)
+    return ext.lstrip('.') in PHOTO_FORMATS and any(stem.endswith(f'_{variant}') for variant in PHOTO_VARIANTS)
+
+
+def _normalise(image):
+    """Apply the EXIF orientation and flatten to RGB on white (JPEG has no alpha)"""
+    from PIL import Image as PILImage, ImageOps
+    
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = PILImage.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def _encode(image, fmt):
+    """Encode an image without metadata (EXIF, GPS, ICC extras are not passed on)"""
+    pil_format, options = PHOTO_FORMATS[fmt]
+    buffer = BytesIO()
+    image.save(buffer, format=pil_format, **options)
+    buffer.seek(0)
+    return buffer
+
+
+def _save_atomic(image, path, fmt):
+    """Write an encoded image to a local path via a temp file"""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_encode(image, fmt).getvalue())
+        os.replace(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _variant_images(image):
+    """(variant, fmt, resized image) for every variant of an already-normalised image"""
+    from PIL import Image as PILImage
+    
+    for variant, edge in PHOTO_VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail((edge, edge), PILImage.LANCZOS)
+        for fmt in PHOTO_FORMATS:
+            yield variant, fmt, resized
+
+
+def write_photo_variants(image, full_path):
+    """Write every variant of an already-normalised image next to a local file and return their paths"""
+    written = []
+    for variant, fmt, resized in _variant_images(image):
+        variant_path = photo_variant_path(full_path, variant, fmt)
+        _save_atomic(resized, variant_path, fmt)
+        written.append(variant_path)
+    return written
+
+
+def save_uploaded_photo(file, subfolder, stem):
+    """
+    Store an uploaded photo (a FileStorage) as <subfolder>/<stem>.jpg: orientation fixed,
+    metadata stripped and capped at MAX_PHOTO_EDGE, plus its variants.
+    Returns the storage key, as stored on the model.
+    Raises ValueError if the file is not a readable image.
+    """
+    from PIL import Image as PILImage, UnidentifiedImageError
+    
+    storage = get_storage()
+    key = f'{subfolder}/{stem}.jpg'
+    
+    try:
+        with PILImage.open(file.stream) as image:
+            image.draft('RGB', (MAX_PHOTO_EDGE, MAX_PHOTO_EDGE))
+            image = _normalise(image)
+    except (UnidentifiedImageError, OSError):
+        raise ValueError('The uploaded file is not a valid image.')
+    
+    image.thumbnail((MAX_PHOTO_EDGE, MAX_PHOTO_EDGE), PILImage.LANCZOS)
+    storage.put(key, _encode(image, 'jpg'), content_type='image/jpeg')
+    for variant, fmt, resized in _variant_images(image):
+        variant_key = photo_variant_path(key, variant, fmt)
+        storage.put(variant_key, _encode(resized, fmt), content_type=f"image/{PHOTO_FORMATS[fmt][0].lower()}")
+        _existing_variants.add(variant_key)
+        _missing_variants.pop(variant_key, None)
+    return key
+
+
+def generate_photo_variants(full_path, force=False):
+    """
+    Create the variants for an existing photo in the local upload folder (backfill); the original
+    file is not changed.
+    Returns the number of files written, or 0 if the variants already exist or the file is not an image.
+    Top-level so it can run in a worker pool.
+    """
+    from PIL import Image as PILImage
+    
+    if not force and all(os.path.exists(photo_variant_path(full_path, variant, fmt))
+                         for variant in PHOTO_VARIANTS for fmt in PHOTO_FORMATS):
+        return 0
+    try:
+        with PILImage.open(full_path) as image:
+            image.draft('RGB', (MAX_PHOTO_EDGE, MAX_PHOTO_EDGE))
+            image = _normalise(image)
+        return len(write_photo_variants(image, full_path))
+    except Exception as e:
+        print(f"Error processing {full_path}: {e}")
+        return 0
+
+
+def find_photos(upload_folder):
+    """Original photos under the photo subfolders of upload_folder"""
+    for subfolder in PHOTO_FOLDERS:
+        folder = os.path.join(upload_folder, subfolder)
+        if not os.path.isdir(folder):
+            continue
+        for entry in os.scandir(folder):
+            ext = os.path.splitext(entry.name)[1].lstrip('.').lower()
+            if entry.is_file() and ext in PHOTO_EXTENSIONS and not is_variant_file(entry.name):
+                yield entry.path
+
+
+def photo_path(relative_path, variant=None, fmt='jpg'):
+    """
+    Storage key of the best file for a photo: the requested variant if it has been generated,
+    otherwise the original upload
+    """
+    if not relative_path:
+        return None
+    if variant:
+        candidate = photo_variant_path(relative_path, variant, fmt)
+        if candidate in _existing_variants:
+            return candidate
+        if _missing_variants.get(candidate, 0) > time.monotonic():
+            return relative_path
+        try:
+            if get_storage().exists(candidate):
+                _existing_variants.add(candidate)
+                _missing_variants.pop(candidate, None)
+                return candidate
+        except ValueError:
+            pass
+        except Exception as e:
+            # e.g. S3 unreachable or refusing the HEAD request; the original upload still displays
+            print(f"Error checking photo variant {candidate}: {e}")
+        _missing_variants[candidate] = time.monotonic() + MISSING_VARIANT_TTL
+    return relative_path
+
+
+def photo_url(relative_path, variant='thumb', fmt='jpg'):
+    """URL of a photo variant for templates, e.g. {{ photo_url(learner.passport_photograph, 'card') }}"""
+    key = photo_path(relative_path, variant, fmt)
+    if not key:
+        return None
+    return get_storage().url(key)
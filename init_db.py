@@ -69,6 +69,29 @@ def init_database():
         except Exception as e:
             print(f"Note: Could not add password reset columns automatically: {str(e)}")
         
+        # Add e-wallet running total columns if they don't exist, then backfill them
+        try:
+            inspector = inspect(db.engine)
+            wallet_columns = [col['name'] for col in inspector.get_columns('ewallets')]
+            added = False
+            
+            for column in ('total_deposits', 'total_withdrawals', 'total_payments'):
+                if column not in wallet_columns:
+                    print(f"Adding {column} column to ewallets table...")
+                    with db.engine.begin() as conn:
+                        conn.execute(text(f'ALTER TABLE ewallets ADD COLUMN {column} NUMERIC(12, 2) DEFAULT 0 NOT NULL'))
+                    added = True
+            
+            if added:
+                from ewallet_service import rebuild_wallet_totals
+                print("Backfilling e-wallet totals from transaction history...")
+                rebuild_wallet_totals()
+                db.session.commit()
+                print("E-wallet totals backfilled successfully!")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Note: Could not add e-wallet total columns automatically: {str(e)}")
+        
         # Create default admin user if it doesn't exist
         admin = User.query.filter_by(username='admin').first()
         if not admin:
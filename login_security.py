@@ -0,0 +1,101 @@
+"""
+Login Security for Wajina Suite
+Finds the account for a login identifier (username, email or phone) in one indexed query,
+throttles failed attempts per account and per client IP in the shared cache before any password
+hash is checked, and upgrades stored hashes to PASSWORD_HASH_METHOD on a successful login.
+"""
+
+from cache import get_cache
+from database import db
+from models import User
+from flask import current_app, request
+from sqlalchemy import func, or_
+import hashlib
+import math
+import time
+
+
+def normalize_login(identifier):
+    """Login identifier as it is looked up: surrounding whitespace removed"""
+    return (identifier or '').strip()
+
+
+def find_login_user(identifier):
+    """
+    User whose username, email (case-insensitive) or phone is identifier, in one query.
+    When several accounts match, username beats email and email beats phone, as before.
+    """
+    identifier = normalize_login(identifier)
+    if not identifier:
+        return None
+    lowered = identifier.lower()
+    users = User.query.filter(or_(
+        User.username == identifier,
+        func.lower(User.email) == lowered,
+        User.phone == identifier,
+    )).limit(3).all()
+
+    def rank(user):
+        if user.username == identifier:
+            return 0
+        if user.email == identifier:
+            return 1
+        if user.email and user.email.lower() == lowered:
+            return 2
+        return 3
+
+    return min(users, key=rank) if users else None
+
+
+def _window_key(kind, value, window):
+    """Counter key for the current fixed window, e.g. login:ip:<hash>:1931"""
+    digest = hashlib.sha1(value.encode('utf-8')).hexdigest()[:20]
+    return f'login:{kind}:{digest}:{int(time.time() // window)}'
+
+
+def _attempt_keys(identifier, user=None):
+    window = current_app.config.get('LOGIN_ATTEMPT_WINDOW', 900)
+    # Keyed on the matched account, so its username, email and phone share one count; identifiers
+    # that match no account are counted as typed
+    account = f'user:{user.id}' if user is not None else f'login:{normalize_login(identifier).lower()}'
+    return (
+        (_window_key('account', account, window), current_app.config.get('MAX_LOGIN_ATTEMPTS', 5)),
+        (_window_key('ip', request.remote_addr or '', window), current_app.config.get('MAX_LOGIN_ATTEMPTS_PER_IP', 50)),
+    )
+
+
+def login_retry_after(identifier, user=None):
+    """Seconds until the account (user from find_login_user, if any) or this client may try again, or 0"""
+    cache = get_cache()
+    for key, limit in _attempt_keys(identifier, user):
+        if limit and (cache.get(key) or 0) >= limit:
+            window = current_app.config.get('LOGIN_ATTEMPT_WINDOW', 900)
+            return max(1, math.ceil(window - time.time() % window))
+    return 0
+
+
+def record_failed_login(identifier, user=None):
+    """Count a failed attempt against the account (or the unmatched identifier) and the client IP"""
+    cache = get_cache()
+    window = current_app.config.get('LOGIN_ATTEMPT_WINDOW', 900)
+    for key, limit in _attempt_keys(identifier, user):
+        if limit:
+            cache.incr(key, window)
+
+
+def clear_failed_logins(identifier, user):
+    """Forget the account's failed attempts after a successful login (the IP count is kept)"""
+    get_cache().delete(_attempt_keys(identifier, user)[0][0])
+
+
+def rehash_password(user, password):
+    """Re-hash a just-verified password when it was stored with another method or cost"""
+    method = current_app.config.get('PASSWORD_HASH_METHOD')
+    if not method or user.password_hash.split('$', 1)[0] == method:
+        return
+    try:
+        user.set_password(password)
+        db.session.commit()
+    except Exception:
+        # The old hash still works; try again at the next login
+        db.session.rollback()
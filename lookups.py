@@ -0,0 +1,141 @@
+"""
+Filter Lookups for Wajina Suite
+Distinct values of the columns behind filter dropdowns (sessions, terms, fee types, categories,
+payment methods), kept in the app cache instead of running SELECT DISTINCT on every page view.
+A commit that adds a value the cached set lacks, or that may remove one, drops the set so it is
+rebuilt by the next read (one SELECT DISTINCT), which cannot lose a value another worker added
+at the same time. Bulk UPDATE/DELETE statements on a lookup model drop every lookup.
+"""
+
+from cache import get_cache
+from database import db
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect as sa_inspect
+
+
+# Model name -> columns offered as filter values
+LOOKUP_COLUMNS = {
+    'Subject': ('category',),
+    'SchoolTimetable': ('session', 'term'),
+    'ExamTimetable': ('exam_type', 'session', 'term'),
+    'Exam': ('session', 'term', 'exam_type'),
+    'Assignment': ('session', 'term'),
+    'Test': ('session', 'term'),
+    'Fee': ('fee_type', 'session', 'term', 'payment_method'),
+    'StoreItem': ('category',),
+    'Expenditure': ('category',),
+}
+
+# Model name -> columns a lookup can also be narrowed by (e.g. one class's timetable terms)
+LOOKUP_SCOPES = {
+    'SchoolTimetable': ('class_id',),
+    'ExamTimetable': ('class_id',),
+}
+
+
+def lookup_key(table, column, scope=None):
+    """Cache key of a lookup: lookup:fees.fee_type or lookup:school_timetables.term:class_id=3"""
+    key = f'lookup:{table}.{column}'
+    for name, value in sorted((scope or {}).items()):
+        key += f':{name}={value}'
+    return key
+
+
+def distinct_values(column, **scope):
+    """
+    Sorted, non-empty distinct values of a registered column, e.g.
+    distinct_values(Fee.fee_type) or distinct_values(SchoolTimetable.term, class_id=3)
+    """
+    model = column.class_
+    if column.key not in LOOKUP_COLUMNS.get(model.__name__, ()):
+        raise ValueError(f'{model.__name__}.{column.key} is not a registered lookup')
+    if any(name not in LOOKUP_SCOPES.get(model.__name__, ()) for name in scope):
+        raise ValueError(f'Unsupported lookup scope for {model.__name__}: {sorted(scope)}')
+    
+    cache = get_cache()
+    key = lookup_key(model.__tablename__, column.key, scope)
+    values = cache.get(key)
+    if values is None:
+        rows = db.session.query(column).filter_by(**scope).distinct()
+        values = sorted({row[0] for row in rows if row[0]})
+        cache.set(key, values, current_app.config.get('LOOKUP_CACHE_TTL'))
+    return list(values)
+
+
+def _keys_for(obj, column):
+    """Cache keys a row contributes to: the unscoped lookup plus one per (old and new) scope value"""
+    table = type(obj).__tablename__
+    keys = [lookup_key(table, column)]
+    state = sa_inspect(obj)
+    for name in LOOKUP_SCOPES.get(type(obj).__name__, ()):
+        for value in state.attrs[name].history.sum():
+            if value is not None:
+                keys.append(lookup_key(table, column, {name: value}))
+    return keys
+
+
+def _after_flush(session, flush_context):
+    # (key, value) committed rows now use; value None means a value may no longer be used
+    changes = session.info.setdefault('lookup_changes', [])
+    for obj in session.new:
+        for column in LOOKUP_COLUMNS.get(type(obj).__name__, ()):
+            value = getattr(obj, column)
+            if value:
+                changes.extend((key, value) for key in _keys_for(obj, column))
+    for obj in session.deleted:
+        for column in LOOKUP_COLUMNS.get(type(obj).__name__, ()):
+            changes.extend((key, None) for key in _keys_for(obj, column))
+    for obj in session.dirty:
+        name = type(obj).__name__
+        if name not in LOOKUP_COLUMNS:
+            continue
+        state = sa_inspect(obj)
+        scope_changed = any(state.attrs[scope].history.deleted for scope in LOOKUP_SCOPES.get(name, ()))
+        for column in LOOKUP_COLUMNS[name]:
+            history = state.attrs[column].history
+            if scope_changed or any(history.deleted):
+                # The old value may no longer be used by any row
+                changes.extend((key, None) for key in _keys_for(obj, column))
+            elif history.added and history.added[0]:
+                changes.extend((key, history.added[0]) for key in _keys_for(obj, column))
+
+
+def _on_execute(orm_execute_state):
+    # Query.delete()/update() write without a flush, so no row events reach _after_flush
+    if orm_execute_state.is_delete or orm_execute_state.is_update:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and mapper.class_.__name__ in LOOKUP_COLUMNS:
+            orm_execute_state.session.info['lookup_bulk_write'] = True
+
+
+def _after_commit(session):
+    changes = session.info.pop('lookup_changes', None)
+    bulk_write = session.info.pop('lookup_bulk_write', False)
+    if not (changes or bulk_write) or not has_app_context():
+        return
+    cache = get_cache()
+    if bulk_write:
+        cache.delete_namespace('lookup')
+        return
+    for key, value in changes:
+        if value is not None:
+            values = cache.get(key)
+            if values is None or value in values:
+                # Not cached, or already listed
+                continue
+        cache.delete(key)
+
+
+def _after_rollback(session, previous_transaction):
+    if not previous_transaction.nested:
+        session.info.pop('lookup_changes', None)
+        session.info.pop('lookup_bulk_write', None)
+
+
+def track_lookups(session=None):
+    """Keep cached lookups in step with writes made through session (db.session by default)"""
+    session = session if session is not None else db.session
+    event.listen(session, 'after_flush', _after_flush)
+    event.listen(session, 'do_orm_execute', _on_execute)
+    event.listen(session, 'after_commit', _after_commit)
+    event.listen(session, 'after_soft_rollback', _after_rollback)
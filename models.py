@@ -3,6 +3,7 @@ Database Models for Wajina Suite
 """
 
 from database import db
+from flask import current_app, has_app_context
 from flask_login import UserMixin
 from datetime import datetime, date
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -19,7 +20,7 @@ class User(UserMixin, db.Model):
     role = db.Column(db.String(20), nullable=False)  # admin, teacher, learner, parent, store_keeper, accountant, cashier
     first_name = db.Column(db.String(100), nullable=False)
     last_name = db.Column(db.String(100), nullable=False)
-    phone = db.Column(db.String(20))
+    phone = db.Column(db.String(20), index=True)
     profile_picture = db.Column(db.String(255))
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -28,12 +29,17 @@ class User(UserMixin, db.Model):
     reset_token = db.Column(db.String(100), unique=True, nullable=True)
     reset_token_expiry = db.Column(db.DateTime, nullable=True)
     
+    # Login looks up emails case-insensitively
+    __table_args__ = (db.Index('ix_users_email_lower', db.func.lower(email)),)
+    
     # Relationships
     learner_profile = db.relationship('Learner', backref='user', uselist=False, cascade='all, delete-orphan')
     staff_profile = db.relationship('Staff', backref='user', uselist=False, cascade='all, delete-orphan')
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        # PASSWORD_HASH_METHOD sets the hash cost; werkzeug's default outside the app
+        method = current_app.config.get('PASSWORD_HASH_METHOD') if has_app_context() else None
+        self.password_hash = generate_password_hash(password, method=method) if method else generate_password_hash(password)
     
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
@@ -182,6 +188,9 @@ class Fee(db.Model):
     remarks = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Keyset pagination order of the fees list
+    __table_args__ = (db.Index('ix_fees_due_date_id', 'due_date', 'id'),)
+    
     def __repr__(self):
         return f'<Fee {self.fee_type} - {self.amount}>'
 
@@ -403,6 +412,8 @@ class StoreTransaction(db.Model):
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (db.Index('ix_store_transactions_date_id', 'transaction_date', 'id'),)
+    
     # Relationships
     creator = db.relationship('User', foreign_keys=[created_by])
     
@@ -435,6 +446,8 @@ class Expenditure(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    __table_args__ = (db.Index('ix_expenditures_payment_date_id', 'payment_date', 'id'),)
+    
     # Relationships
     approver = db.relationship('User', foreign_keys=[approved_by])
     creator = db.relationship('User', foreign_keys=[created_by])
@@ -522,6 +535,10 @@ class PaymentTransaction(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # The transactions list sorts by payment date, falling back to creation for unpaid ones
+    __table_args__ = (db.Index('ix_payment_transactions_paid_or_created',
+                               db.func.coalesce(payment_date, created_at), id),)
+    
     # Relationships
     learner = db.relationship('Learner', backref='payment_transactions')
     fee = db.relationship('Fee', backref='payment_transactions')
@@ -553,6 +570,8 @@ class Salary(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    __table_args__ = (db.Index('ix_salaries_created_at_id', 'created_at', 'id'),)
+    
     # Relationships
     staff = db.relationship('Staff', backref='salaries')
     creator = db.relationship('User', foreign_keys=[created_by])
@@ -659,6 +678,12 @@ class EWallet(db.Model):
     balance = db.Column(db.Numeric(10, 2), default=0.00, nullable=False)
     currency = db.Column(db.String(10), default='NGN', nullable=False)
     status = db.Column(db.String(20), default='active')  # active, frozen, closed
+    
+    # Running totals of completed transactions (maintained by ewallet_service)
+    total_deposits = db.Column(db.Numeric(12, 2), default=0, nullable=False)
+    total_withdrawals = db.Column(db.Numeric(12, 2), default=0, nullable=False)
+    total_payments = db.Column(db.Numeric(12, 2), default=0, nullable=False)
+    
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -695,6 +720,9 @@ class EWalletTransaction(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # A user's transaction history, newest first
+    __table_args__ = (db.Index('ix_ewallet_transactions_user_created_id', 'user_id', 'created_at', 'id'),)
+    
     # Relationships
     user = db.relationship('User', backref='ewallet_transactions', lazy=True)
     related_fee = db.relationship('Fee', backref='ewallet_transactions', lazy=True)
@@ -703,3 +731,62 @@ class EWalletTransaction(db.Model):
     def __repr__(self):
         return f'<EWalletTransaction {self.transaction_type} - {self.amount}>'
 
+
+class EWalletDailyTotal(db.Model):
+    """School-wide e-wallet totals per day and transaction type (completed transactions only)"""
+    __tablename__ = 'ewallet_daily_totals'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    transaction_type = db.Column(db.String(20), nullable=False)  # deposit, withdrawal, payment, refund, transfer
+    total_amount = db.Column(db.Numeric(14, 2), default=0, nullable=False)
+    transaction_count = db.Column(db.Integer, default=0, nullable=False)
+    
+    __table_args__ = (db.UniqueConstraint('day', 'transaction_type', name='unique_ewallet_day_type'),)
+    
+    def __repr__(self):
+        return f'<EWalletDailyTotal {self.day} {self.transaction_type} - {self.total_amount}>'
+
+
+
+class ReportJob(db.Model):
+    """Background report generation job (e.g. report card PDFs for a whole school)"""
+    __tablename__ = 'report_jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    job_type = db.Column(db.String(50), nullable=False)  # report_cards_pdf
+    status = db.Column(db.String(20), default='queued', nullable=False)  # queued, running, completed, failed
+    progress = db.Column(db.Integer, default=0, nullable=False)  # Items processed so far
+    total = db.Column(db.Integer, default=0, nullable=False)  # Items to process
+    parameters = db.Column(db.Text)  # JSON string of filters and settings
+    file_path = db.Column(db.String(255))  # Generated artifact
+    download_name = db.Column(db.String(255))
+    error_message = db.Column(db.Text)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    completed_at = db.Column(db.DateTime)
+    
+    # Relationships
+    creator = db.relationship('User', foreign_keys=[created_by])
+    
+    @property
+    def percent(self):
+        """Progress as a whole percentage"""
+        if self.status == 'completed':
+            return 100
+        return int(self.progress * 100 / self.total) if self.total else 0
+    
+    def __repr__(self):
+        return f'<ReportJob {self.id} {self.job_type} - {self.status}>'
+
+
+class DataVersion(db.Model):
+    """Version counter per data scope (e.g. 'learner:12', 'class:3'), bumped whenever rows in that scope change"""
+    __tablename__ = 'data_versions'
+    
+    scope = db.Column(db.String(100), primary_key=True)
+    version = db.Column(db.Integer, default=0, nullable=False)
+    
+    def __repr__(self):
+        return f'<DataVersion {self.scope} - {self.version}>'
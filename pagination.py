@@ -0,0 +1,169 @@
+"""
+Keyset (seek) Pagination for Wajina Suite
+Pages through large, date-ordered lists without OFFSET scans or COUNT(*) per page
+"""
+
+from database import db
+from datetime import datetime, date
+import base64
+import json
+import math
+
+
+class KeysetPage:
+    """
+    One page of keyset-paginated results.
+    Mirrors the parts of Flask-SQLAlchemy's Pagination used by list templates
+    (items, per_page, total, has_next, has_prev) and adds opaque cursors.
+    Page numbers do not exist here: page, prev_num and next_num are None and iter_pages()
+    yields nothing, so numbered pagers written for Pagination render without links instead of
+    failing. Their prev/next links must pass cursor=prev_cursor/next_cursor; this applies to
+    fees/list.html, ewallet/transactions.html, store/transactions.html, expenditures/list.html,
+    salaries/list.html and portals/cashier/transactions.html.
+    """
+    
+    page = None
+    prev_num = None
+    next_num = None
+    
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None,
+                 total=None, total_is_estimate=False):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+        self.total_is_estimate = total_is_estimate
+    
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+    
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+    
+    @property
+    def pages(self):
+        """Number of pages from total (0 when no total was requested)"""
+        if not self.total or not self.per_page:
+            return 0
+        return math.ceil(self.total / self.per_page)
+    
+    def iter_pages(self, *args, **kwargs):
+        """Pagination.iter_pages() stand-in: keyset pages cannot be jumped to by number"""
+        return iter(())
+    
+    def __iter__(self):
+        return iter(self.items)
+    
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(sort_value, row_id, direction='next'):
+    """Encode a (sort value, id) position into an opaque URL-safe cursor"""
+    if isinstance(sort_value, datetime):
+        value = ['t', sort_value.isoformat()]
+    elif isinstance(sort_value, date):
+        value = ['d', sort_value.isoformat()]
+    else:
+        value = ['v', sort_value]
+    payload = json.dumps([direction, value, row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor from encode_cursor. Returns (direction, sort value, id) or None if invalid"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        direction, (kind, raw), row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if direction not in ('next', 'prev') or not isinstance(row_id, int):
+            return None
+        if kind == 't':
+            value = datetime.fromisoformat(raw)
+        elif kind == 'd':
+            value = date.fromisoformat(raw)
+        else:
+            value = raw
+        return direction, value, row_id
+    except Exception:
+        return None
+
+
+def estimate_query_count(query):
+    """
+    Estimate the row count of a query from the PostgreSQL planner (EXPLAIN) instead of COUNT(*).
+    Returns None on other databases or if the estimate cannot be obtained.
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return None
+    try:
+        statement = query.order_by(None).statement
+        compiled = statement.compile(dialect=db.engine.dialect)
+        result = db.session.connection().exec_driver_sql(
+            f'EXPLAIN (FORMAT JSON) {compiled}', compiled.params
+        ).scalar()
+        plan = result if isinstance(result, list) else json.loads(result)
+        return int(plan[0]['Plan']['Plan Rows'])
+    except Exception:
+        return None
+
+
+def keyset_paginate(query, sort_column, id_column, cursor=None, per_page=20, with_total=False):
+    """
+    Paginate a query newest-first by (sort_column, id_column) using a seek predicate.
+    
+    sort_column may be any non-null column or expression (e.g. a coalesce for nullable dates);
+    id_column breaks ties so every row has a unique position.
+    with_total=True adds an approximate total from the PostgreSQL planner, or an exact
+    COUNT(*) on other databases (SQLite development databases are small).
+    """
+    position = decode_cursor(cursor)
+    total = None
+    total_is_estimate = False
+    
+    if with_total:
+        total = estimate_query_count(query)
+        if total is not None:
+            total_is_estimate = True
+        else:
+            total = query.order_by(None).count()
+    
+    key = db.tuple_(sort_column, id_column)
+    paged = query.add_columns(sort_column.label('_keyset_sort'), id_column.label('_keyset_id'))
+    
+    if position and position[0] == 'prev':
+        # Walk backwards (oldest-first) from the cursor, then flip the page back round
+        paged = paged.filter(key > (position[1], position[2]))
+        paged = paged.order_by(None).order_by(sort_column.asc(), id_column.asc())
+    else:
+        if position:
+            paged = paged.filter(key < (position[1], position[2]))
+        paged = paged.order_by(None).order_by(sort_column.desc(), id_column.desc())
+    
+    rows = paged.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    
+    if position and position[0] == 'prev':
+        rows.reverse()
+    
+    items = [row[0] for row in rows]
+    keys = [(row[-2], row[-1]) for row in rows]
+    
+    next_cursor = None
+    prev_cursor = None
+    if keys:
+        going_back = bool(position and position[0] == 'prev')
+        # There are newer rows whenever we arrived via a cursor, or came backwards and found more
+        if (going_back and has_more) or (position and not going_back):
+            prev_cursor = encode_cursor(keys[0][0], keys[0][1], 'prev')
+        # There are older rows whenever we came backwards, or went forwards and found more
+        if going_back or has_more:
+            next_cursor = encode_cursor(keys[-1][0], keys[-1][1], 'next')
+    
+    return KeysetPage(items, per_page, next_cursor=next_cursor, prev_cursor=prev_cursor,
+                      total=total, total_is_estimate=total_is_estimate)
@@ -0,0 +1,244 @@
+"""
+PDF Theme for Wajina Suite Reports
+Paragraph styles, table styles and the school logo are built once per process and reused
+by every report; the school letterhead and page footer are drawn by onPage callbacks
+"""
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.utils import ImageReader
+from reportlab.platypus import SimpleDocTemplate, TableStyle, Paragraph
+from datetime import datetime
+from functools import lru_cache
+from xml.sax.saxutils import escape
+
+
+BRAND_COLOR = colors.HexColor('#9ACD32')
+
+# Letterhead layout
+LOGO_SIZE = 1.5 * inch
+LOGO_GAP = 0.1 * inch
+HEADER_GAP = 0.1 * inch
+# The logo is printed at 1.5in, so 300px (200dpi) is plenty and keeps the embedded image small
+LOGO_MAX_PIXELS = 300
+
+
+@lru_cache(maxsize=None)
+def get_styles():
+    """Sample stylesheet plus the report styles, built once per process"""
+    styles = getSampleStyleSheet()
+    styles.add(ParagraphStyle(
+        'SchoolTitle',
+        parent=styles['Heading1'],
+        fontSize=16,
+        textColor=BRAND_COLOR,
+        spaceAfter=6,
+        alignment=TA_CENTER
+    ))
+    styles.add(ParagraphStyle(
+        'ContactInfo',
+        parent=styles['Normal'],
+        fontSize=9,
+        alignment=TA_CENTER,
+        spaceAfter=10
+    ))
+    styles.add(ParagraphStyle(
+        'ReportTitle',
+        parent=styles['Heading1'],
+        alignment=TA_CENTER
+    ))
+    styles.add(ParagraphStyle(
+        'ReportCardTitle',
+        parent=styles['Heading1'],
+        fontSize=18,
+        textColor=BRAND_COLOR,
+        spaceAfter=20,
+        alignment=TA_CENTER
+    ))
+    styles.add(ParagraphStyle(
+        'OverallGrade',
+        parent=styles['Normal'],
+        fontSize=24,
+        textColor=BRAND_COLOR,
+        alignment=TA_CENTER
+    ))
+    return styles
+
+
+def _data_table_style(header_font_size, body_font_size, total_row=False):
+    """Branded header row, beige body and grid used by the list reports"""
+    commands = [
+        ('BACKGROUND', (0, 0), (-1, 0), BRAND_COLOR),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), header_font_size),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ]
+    if total_row:
+        commands += [
+            ('BACKGROUND', (0, 1), (-1, -2), colors.beige),
+            ('BACKGROUND', (0, -1), (-1, -1), colors.lightgrey),
+            ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+        ]
+    else:
+        commands.append(('BACKGROUND', (0, 1), (-1, -1), colors.beige))
+    commands += [
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('FONTSIZE', (0, 1), (-1, -1), body_font_size),
+    ]
+    return TableStyle(commands)
+
+
+# Table styles shared by every report (Table.setStyle only reads them)
+DATA_TABLE_STYLE = _data_table_style(12, 10)
+DATA_TABLE_TOTAL_STYLE = _data_table_style(12, 10, total_row=True)
+COMPACT_DATA_TABLE_STYLE = _data_table_style(10, 9)
+
+REPORT_CARD_INFO_STYLE = TableStyle([
+    ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+])
+
+REPORT_CARD_SUMMARY_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), BRAND_COLOR),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 12),
+    ('FONTSIZE', (0, 1), (-1, 1), 14),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+])
+
+REPORT_CARD_SUBJECT_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), BRAND_COLOR),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 10),
+    ('FONTSIZE', (0, 1), (-1, -1), 8),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+    ('TOPPADDING', (0, 0), (-1, -1), 6),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+])
+
+REPORT_CARD_SIGNATURE_STYLE = TableStyle([
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('TOPPADDING', (1, 0), (-1, 0), 30),
+])
+
+
+@lru_cache(maxsize=8)
+def get_logo(logo_path):
+    """
+    Decode the school logo once per process and return an ImageReader, or None.
+    Uploaded logos get a new timestamped filename, so caching by path never goes stale.
+    """
+    if not logo_path:
+        return None
+    try:
+        from PIL import Image as PILImage
+        with PILImage.open(logo_path) as image:
+            image.thumbnail((LOGO_MAX_PIXELS, LOGO_MAX_PIXELS))
+            image.load()
+            reader = ImageReader(image.copy())
+        # Decode now so every page and every document reuses the same pixel data
+        reader.getRGBData()
+        return reader
+    except Exception as e:
+        # If logo fails to load, continue without it
+        print(f"Error loading logo: {e}")
+        return None
+
+
+def _contact_line(school_info):
+    """School address, phone, email and website on one line"""
+    contact_info = school_info.get('school_address', 'Makurdi, Benue State, Nigeria')
+    if school_info.get('school_phone'):
+        contact_info += f" | Phone: {school_info['school_phone']}"
+    if school_info.get('school_email'):
+        contact_info += f" | Email: {school_info['school_email']}"
+    if school_info.get('school_website'):
+        contact_info += f" | Website: {school_info['school_website']}"
+    return contact_info
+
+
+class ThemedDocTemplate(SimpleDocTemplate):
+    """
+    SimpleDocTemplate that draws the school letterhead and a page footer on every page.
+    The letterhead is measured once and reserved inside the top margin, so report
+    flowables no longer need to repeat it. show_generated_on=False leaves the generation date
+    out of the footer, for documents that are cached and served again later.
+    """
+    
+    def __init__(self, filename, school_info=None, **kwargs):
+        kwargs.setdefault('pagesize', A4)
+        self.page_top_margin = kwargs.pop('topMargin', inch)
+        bottom_margin = kwargs.pop('bottomMargin', inch)
+        self.school_info = school_info or {}
+        show_generated_on = kwargs.pop('show_generated_on', True)
+        self.generated_on = datetime.now().strftime('%d/%m/%Y %H:%M') if show_generated_on else None
+        
+        styles = get_styles()
+        self.logo = get_logo(self.school_info.get('logo_path', ''))
+        self.school_title = Paragraph(
+            escape(self.school_info.get('school_name', 'Wajina International School')), styles['SchoolTitle']
+        )
+        self.contact_info = Paragraph(escape(_contact_line(self.school_info)), styles['ContactInfo'])
+        
+        page_width = kwargs['pagesize'][0]
+        text_width = page_width - kwargs.get('leftMargin', inch) - kwargs.get('rightMargin', inch)
+        self.header_height = self._layout_header(text_width)
+        
+        super().__init__(filename, topMargin=self.page_top_margin + self.header_height,
+                         bottomMargin=bottom_margin, **kwargs)
+    
+    def _layout_header(self, text_width):
+        """Wrap the letterhead paragraphs and return the total header height"""
+        height = LOGO_SIZE + LOGO_GAP if self.logo else 0
+        self.school_title_height = self.school_title.wrap(text_width, 1000)[1]
+        self.contact_info_height = self.contact_info.wrap(text_width, 1000)[1]
+        height += self.school_title_height + self.school_title.getSpaceAfter()
+        height += self.contact_info_height + self.contact_info.getSpaceAfter()
+        return height + HEADER_GAP
+    
+    def draw_page(self, canvas, doc):
+        """onPage callback: letterhead at the top, generation date and page number at the bottom"""
+        canvas.saveState()
+        page_width, page_height = self.pagesize
+        y = page_height - self.page_top_margin
+        
+        if self.logo:
+            y -= LOGO_SIZE
+            canvas.drawImage(self.logo, (page_width - LOGO_SIZE) / 2, y,
+                             width=LOGO_SIZE, height=LOGO_SIZE, mask='auto')
+            y -= LOGO_GAP
+        
+        y -= self.school_title_height
+        self.school_title.drawOn(canvas, self.leftMargin, y)
+        y -= self.school_title.getSpaceAfter() + self.contact_info_height
+        self.contact_info.drawOn(canvas, self.leftMargin, y)
+        
+        canvas.setFont('Helvetica', 8)
+        canvas.setFillColor(colors.grey)
+        footer_y = self.bottomMargin / 2
+        if self.generated_on:
+            canvas.drawString(self.leftMargin, footer_y, f"Generated on {self.generated_on}")
+        canvas.drawRightString(page_width - self.rightMargin, footer_y, f"Page {doc.page}")
+        canvas.restoreState()
+    
+    def build(self, flowables, onFirstPage=None, onLaterPages=None, **kwargs):
+        super().build(flowables,
+                      onFirstPage=onFirstPage or self.draw_page,
+                      onLaterPages=onLaterPages or self.draw_page,
+                      **kwargs)
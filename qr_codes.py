@@ -0,0 +1,130 @@
+"""
+QR Code Cache for Wajina Suite
+Generates ID card QR codes once per payload and size and keeps the PNGs in memory and on disk
+"""
+
+from flask import current_app
+from base64 import b64encode
+from functools import lru_cache
+from io import BytesIO
+import hashlib
+import os
+import tempfile
+
+
+# Bump when the generation parameters below change so old PNGs are not reused
+QR_CODE_VERSION = 1
+QR_BOX_SIZE = 10
+QR_BORDER = 4
+
+# PNGs kept per process in front of the disk store (about 1KB each)
+QR_MEMORY_CACHE_SIZE = 2048
+
+# Browser cache lifetime for /qr-codes/<key>.png; a key's image never changes
+QR_CODE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def qr_code_key(payload, box_size=QR_BOX_SIZE):
+    """Content address of a QR code: a hash of the payload and the generation parameters"""
+    source = f"{QR_CODE_VERSION}|{box_size}|{QR_BORDER}|{payload}"
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()[:32]
+
+
+def qr_code_path(folder, key):
+    """Disk location of a cached QR code, fanned out by the first two hex digits"""
+    return os.path.join(folder, key[:2], f'{key}.png')
+
+
+def generate_qr_png(payload, box_size=QR_BOX_SIZE):
+    """Render a QR code to PNG bytes"""
+    import qrcode
+    
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=box_size,
+        border=QR_BORDER,
+    )
+    qr.add_data(payload)
+    qr.make(fit=True)
+    
+    qr_img = qr.make_image(fill_color="black", back_color="white")
+    qr_buffer = BytesIO()
+    qr_img.save(qr_buffer, format='PNG')
+    return qr_buffer.getvalue()
+
+
+def _store(path, png_bytes):
+    """Atomically write a PNG into the disk store; a failed write only costs a regeneration later"""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(png_bytes)
+        os.replace(temp_path, path)
+    except OSError:
+        pass
+
+
+@lru_cache(maxsize=QR_MEMORY_CACHE_SIZE)
+def get_qr_png(payload, box_size=QR_BOX_SIZE, folder=None):
+    """
+    QR code PNG bytes for payload: from this process's LRU, else the disk store in folder,
+    else generated and written to the store. Safe to call from rendering worker processes,
+    which have no app context, by passing the folder explicitly.
+    """
+    if folder:
+        path = qr_code_path(folder, qr_code_key(payload, box_size))
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            pass
+    
+    png_bytes = generate_qr_png(payload, box_size)
+    if folder:
+        _store(path, png_bytes)
+    return png_bytes
+
+
+@lru_cache(maxsize=QR_MEMORY_CACHE_SIZE)
+def get_qr_base64(payload, box_size=QR_BOX_SIZE, folder=None):
+    """Base64 form of get_qr_png, for embedding as a data: URI"""
+    return b64encode(get_qr_png(payload, box_size, folder)).decode()
+
+
+def qr_cache_folder():
+    return current_app.config['QR_CODE_CACHE_FOLDER']
+
+
+def qr_code_png(payload, box_size=QR_BOX_SIZE):
+    """Cached QR code PNG bytes using the app's disk store"""
+    return get_qr_png(payload, box_size, qr_cache_folder())
+
+
+def qr_code_base64(payload, box_size=QR_BOX_SIZE):
+    """Cached base64 QR code PNG using the app's disk store"""
+    return get_qr_base64(payload, box_size, qr_cache_folder())
+
+
+def ensure_qr_code(payload, box_size=QR_BOX_SIZE):
+    """Make sure the QR code is in the disk store and return its key"""
+    folder = qr_cache_folder()
+    key = qr_code_key(payload, box_size)
+    if not os.path.exists(qr_code_path(folder, key)):
+        _store(qr_code_path(folder, key), get_qr_png(payload, box_size, folder))
+    return key
+
+
+def warm_qr_codes(payloads, box_size=QR_BOX_SIZE):
+    """Generate and store QR codes for many payloads (e.g. newly added learners). Returns how many were new"""
+    folder = qr_cache_folder()
+    created = 0
+    for payload in payloads:
+        if not payload:
+            continue
+        path = qr_code_path(folder, qr_code_key(payload, box_size))
+        if not os.path.exists(path):
+            _store(path, generate_qr_png(payload, box_size))
+            created += 1
+    return created
@@ -0,0 +1,50 @@
+"""
+E-Wallet totals verification and rebuild script
+Checks the running totals on each wallet and the daily totals table against the
+transaction history, and rewrites them when they have drifted.
+
+Usage:
+    python rebuild_wallet_totals.py            # verify, rebuild if mismatched
+    python rebuild_wallet_totals.py --verify   # verify only (exit code 1 on mismatch)
+    python rebuild_wallet_totals.py --force    # rebuild unconditionally
+"""
+import sys
+from app import app, db
+from ewallet_service import verify_wallet_totals, rebuild_wallet_totals
+
+
+def main(argv):
+    verify_only = '--verify' in argv
+    force = '--force' in argv
+    
+    with app.app_context():
+        print("Verifying e-wallet totals...")
+        mismatches = verify_wallet_totals()
+        
+        if not mismatches:
+            print("All e-wallet totals match the transaction history.")
+        else:
+            print(f"Found {len(mismatches)} mismatched total(s):")
+            for mismatch in mismatches[:50]:
+                print(f"  - {mismatch}")
+            if len(mismatches) > 50:
+                print(f"  ... and {len(mismatches) - 50} more")
+        
+        if verify_only:
+            return 1 if mismatches else 0
+        
+        if mismatches or force:
+            print("Rebuilding e-wallet totals...")
+            rebuild_wallet_totals()
+            db.session.commit()
+            remaining = verify_wallet_totals()
+            if remaining:
+                print(f"Rebuild finished but {len(remaining)} total(s) still differ (concurrent writes?).")
+                return 1
+            print("E-wallet totals rebuilt successfully!")
+        
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,83 @@
+"""
+Read Replica Routing for Wajina Suite
+With DATABASE_REPLICA_URL set, report views and background report jobs read from a replica while
+attendance, payments and everything else use the primary. replica_reads() marks a view or block
+as read-only. A write inside it switches the rest of the block back to the primary. A browser
+that has just written is kept on the primary for REPLICA_STICKY_SECONDS, so a report opened right
+after a payment shows that payment even if the replica lags.
+"""
+
+from database import db
+from db_engine import engine_options
+from contextlib import contextmanager
+from flask import current_app, has_request_context, session as flask_session
+from sqlalchemy import event
+import time
+
+
+def replica_bind(config):
+    """SQLALCHEMY_BINDS entry for the replica, or None when DATABASE_REPLICA_URL is not set"""
+    url = config.get('DATABASE_REPLICA_URL')
+    if not url:
+        return None
+    if url.startswith('postgres://'):
+        url = url.replace('postgres://', 'postgresql://', 1)
+    return dict(engine_options(dict(config, SQLALCHEMY_DATABASE_URI=url)), url=url)
+
+
+def replica_enabled():
+    return 'replica' in db.engines
+
+
+@contextmanager
+def replica_reads():
+    """Send the SELECTs of a block (or, as @replica_reads(), a view) to the replica"""
+    session = db.session()
+    previous = session.info.get('replica_reads')
+    use_replica = replica_enabled()
+    if use_replica and has_request_context():
+        use_replica = flask_session.get('_primary_until', 0) < time.time()
+    session.info['replica_reads'] = use_replica
+    try:
+        yield
+    finally:
+        session.info['replica_reads'] = previous
+
+
+def replica_iter(iterable):
+    """
+    Iterate over iterable inside replica_reads(). Streamed responses produce their rows after the
+    view, and so its @replica_reads(), has returned; wrap their row or chunk iterators in this.
+    """
+    with replica_reads():
+        yield from iterable
+
+
+def _after_flush(session, flush_context):
+    session.info['wrote'] = True
+
+
+def _on_execute(orm_execute_state):
+    # Bulk UPDATE/DELETE/INSERT statements write without a flush
+    if not orm_execute_state.is_select:
+        orm_execute_state.session.info['wrote'] = True
+
+
+def _after_commit(session):
+    if session.info.pop('wrote', False) and has_request_context():
+        # Later requests from this browser read from the primary until the replica has caught up
+        flask_session['_primary_until'] = time.time() + current_app.config.get('REPLICA_STICKY_SECONDS', 5)
+
+
+def _after_rollback(session, previous_transaction):
+    if not previous_transaction.nested:
+        session.info.pop('wrote', None)
+
+
+def track_replica_writes(session=None):
+    """Keep browsers that just wrote through session (db.session by default) on the primary"""
+    session = session if session is not None else db.session
+    event.listen(session, 'after_flush', _after_flush)
+    event.listen(session, 'do_orm_execute', _on_execute)
+    event.listen(session, 'after_commit', _after_commit)
+    event.listen(session, 'after_soft_rollback', _after_rollback)
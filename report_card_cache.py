@@ -0,0 +1,170 @@
+"""
+Rendered Report Card Cache for Wajina Suite
+Keeps each learner's rendered report card PDF on disk, keyed by a hash of everything printed on it
+"""
+
+from flask import current_app
+from datetime import date
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+
+# Bump when the report card layout in report_utils changes so old renders are not reused
+REPORT_CARD_CACHE_VERSION = 2
+
+# Application settings that affect how grades are printed
+GRADING_SETTING_KEYS = (
+    'GRADE_A_MIN', 'GRADE_B_MIN', 'GRADE_C_MIN', 'GRADE_D_MIN',
+    'GRADE_A_LABEL', 'GRADE_B_LABEL', 'GRADE_C_LABEL', 'GRADE_D_LABEL', 'GRADE_F_LABEL',
+)
+
+# Evict down to this fraction of the size limit so eviction does not run on every store
+EVICT_TO_RATIO = 0.9
+
+
+def _json_default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+def _slug(value):
+    """Filesystem-safe form of a session or term name"""
+    return re.sub(r'[^A-Za-z0-9]+', '-', value or '').strip('-') or 'all'
+
+
+class ReportCardCache:
+    """
+    Disk cache of per-learner report card PDFs with least-recently-used eviction.
+    
+    Files are stored as <learner>/<session>_<term>_<class>_<hash>.pdf; the hash covers the learner's
+    scores, position, subject names, grading settings and school letterhead, so any change
+    produces a new key and the superseded file is removed when the new one is stored.
+    Positions are only ranked for class prints, so a class print (<class>) and a single-learner
+    render (all) are kept side by side instead of replacing each other.
+    Recency is tracked with file modification times, so every worker process shares one cache.
+    """
+    
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        os.makedirs(folder, exist_ok=True)
+    
+    def context_fingerprint(self, filters, school_info, grading_settings):
+        """Hash of the inputs shared by every card in a run (computed once per run)"""
+        school_info = dict(school_info or {})
+        logo_path = school_info.get('logo_path')
+        if logo_path and os.path.exists(logo_path):
+            stat = os.stat(logo_path)
+            school_info['logo_signature'] = [stat.st_size, int(stat.st_mtime)]
+        payload = {
+            'version': REPORT_CARD_CACHE_VERSION,
+            'session': (filters or {}).get('session', ''),
+            'term': (filters or {}).get('term', ''),
+            'school': school_info,
+            'grading': grading_settings or {},
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=_json_default).encode('utf-8')).hexdigest()
+    
+    def content_hash(self, learner_data, context_fingerprint):
+        """Hash of one learner's card content combined with the run fingerprint"""
+        subject_scores = learner_data.get('assessments', {}).get('subject_scores', {})
+        subjects_dict = learner_data.get('subjects_dict', {})
+        payload = {
+            'context': context_fingerprint,
+            'learner': learner_data['learner'],
+            'assessments': learner_data.get('assessments', {}),
+            'totals': learner_data.get('totals'),
+            'averages': learner_data.get('averages'),
+            'position': learner_data.get('position'),
+            # Only the names of subjects printed on this card
+            'subjects': {str(subject_id): subjects_dict.get(subject_id) for subject_id in subject_scores},
+        }
+        encoded = json.dumps(payload, sort_keys=True, default=_json_default).encode('utf-8')
+        return hashlib.sha256(encoded).hexdigest()[:32]
+    
+    def _prefix(self, filters):
+        filters = filters or {}
+        return f"{_slug(filters.get('session'))}_{_slug(filters.get('term'))}_{_slug(filters.get('class'))}_"
+    
+    def _path(self, learner_id, filters, content_hash):
+        return os.path.join(self.folder, str(learner_id), f'{self._prefix(filters)}{content_hash}.pdf')
+    
+    def get(self, learner_id, filters, content_hash):
+        """Return the cached PDF bytes, or None"""
+        path = self._path(learner_id, filters, content_hash)
+        try:
+            with open(path, 'rb') as f:
+                pdf_bytes = f.read()
+            # Mark as recently used
+            os.utime(path, None)
+            return pdf_bytes
+        except OSError:
+            return None
+    
+    def put(self, learner_id, filters, content_hash, pdf_bytes):
+        """Store a rendered card and drop older renders of the same learner, session, term and class"""
+        path = self._path(learner_id, filters, content_hash)
+        learner_folder = os.path.dirname(path)
+        prefix = self._prefix(filters)
+        try:
+            os.makedirs(learner_folder, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=learner_folder, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(pdf_bytes)
+            os.replace(temp_path, path)
+        except OSError:
+            return
+        
+        for entry in os.scandir(learner_folder):
+            if entry.name.startswith(prefix) and entry.path != path:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+    
+    def evict(self):
+        """Remove least recently used files until the cache is back under its size limit"""
+        entries = []
+        total = 0
+        for learner_folder in os.scandir(self.folder):
+            if not learner_folder.is_dir():
+                continue
+            for entry in os.scandir(learner_folder.path):
+                if not entry.name.endswith('.pdf'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        
+        if total <= self.max_bytes:
+            return
+        
+        target = self.max_bytes * EVICT_TO_RATIO
+        for mtime, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+def get_report_card_cache():
+    """Cache configured from the current app"""
+    return ReportCardCache(
+        current_app.config['REPORT_CARD_CACHE_FOLDER'],
+        current_app.config.get('REPORT_CARD_CACHE_MAX_BYTES', 200 * 1024 * 1024)
+    )
+
+
+def get_grading_settings():
+    """Grading settings from the current app config"""
+    return {key: current_app.config.get(key) for key in GRADING_SETTING_KEYS}
@@ -0,0 +1,356 @@
+"""
+Report Card Data and Background Jobs for Wajina Suite
+Builds report card data as plain dicts and renders large report card runs in the background
+"""
+
+from flask import current_app
+from database import db
+from models import (Learner, User, Subject, Assignment, AssignmentResult, Test, TestResult,
+                    Exam, ExamResult, ReportJob)
+from report_utils import (
+    generate_report_card_pdf, render_report_cards, render_pool, merge_pdfs, iter_zip,
+    REPORT_CARD_MAX_WORKERS
+)
+from report_card_cache import get_report_card_cache, get_grading_settings
+from replicas import replica_reads
+from datetime import datetime, timedelta
+import json
+import os
+import re
+import threading
+
+
+# Learner ids per IN (...) clause when loading results
+RESULT_QUERY_BATCH_SIZE = 500
+
+# A running job that has not reported progress for this long is assumed lost (worker restarted)
+REPORT_JOB_STALE_MINUTES = 15
+# Finished jobs and their files are removed after this long
+REPORT_JOB_RETENTION_HOURS = 24
+
+# Background job output formats: job_type -> (file extension, mimetype)
+REPORT_JOB_FORMATS = {
+    'report_cards_pdf': ('pdf', 'application/pdf'),
+    'report_cards_zip': ('zip', 'application/zip'),
+}
+
+# (key in subject_scores, result model, assessment model, foreign key to the assessment)
+RESULT_SOURCES = (
+    ('assignments', AssignmentResult, Assignment, AssignmentResult.assignment_id),
+    ('tests', TestResult, Test, TestResult.test_id),
+    ('exams', ExamResult, Exam, ExamResult.exam_id),
+)
+
+
+def count_report_card_learners(class_filter='', learner_id=None):
+    """Number of learners a report card run would include"""
+    query = Learner.query.filter_by(status='active')
+    if class_filter:
+        query = query.filter_by(current_class=class_filter)
+    if learner_id:
+        query = query.filter_by(id=learner_id)
+    return query.count()
+
+
+def _load_results(learner_ids, session_filter='', term_filter=''):
+    """Yield (kind, learner_id, subject_id, name, score, max_score, grade) for every result"""
+    for kind, result_model, assessment_model, assessment_fk in RESULT_SOURCES:
+        for start in range(0, len(learner_ids), RESULT_QUERY_BATCH_SIZE):
+            batch = learner_ids[start:start + RESULT_QUERY_BATCH_SIZE]
+            query = db.session.query(
+                result_model.learner_id,
+                assessment_model.subject_id,
+                assessment_model.name,
+                result_model.score,
+                assessment_model.max_score,
+                result_model.grade
+            ).join(assessment_model, assessment_fk == assessment_model.id).filter(
+                result_model.learner_id.in_(batch)
+            )
+            if session_filter:
+                query = query.filter(assessment_model.session == session_filter)
+            if term_filter:
+                query = query.filter(assessment_model.term == term_filter)
+            for row in query.order_by(result_model.id):
+                yield (kind,) + tuple(row)
+
+
+def build_report_card_data(class_filter='', session_filter='', term_filter='', learner_id=None):
+    """
+    Build report card data for active learners as plain dicts (no ORM objects), so it can be
+    pickled to rendering worker processes. Results are loaded with one query per assessment
+    type instead of three queries per learner.
+    """
+    query = db.session.query(
+        Learner.id,
+        User.first_name,
+        User.last_name,
+        Learner.admission_number,
+        Learner.current_class,
+        Learner.date_of_birth
+    ).join(User, Learner.user_id == User.id).filter(Learner.status == 'active')
+    
+    if class_filter:
+        query = query.filter(Learner.current_class == class_filter)
+    
+    if learner_id:
+        query = query.filter(Learner.id == learner_id)
+    
+    learners = [row._asdict() for row in query.order_by(Learner.id)]
+    subjects_dict = {subject_id: name for subject_id, name in db.session.query(Subject.id, Subject.name)}
+    
+    # Organize results by learner and subject
+    scores_by_learner = {learner['id']: {} for learner in learners}
+    for kind, result_learner_id, subject_id, name, score, max_score, grade in _load_results(
+            list(scores_by_learner), session_filter, term_filter):
+        subject_scores = scores_by_learner[result_learner_id]
+        if subject_id not in subject_scores:
+            subject_scores[subject_id] = {'assignments': [], 'tests': [], 'exams': []}
+        subject_scores[subject_id][kind].append({
+            'name': name,
+            'score': float(score),
+            'max_score': max_score,
+            'grade': grade,
+        })
+    
+    learners_data = []
+    for learner in learners:
+        subject_scores = scores_by_learner[learner['id']]
+        
+        # Calculate totals and averages
+        subject_totals = {}
+        subject_averages = {}
+        for subject_id, scores in subject_scores.items():
+            results = scores['assignments'] + scores['tests'] + scores['exams']
+            total_score = sum(result['score'] for result in results)
+            total_max = sum(result['max_score'] for result in results)
+            subject_totals[subject_id] = total_score
+            subject_averages[subject_id] = (total_score / total_max * 100) if total_max > 0 else 0
+        
+        overall_total = sum(subject_totals.values())
+        overall_average = sum(subject_averages.values()) / len(subject_averages) if subject_averages else 0
+        
+        learners_data.append({
+            'learner': learner,
+            'assessments': {
+                'subject_scores': subject_scores,
+                'subject_totals': subject_totals,
+                'subject_averages': subject_averages
+            },
+            'totals': overall_total,
+            'averages': overall_average,
+            'position': None,  # Will be calculated below
+            'subjects_dict': subjects_dict
+        })
+    
+    # Calculate positions once every total is known
+    if class_filter:
+        ranked = sorted(learners_data, key=lambda ld: ld['totals'], reverse=True)
+        for idx, ld in enumerate(ranked, start=1):
+            ld['position'] = idx
+    
+    return learners_data
+
+
+def render_report_card_pdfs(learners_data, filters, school_info, progress_callback=None, executor=None):
+    """
+    Return one PDF (bytes) per learner, in order. Cards whose content hash is already in the
+    rendered-card cache are reused; only new or changed cards are rendered (in parallel) and stored.
+    """
+    cache = get_report_card_cache()
+    fingerprint = cache.context_fingerprint(filters, school_info, get_grading_settings())
+    hashes = [cache.content_hash(learner_data, fingerprint) for learner_data in learners_data]
+    pdfs = [
+        cache.get(learner_data['learner']['id'], filters, content_hash)
+        for learner_data, content_hash in zip(learners_data, hashes)
+    ]
+    missing = [index for index, pdf_bytes in enumerate(pdfs) if pdf_bytes is None]
+    cached_count = len(learners_data) - len(missing)
+    
+    if missing:
+        report_progress = None
+        if progress_callback:
+            report_progress = lambda done, total: progress_callback(cached_count + done, len(learners_data))
+        rendered = render_report_cards(
+            [learners_data[index] for index in missing], filters, school_info,
+            chunk_size=current_app.config.get('REPORT_CARD_CHUNK_SIZE') or 50,
+            max_workers=current_app.config.get('REPORT_CARD_WORKERS'),
+            progress_callback=report_progress,
+            executor=executor
+        )
+        for index, pdf_bytes in zip(missing, rendered):
+            cache.put(learners_data[index]['learner']['id'], filters, hashes[index], pdf_bytes)
+            pdfs[index] = pdf_bytes
+        cache.evict()
+    elif progress_callback:
+        progress_callback(len(learners_data), len(learners_data))
+    
+    return pdfs
+
+
+def render_report_card_pdf(learners_data, filters, school_info, output, progress_callback=None):
+    """Write the report cards for learners_data as one PDF to output (path or file object)"""
+    if not learners_data:
+        # Still produce a valid (blank) document
+        merge_pdfs([generate_report_card_pdf([], filters, school_info).getvalue()], output)
+        return
+    merge_pdfs(render_report_card_pdfs(learners_data, filters, school_info, progress_callback), output)
+
+
+def report_card_filename(learner, used_names):
+    """Per-learner PDF name from the admission number, made safe and unique inside a ZIP"""
+    base = re.sub(r'[^A-Za-z0-9._-]+', '-', learner.get('admission_number') or '').strip('-.') or f"learner-{learner['id']}"
+    filename = f'{base}.pdf'
+    counter = 2
+    while filename in used_names:
+        filename = f'{base}-{counter}.pdf'
+        counter += 1
+    used_names.add(filename)
+    return filename
+
+
+def iter_report_card_zip(learners_data, filters, school_info, progress_callback=None):
+    """
+    Yield a ZIP of one PDF per learner (named by admission number), chunk by chunk.
+    Learners are rendered a slice at a time through the rendered-card cache, sharing one
+    process pool, so memory stays bounded by the slice rather than the whole run.
+    """
+    chunk_size = current_app.config.get('REPORT_CARD_CHUNK_SIZE') or 50
+    max_workers = current_app.config.get('REPORT_CARD_WORKERS') or REPORT_CARD_MAX_WORKERS
+    slice_size = chunk_size * max_workers
+    total = len(learners_data)
+    
+    def entries(executor):
+        used_names = set()
+        for start in range(0, total, slice_size):
+            batch = learners_data[start:start + slice_size]
+            batch_progress = None
+            if progress_callback:
+                batch_progress = lambda done, batch_total, start=start: progress_callback(start + done, total)
+            pdfs = render_report_card_pdfs(batch, filters, school_info, batch_progress, executor=executor)
+            for learner_data, pdf_bytes in zip(batch, pdfs):
+                yield report_card_filename(learner_data['learner'], used_names), pdf_bytes
+    
+    executor = render_pool(max_workers) if total > chunk_size else None
+    try:
+        for chunk in iter_zip(entries(executor)):
+            yield chunk
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+def _update_job(job_id, **values):
+    """Write job fields straight to the database so pollers in other workers see them"""
+    values['updated_at'] = datetime.utcnow()
+    db.session.execute(
+        db.update(ReportJob).where(ReportJob.id == job_id).values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+
+def _run_report_card_job(app, job_id):
+    """Thread target: build the data, render it across the process pool and save the PDF or ZIP"""
+    with app.app_context():
+        try:
+            job = db.session.get(ReportJob, job_id)
+            parameters = json.loads(job.parameters or '{}')
+            filters = parameters.get('filters', {})
+            school_info = parameters.get('school_info', {})
+            _update_job(job_id, status='running')
+            
+            # The heavy reads go to the read replica when one is configured
+            with replica_reads():
+                learners_data = build_report_card_data(
+                    class_filter=filters.get('class', ''),
+                    session_filter=filters.get('session', ''),
+                    term_filter=filters.get('term', ''),
+                    learner_id=filters.get('learner_id')
+                )
+            _update_job(job_id, total=len(learners_data))
+            
+            folder = app.config['REPORT_JOBS_FOLDER']
+            os.makedirs(folder, exist_ok=True)
+            extension = REPORT_JOB_FORMATS[job.job_type][0]
+            file_path = os.path.join(folder, f'report_cards_{job_id}.{extension}')
+            partial_path = file_path + '.part'
+            progress = lambda done, total: _update_job(job_id, progress=done)
+            
+            if job.job_type == 'report_cards_zip':
+                with open(partial_path, 'wb') as f:
+                    for chunk in iter_report_card_zip(learners_data, filters, school_info, progress):
+                        f.write(chunk)
+            else:
+                render_report_card_pdf(learners_data, filters, school_info, partial_path, progress)
+            os.replace(partial_path, file_path)
+            
+            _update_job(job_id, status='completed', progress=len(learners_data),
+                        file_path=file_path, completed_at=datetime.utcnow())
+        except Exception as e:
+            db.session.rollback()
+            import traceback
+            traceback.print_exc()
+            _update_job(job_id, status='failed', error_message=str(e), completed_at=datetime.utcnow())
+        finally:
+            db.session.remove()
+
+
+def start_report_card_job(filters, school_info, user_id, output_format='pdf'):
+    """
+    Queue a report card job and start it on a background thread. Returns the job.
+    output_format is 'pdf' (one combined PDF) or 'zip' (one PDF per learner).
+    """
+    cleanup_report_jobs()
+    
+    job_type = f'report_cards_{output_format}'
+    if job_type not in REPORT_JOB_FORMATS:
+        raise ValueError(f'Unsupported report card format: {output_format}')
+    
+    job = ReportJob(
+        job_type=job_type,
+        status='queued',
+        parameters=json.dumps({'filters': filters, 'school_info': school_info}),
+        download_name=f'report_cards_{datetime.now().strftime("%Y%m%d")}.{output_format}',
+        created_by=user_id
+    )
+    db.session.add(job)
+    db.session.commit()
+    
+    thread = threading.Thread(
+        target=_run_report_card_job,
+        args=(current_app._get_current_object(), job.id),
+        name=f'report-job-{job.id}',
+        daemon=True
+    )
+    thread.start()
+    return job
+
+
+def expire_stale_report_job(job):
+    """Mark a job failed if its worker stopped reporting progress (e.g. it was restarted)"""
+    if job.status in ('queued', 'running') and job.updated_at and \
+            job.updated_at < datetime.utcnow() - timedelta(minutes=REPORT_JOB_STALE_MINUTES):
+        job.status = 'failed'
+        job.error_message = 'The job stopped responding. Please start it again.'
+        job.completed_at = datetime.utcnow()
+        db.session.commit()
+    return job
+
+
+def cleanup_report_jobs():
+    """Delete finished jobs older than the retention period along with their files"""
+    cutoff = datetime.utcnow() - timedelta(hours=REPORT_JOB_RETENTION_HOURS)
+    old_jobs = ReportJob.query.filter(
+        ReportJob.status.in_(['completed', 'failed']),
+        ReportJob.created_at < cutoff
+    ).all()
+    for job in old_jobs:
+        if job.file_path and os.path.exists(job.file_path):
+            try:
+                os.remove(job.file_path)
+            except OSError:
+                pass
+        db.session.delete(job)
+    if old_jobs:
+        db.session.commit()
@@ -1,29 +1,99 @@
 """
 Report Generation Utilities for Wajina Suite
-Generates PDF and CSV reports
+Generates PDF, CSV and Excel (XLSX) reports
 """
 
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak, Image
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.platypus import Table, Paragraph, Spacer, PageBreak
 from reportlab.lib.units import inch
-from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
-from io import BytesIO
+from pdf_theme import (
+    ThemedDocTemplate, get_styles, DATA_TABLE_STYLE, DATA_TABLE_TOTAL_STYLE, COMPACT_DATA_TABLE_STYLE,
+    REPORT_CARD_INFO_STYLE, REPORT_CARD_SUMMARY_STYLE, REPORT_CARD_SUBJECT_STYLE, REPORT_CARD_SIGNATURE_STYLE
+)
+from io import BytesIO, StringIO
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import csv
-from datetime import datetime
+import multiprocessing
 import os
+import re
+import tempfile
+import zipfile
+
+
+# Rows per chunk when streaming CSV and per batch when iterating ORM queries
+CSV_CHUNK_ROWS = 500
+QUERY_BATCH_SIZE = 500
+
+# XLSX files are assembled in a spooled temp file: kept in memory up to this size, then on disk
+XLSX_SPOOL_MAX_SIZE = 5 * 1024 * 1024
+XLSX_STREAM_CHUNK_SIZE = 64 * 1024
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Report cards per worker task and the default process pool size for parallel rendering
+REPORT_CARD_CHUNK_SIZE = 50
+REPORT_CARD_MAX_WORKERS = min(os.cpu_count() or 1, 4)
+
+
+def iter_query(query, batch_size=QUERY_BATCH_SIZE):
+    """Iterate a query in fixed-size batches instead of loading every row with .all()"""
+    return query.yield_per(batch_size)
+
+
+def iter_csv(rows, chunk_rows=CSV_CHUNK_ROWS, encoding='utf-8', bom=True):
+    """
+    Encode an iterable of CSV rows into byte chunks.
+    The csv module needs a text stream, so rows are written to a small StringIO that is
+    encoded and emptied every chunk_rows rows. A UTF-8 BOM lets Excel read the ₦ sign.
+    """
+    text_buffer = StringIO()
+    writer = csv.writer(text_buffer)
+    if bom:
+        text_buffer.write('\ufeff')
+    
+    pending = 0
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= chunk_rows:
+            yield text_buffer.getvalue().encode(encoding)
+            text_buffer.seek(0)
+            text_buffer.truncate(0)
+            pending = 0
+    
+    remainder = text_buffer.getvalue()
+    if remainder:
+        yield remainder.encode(encoding)
+
+
+def csv_buffer_from_rows(rows):
+    """Build an in-memory CSV (e.g. for email attachments) from an iterable of rows"""
+    buffer = BytesIO()
+    for chunk in iter_csv(rows):
+        buffer.write(chunk)
+    buffer.seek(0)
+    return buffer
+
+
+def stream_csv_response(rows, filename):
+    """Return a chunked Flask response that writes CSV rows as they are produced"""
+    from flask import Response, stream_with_context
+    return Response(
+        stream_with_context(iter_csv(rows)),
+        mimetype='text/csv',
+        headers={
+            'Content-Disposition': f'attachment; filename={filename}',
+            'X-Accel-Buffering': 'no'
+        }
+    )
 
 
 def get_school_info():
     """Get school information from Flask app config"""
     try:
         from flask import current_app
+        from storage import get_storage
         logo_path = ''
         if current_app.config.get('SCHOOL_LOGO'):
-            logo_full_path = os.path.join(current_app.config.get('UPLOAD_FOLDER', 'static/uploads'), current_app.config['SCHOOL_LOGO'])
-            if os.path.exists(logo_full_path):
-                logo_path = logo_full_path
+            logo_path = get_storage().local_path(current_app.config['SCHOOL_LOGO']) or ''
         
         return {
             'school_name': current_app.config.get('SCHOOL_NAME', 'Wajina International School'),
@@ -44,81 +114,18 @@ def get_school_info():
         }
 
 
-def create_report_header(styles, school_info=None):
-    """Create a header with school logo, name, address, and contact"""
-    elements = []
-    
-    if school_info is None:
-        school_info = get_school_info()
-    
-    # Logo
-    if school_info.get('logo_path') and os.path.exists(school_info['logo_path']):
-        try:
-            logo = Image(school_info['logo_path'], width=1.5*inch, height=1.5*inch)
-            # Center the logo by wrapping in a table
-            logo_table = Table([[logo]], colWidths=[7.5*inch])
-            logo_table.setStyle(TableStyle([
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ]))
-            elements.append(logo_table)
-            elements.append(Spacer(1, 0.1*inch))
-        except Exception as e:
-            # If logo fails to load, continue without it
-            import traceback
-            print(f"Error loading logo: {e}")
-            traceback.print_exc()
-            pass
-    
-    # School name
-    title_style = ParagraphStyle(
-        'SchoolTitle',
-        parent=styles['Heading1'],
-        fontSize=16,
-        textColor=colors.HexColor('#9ACD32'),
-        spaceAfter=6,
-        alignment=TA_CENTER
-    )
-    elements.append(Paragraph(school_info.get('school_name', 'Wajina International School'), title_style))
-    
-    # Address and contact
-    contact_info = school_info.get('school_address', 'Makurdi, Benue State, Nigeria')
-    if school_info.get('school_phone'):
-        contact_info += f" | Phone: {school_info['school_phone']}"
-    if school_info.get('school_email'):
-        contact_info += f" | Email: {school_info['school_email']}"
-    if school_info.get('school_website'):
-        contact_info += f" | Website: {school_info['school_website']}"
-    
-    contact_style = ParagraphStyle(
-        'ContactInfo',
-        parent=styles['Normal'],
-        fontSize=9,
-        alignment=TA_CENTER,
-        spaceAfter=10
-    )
-    elements.append(Paragraph(contact_info, contact_style))
-    
-    # Horizontal line
-    elements.append(Spacer(1, 0.1*inch))
-    
-    return elements
-
-
 def generate_learner_pdf(learners, filters=None, school_info=None):
     """Generate PDF report for learners"""
     buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4)
-    elements = []
-    styles = getSampleStyleSheet()
     
     # Get school info if not provided
     if school_info is None:
         school_info = get_school_info()
     
-    # Create header
-    header_elements = create_report_header(styles, school_info)
-    elements.extend(header_elements)
+    # School letterhead and footer are drawn on every page by the template
+    doc = ThemedDocTemplate(buffer, school_info)
+    elements = []
+    styles = get_styles()
     
     # Title
     title = Paragraph("LEARNER REPORT", styles['Heading1'])
@@ -152,17 +159,7 @@ def generate_learner_pdf(learners, filters=None, school_info=None):
     
     # Create table
     table = Table(table_data, colWidths=[1.5*inch, 2.5*inch, 1.5*inch, 1*inch, 1.5*inch])
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#9ACD32')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 12),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('FONTSIZE', (0, 1), (-1, -1), 10),
-    ]))
+    table.setStyle(DATA_TABLE_STYLE)
     
     elements.append(table)
     
@@ -175,17 +172,15 @@ def generate_learner_pdf(learners, filters=None, school_info=None):
 def generate_attendance_pdf(attendance_data, filters=None, school_info=None):
     """Generate PDF report for attendance"""
     buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4)
-    elements = []
-    styles = getSampleStyleSheet()
     
     # Get school info if not provided
     if school_info is None:
         school_info = get_school_info()
     
-    # Create header
-    header_elements = create_report_header(styles, school_info)
-    elements.extend(header_elements)
+    # School letterhead and footer are drawn on every page by the template
+    doc = ThemedDocTemplate(buffer, school_info)
+    elements = []
+    styles = get_styles()
     
     # Title
     title = Paragraph("ATTENDANCE REPORT", styles['Heading1'])
@@ -224,17 +219,7 @@ def generate_attendance_pdf(attendance_data, filters=None, school_info=None):
     
     # Create table
     table = Table(table_data, colWidths=[2*inch, 1.5*inch, 1*inch, 1*inch, 1*inch, 1.5*inch])
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#9ACD32')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 12),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('FONTSIZE', (0, 1), (-1, -1), 10),
-    ]))
+    table.setStyle(DATA_TABLE_STYLE)
     
     elements.append(table)
     
@@ -247,17 +232,15 @@ def generate_attendance_pdf(attendance_data, filters=None, school_info=None):
 def generate_fee_pdf(fees, filters=None, school_info=None):
     """Generate PDF report for fees"""
     buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4)
-    elements = []
-    styles = getSampleStyleSheet()
     
     # Get school info if not provided
     if school_info is None:
         school_info = get_school_info()
     
-    # Create header
-    header_elements = create_report_header(styles, school_info)
-    elements.extend(header_elements)
+    # School letterhead and footer are drawn on every page by the template
+    doc = ThemedDocTemplate(buffer, school_info)
+    elements = []
+    styles = get_styles()
     
     # Title
     title = Paragraph("FEE REPORT", styles['Heading1'])
@@ -286,19 +269,7 @@ def generate_fee_pdf(fees, filters=None, school_info=None):
     
     # Create table
     table = Table(table_data, colWidths=[2*inch, 1.5*inch, 1.5*inch, 1.2*inch, 1.2*inch, 1*inch])
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#9ACD32')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 12),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -2), colors.beige),
-        ('BACKGROUND', (0, -1), (-1, -1), colors.lightgrey),
-        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('FONTSIZE', (0, 1), (-1, -1), 10),
-    ]))
+    table.setStyle(DATA_TABLE_TOTAL_STYLE)
     
     elements.append(table)
     
@@ -308,71 +279,78 @@ def generate_fee_pdf(fees, filters=None, school_info=None):
     return buffer
 
 
-def generate_learner_csv(learners, filters=None):
-    """Generate CSV report for learners"""
-    buffer = BytesIO()
-    writer = csv.writer(buffer)
-    
+def learner_csv_rows(learners):
+    """Yield CSV rows for a learner report"""
     # Header
-    writer.writerow(['Admission Number', 'First Name', 'Last Name', 'Class', 'Gender', 'Status'])
+    yield ['Admission Number', 'First Name', 'Last Name', 'Class', 'Gender', 'Status']
     
     # Data rows
     for learner in learners:
-        writer.writerow([
+        yield [
             learner.admission_number,
             learner.user.first_name,
             learner.user.last_name,
             learner.current_class or 'N/A',
             learner.gender,
             learner.status
-        ])
-    
-    buffer.seek(0)
-    return buffer
+        ]
 
 
-def generate_attendance_csv(attendance_data, filters=None):
-    """Generate CSV report for attendance"""
-    buffer = BytesIO()
-    writer = csv.writer(buffer)
-    
+def generate_learner_csv(learners, filters=None):
+    """Generate CSV report for learners"""
+    return csv_buffer_from_rows(learner_csv_rows(learners))
+
+
+def attendance_csv_rows(attendance_data):
+    """
+    Yield CSV rows for an attendance report.
+    Accepts either {'learner': Learner, 'present': ..} entries or the flat
+    {'first_name': .., 'present_days': ..} dicts built by the report routes.
+    """
     # Header
-    writer.writerow(['Learner Name', 'Admission Number', 'Class', 'Present', 'Absent', 'Late', 'Attendance %'])
+    yield ['Learner Name', 'Admission Number', 'Class', 'Present', 'Absent', 'Late', 'Attendance %']
     
     # Data rows
     for data in attendance_data:
-        learner = data['learner']
-        present = data.get('present', 0)
-        absent = data.get('absent', 0)
-        late = data.get('late', 0)
+        if 'learner' in data:
+            learner = data['learner']
+            name = f"{learner.user.first_name} {learner.user.last_name}"
+            admission_number = learner.admission_number
+            current_class = learner.current_class
+        else:
+            name = f"{data.get('first_name', '')} {data.get('last_name', '')}"
+            admission_number = data.get('admission_number')
+            current_class = data.get('current_class')
+        present = data.get('present', data.get('present_days', 0))
+        absent = data.get('absent', data.get('absent_days', 0))
+        late = data.get('late', data.get('late_days', 0))
         total = present + absent + late
         percentage = (present / total * 100) if total > 0 else 0
         
-        writer.writerow([
-            f"{learner.user.first_name} {learner.user.last_name}",
-            learner.admission_number,
-            learner.current_class or 'N/A',
+        yield [
+            name,
+            admission_number,
+            current_class or 'N/A',
             present,
             absent,
             late,
             f"{percentage:.1f}%"
-        ])
-    
-    buffer.seek(0)
-    return buffer
+        ]
 
 
-def generate_fee_csv(fees, filters=None):
-    """Generate CSV report for fees"""
-    buffer = BytesIO()
-    writer = csv.writer(buffer)
-    
+def generate_attendance_csv(attendance_data, filters=None):
+    """Generate CSV report for attendance"""
+    return csv_buffer_from_rows(attendance_csv_rows(attendance_data))
+
+
+def fee_csv_rows(fees):
+    """Yield CSV rows for a fee report"""
     # Header
-    writer.writerow(['Learner Name', 'Admission Number', 'Fee Type', 'Amount', 'Due Date', 'Paid Date', 'Status'])
+    yield ['Learner Name', 'Admission Number', 'Fee Type', 'Amount', 'Due Date', 'Paid Date', 'Status']
     
     # Data rows
     for fee in fees:
-        writer.writerow([
+        yield [
             f"{fee.learner.user.first_name} {fee.learner.user.last_name}",
             fee.learner.admission_number,
             fee.fee_type,
@@ -380,26 +358,26 @@ def generate_fee_csv(fees, filters=None):
             fee.due_date.strftime('%d/%m/%Y') if fee.due_date else 'N/A',
             fee.paid_date.strftime('%d/%m/%Y') if fee.paid_date else 'N/A',
             fee.status
-        ])
-    
-    buffer.seek(0)
-    return buffer
+        ]
+
+
+def generate_fee_csv(fees, filters=None):
+    """Generate CSV report for fees"""
+    return csv_buffer_from_rows(fee_csv_rows(fees))
 
 
 def generate_store_pdf(items, filters=None, school_info=None):
     """Generate PDF report for store items"""
     buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4)
-    elements = []
-    styles = getSampleStyleSheet()
     
     # Get school info if not provided
     if school_info is None:
         school_info = get_school_info()
     
-    # Create header
-    header_elements = create_report_header(styles, school_info)
-    elements.extend(header_elements)
+    # School letterhead and footer are drawn on every page by the template
+    doc = ThemedDocTemplate(buffer, school_info)
+    elements = []
+    styles = get_styles()
     
     # Title
     title = Paragraph("STORE INVENTORY REPORT", styles['Heading1'])
@@ -433,17 +411,7 @@ def generate_store_pdf(items, filters=None, school_info=None):
     
     # Create table
     table = Table(table_data, colWidths=[1*inch, 2*inch, 1*inch, 0.8*inch, 0.8*inch, 1*inch, 1.2*inch, 1*inch])
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#9ACD32')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('FONTSIZE', (0, 1), (-1, -1), 9),
-    ]))
+    table.setStyle(COMPACT_DATA_TABLE_STYLE)
     
     elements.append(table)
     
@@ -456,17 +424,15 @@ def generate_store_pdf(items, filters=None, school_info=None):
 def generate_expenditure_pdf(expenditures, filters=None, school_info=None):
     """Generate PDF report for expenditures"""
     buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4)
-    elements = []
-    styles = getSampleStyleSheet()
     
     # Get school info if not provided
     if school_info is None:
         school_info = get_school_info()
     
-    # Create header
-    header_elements = create_report_header(styles, school_info)
-    elements.extend(header_elements)
+    # School letterhead and footer are drawn on every page by the template
+    doc = ThemedDocTemplate(buffer, school_info)
+    elements = []
+    styles = get_styles()
     
     # Title
     title = Paragraph("EXPENDITURE REPORT", styles['Heading1'])
@@ -499,17 +465,7 @@ def generate_expenditure_pdf(expenditures, filters=None, school_info=None):
     
     # Create table
     table = Table(table_data, colWidths=[1.2*inch, 2*inch, 1*inch, 1.2*inch, 1.2*inch, 1*inch, 1.5*inch])
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#9ACD32')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('FONTSIZE', (0, 1), (-1, -1), 9),
-    ]))
+    table.setStyle(COMPACT_DATA_TABLE_STYLE)
     
     elements.append(table)
     
@@ -519,17 +475,14 @@ def generate_expenditure_pdf(expenditures, filters=None, school_info=None):
     return buffer
 
 
-def generate_store_csv(items, filters=None):
-    """Generate CSV report for store items"""
-    buffer = BytesIO()
-    writer = csv.writer(buffer)
-    
+def store_csv_rows(items):
+    """Yield CSV rows for a store inventory report"""
     # Header
-    writer.writerow(['Item Code', 'Item Name', 'Category', 'Quantity', 'Unit', 'Unit Price', 'Total Value', 'Status'])
+    yield ['Item Code', 'Item Name', 'Category', 'Quantity', 'Unit', 'Unit Price', 'Total Value', 'Status']
     
     # Data rows
     for item in items:
-        writer.writerow([
+        yield [
             item.item_code,
             item.item_name,
             item.category,
@@ -538,25 +491,24 @@ def generate_store_csv(items, filters=None):
             float(item.unit_price),
             float(item.total_value),
             item.status
-        ])
-    
-    buffer.seek(0)
-    return buffer
+        ]
 
 
-def generate_expenditure_csv(expenditures, filters=None):
-    """Generate CSV report for expenditures"""
-    buffer = BytesIO()
-    writer = csv.writer(buffer)
-    
+def generate_store_csv(items, filters=None):
+    """Generate CSV report for store items"""
+    return csv_buffer_from_rows(store_csv_rows(items))
+
+
+def expenditure_csv_rows(expenditures):
+    """Yield CSV rows for an expenditure report"""
     # Header
-    writer.writerow(['Expense Code', 'Title', 'Category', 'Amount', 'Payment Date', 'Payment Method',
-                     'Receipt Number', 'Vendor', 'Status', 'Approved By', 'Session', 'Term'])
+    yield ['Expense Code', 'Title', 'Category', 'Amount', 'Payment Date', 'Payment Method',
+           'Receipt Number', 'Vendor', 'Status', 'Approved By', 'Session', 'Term']
     
     # Data rows
     for exp in expenditures:
         approver_name = f"{exp.approver.first_name} {exp.approver.last_name}" if exp.approver else 'N/A'
-        writer.writerow([
+        yield [
             exp.expense_code,
             exp.title,
             exp.category,
@@ -569,29 +521,48 @@ def generate_expenditure_csv(expenditures, filters=None):
             approver_name,
             exp.session or 'N/A',
             exp.term or 'N/A'
-        ])
+        ]
+
+
+def generate_expenditure_csv(expenditures, filters=None):
+    """Generate CSV report for expenditures"""
+    return csv_buffer_from_rows(expenditure_csv_rows(expenditures))
+
+
+def parent_csv_rows(parents_data):
+    """Yield CSV rows for a parent/guardian report"""
+    # Header
+    yield ['Parent/Guardian Name', 'Phone', 'Email', 'Address', 'Number of Children', 'Children (Name - Admission Number)']
     
-    buffer.seek(0)
-    return buffer
+    # Data rows
+    for parent in parents_data:
+        yield [
+            parent['parent_name'],
+            parent['parent_phone'],
+            parent['parent_email'],
+            parent['parent_address'],
+            parent['children_count'],
+            parent['children_names']
+        ]
 
 
 def generate_report_card_pdf(learners_data, filters=None, school_info=None):
     """Generate PDF report cards for learners"""
     buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=0.5*inch, bottomMargin=0.5*inch)
-    elements = []
-    styles = getSampleStyleSheet()
     
     # Get school info if not provided
     if school_info is None:
         school_info = get_school_info()
     
+    # School letterhead and footer are drawn on every page by the template. Cards are cached and
+    # merged into later prints (report_card_cache), so they carry no generation date
+    doc = ThemedDocTemplate(buffer, school_info, topMargin=0.5*inch, bottomMargin=0.5*inch,
+                            show_generated_on=False)
+    elements = []
+    styles = get_styles()
+    
     # Process each learner
     for learner_data in learners_data:
-        # Create header for each learner
-        header_elements = create_report_header(styles, school_info)
-        elements.extend(header_elements)
-        
         learner = learner_data['learner']
         assessments = learner_data.get('assessments', {})
         totals = learner_data.get('totals', 0)
@@ -600,34 +571,17 @@ def generate_report_card_pdf(learners_data, filters=None, school_info=None):
         subjects_dict = learner_data.get('subjects_dict', {})
         
         # Title
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=18,
-            textColor=colors.HexColor('#9ACD32'),
-            spaceAfter=20,
-            alignment=TA_CENTER
-        )
-        elements.append(Paragraph("TERMLY REPORT CARD", title_style))
+        elements.append(Paragraph("TERMLY REPORT CARD", styles['ReportCardTitle']))
         elements.append(Spacer(1, 0.2*inch))
         
         # Learner Information
         info_data = [
-            ['Name:', f"{learner.user.first_name} {learner.user.last_name}", 'Admission Number:', learner.admission_number],
-            ['Class:', learner.current_class or 'N/A', 'Session:', filters.get('session', 'N/A') if filters else 'N/A'],
-            ['Term:', filters.get('term', 'N/A') if filters else 'N/A', 'Date of Birth:', learner.date_of_birth.strftime('%d/%m/%Y') if learner.date_of_birth else 'N/A'],
+            ['Name:', f"{learner['first_name']} {learner['last_name']}", 'Admission Number:', learner['admission_number']],
+            ['Class:', learner['current_class'] or 'N/A', 'Session:', filters.get('session', 'N/A') if filters else 'N/A'],
+            ['Term:', filters.get('term', 'N/A') if filters else 'N/A', 'Date of Birth:', learner['date_of_birth'].strftime('%d/%m/%Y') if learner['date_of_birth'] else 'N/A'],
         ]
         info_table = Table(info_data, colWidths=[1.5*inch, 2.5*inch, 1.5*inch, 2.5*inch])
-        info_table.setStyle(TableStyle([
-            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('ALIGN', (0, 0), (0, -1), 'LEFT'),
-            ('ALIGN', (1, 0), (1, -1), 'LEFT'),
-            ('ALIGN', (2, 0), (2, -1), 'LEFT'),
-            ('ALIGN', (3, 0), (3, -1), 'LEFT'),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-        ]))
+        info_table.setStyle(REPORT_CARD_INFO_STYLE)
         elements.append(info_table)
         elements.append(Spacer(1, 0.2*inch))
         
@@ -638,16 +592,7 @@ def generate_report_card_pdf(learners_data, filters=None, school_info=None):
             [f"{totals:.2f}", f"{averages:.2f}%", pos_str]
         ]
         summary_table = Table(summary_data, colWidths=[2.5*inch, 2.5*inch, 2.5*inch])
-        summary_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#9ACD32')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('FONTSIZE', (0, 1), (-1, 1), 14),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ]))
+        summary_table.setStyle(REPORT_CARD_SUMMARY_STYLE)
         elements.append(summary_table)
         elements.append(Spacer(1, 0.3*inch))
         
@@ -711,18 +656,7 @@ def generate_report_card_pdf(learners_data, filters=None, school_info=None):
             
             # Create table
             subject_table = Table(table_data, colWidths=[1.2*inch, 1.5*inch, 1.5*inch, 1.5*inch, 0.8*inch, 0.8*inch, 0.7*inch])
-            subject_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#9ACD32')),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 10),
-                ('FONTSIZE', (0, 1), (-1, -1), 8),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-                ('TOPPADDING', (0, 0), (-1, -1), 6),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black),
-                ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-            ]))
+            subject_table.setStyle(REPORT_CARD_SUBJECT_STYLE)
             elements.append(subject_table)
             elements.append(Spacer(1, 0.3*inch))
         
@@ -743,14 +677,7 @@ def generate_report_card_pdf(learners_data, filters=None, school_info=None):
             overall_grade = 'F'
             remark = 'Needs Improvement'
         
-        grade_style = ParagraphStyle(
-            'OverallGrade',
-            parent=styles['Normal'],
-            fontSize=24,
-            textColor=colors.HexColor('#9ACD32'),
-            alignment=TA_CENTER
-        )
-        elements.append(Paragraph(f"Overall Grade: {overall_grade} ({remark})", grade_style))
+        elements.append(Paragraph(f"Overall Grade: {overall_grade} ({remark})", styles['OverallGrade']))
         elements.append(Spacer(1, 0.3*inch))
         
         # Signatures
@@ -759,12 +686,7 @@ def generate_report_card_pdf(learners_data, filters=None, school_info=None):
             ['_________________', '_________________', '_________________']
         ]
         sig_table = Table(signature_data, colWidths=[2.5*inch, 2.5*inch, 2.5*inch])
-        sig_table.setStyle(TableStyle([
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('TOPPADDING', (1, 0), (-1, 0), 30),
-        ]))
+        sig_table.setStyle(REPORT_CARD_SIGNATURE_STYLE)
         elements.append(sig_table)
         
         # Page break between learners - ensure each report card is on its own page
@@ -778,14 +700,128 @@ def generate_report_card_pdf(learners_data, filters=None, school_info=None):
     return buffer
 
 
-def generate_report_card_csv(learners_data, filters=None):
-    """Generate CSV report cards for learners"""
-    buffer = BytesIO()
-    writer = csv.writer(buffer)
+def render_report_card_chunk(learners_data, filters=None, school_info=None):
+    """Render each learner's report card to its own PDF and return the list of bytes (runs in a worker process)"""
+    return [
+        generate_report_card_pdf([learner_data], filters, school_info or {}).getvalue()
+        for learner_data in learners_data
+    ]
+
+
+def render_pool(max_workers=None):
+    """
+    Process pool for report card and ID card rendering, or None when only one worker would be used.
+    spawn rather than fork: the pool is started from a thread inside a web worker
+    that holds database connections and locks the children must not inherit.
+    """
+    workers = max_workers or REPORT_CARD_MAX_WORKERS
+    if workers <= 1:
+        return None
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+def render_report_cards(learners_data, filters=None, school_info=None, chunk_size=REPORT_CARD_CHUNK_SIZE,
+                        max_workers=None, progress_callback=None, executor=None):
+    """
+    Render one PDF per learner, in chunks across a process pool, and return them in input order.
+    
+    learners_data must be plain data (see report_cards.build_report_card_data) so chunks can be
+    pickled to the workers. progress_callback, if given, is called with (learners rendered,
+    total learners) as each chunk finishes. Pass executor (see render_pool) to reuse one
+    pool across several calls; otherwise a pool is started for this call when worthwhile.
+    """
+    total = len(learners_data)
+    chunks = [learners_data[i:i + chunk_size] for i in range(0, total, chunk_size)]
+    rendered = [None] * len(chunks)
+    done = 0
+    
+    own_executor = None
+    if executor is None and len(chunks) > 1:
+        executor = own_executor = render_pool(min(max_workers or REPORT_CARD_MAX_WORKERS, len(chunks)))
+    
+    try:
+        if executor is None:
+            for index, chunk in enumerate(chunks):
+                rendered[index] = render_report_card_chunk(chunk, filters, school_info)
+                done += len(chunk)
+                if progress_callback:
+                    progress_callback(done, total)
+        else:
+            futures = {
+                executor.submit(render_report_card_chunk, chunk, filters, school_info): index
+                for index, chunk in enumerate(chunks)
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                rendered[index] = future.result()
+                done += len(chunks[index])
+                if progress_callback:
+                    progress_callback(done, total)
+    finally:
+        if own_executor is not None:
+            own_executor.shutdown()
+    
+    return [pdf_bytes for chunk_pdfs in rendered for pdf_bytes in chunk_pdfs]
+
+
+def merge_pdfs(pdfs, output):
+    """Concatenate PDF documents (bytes) into output, a path or binary file object"""
+    from pypdf import PdfWriter
+    
+    writer = PdfWriter()
+    for pdf_bytes in pdfs:
+        writer.append(BytesIO(pdf_bytes))
+    # Every document embeds its own copy of the school logo; keep just one
+    writer.compress_identical_objects()
+    writer.write(output)
+
+
+class _ZipChunkBuffer:
+    """Write-only file object that hands back whatever zipfile has written so far"""
+    
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+    
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+    
+    def tell(self):
+        return self._position
+    
+    def flush(self):
+        pass
     
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_zip(entries):
+    """
+    Yield a ZIP archive chunk by chunk from (filename, bytes) entries without holding the
+    archive in memory. PDFs are already compressed, so entries are stored, not deflated.
+    """
+    buffer = _ZipChunkBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for filename, data in entries:
+            archive.writestr(filename, data)
+            chunk = buffer.drain()
+            if chunk:
+                yield chunk
+    chunk = buffer.drain()
+    if chunk:
+        yield chunk
+
+
+def report_card_csv_rows(learners_data, filters=None):
+    """Yield CSV rows for termly report cards"""
     # Header
-    writer.writerow(['Report Card - Termly Assessment Results'])
-    writer.writerow([])
+    yield ['Report Card - Termly Assessment Results']
+    yield []
     
     # Process each learner
     for learner_data in learners_data:
@@ -796,19 +832,19 @@ def generate_report_card_csv(learners_data, filters=None):
         position = learner_data.get('position')
         subjects_dict = learner_data.get('subjects_dict', {})
         
-        writer.writerow(['=' * 80])
-        writer.writerow(['LEARNER INFORMATION'])
-        writer.writerow(['=' * 80])
-        writer.writerow(['Name:', f"{learner.user.first_name} {learner.user.last_name}"])
-        writer.writerow(['Admission Number:', learner.admission_number])
-        writer.writerow(['Class:', learner.current_class or 'N/A'])
-        writer.writerow(['Session:', filters.get('session', 'N/A') if filters else 'N/A'])
-        writer.writerow(['Term:', filters.get('term', 'N/A') if filters else 'N/A'])
-        writer.writerow(['Total Score:', f"{totals:.2f}"])
-        writer.writerow(['Average Score:', f"{averages:.2f}%"])
+        yield ['=' * 80]
+        yield ['LEARNER INFORMATION']
+        yield ['=' * 80]
+        yield ['Name:', f"{learner['first_name']} {learner['last_name']}"]
+        yield ['Admission Number:', learner['admission_number']]
+        yield ['Class:', learner['current_class'] or 'N/A']
+        yield ['Session:', filters.get('session', 'N/A') if filters else 'N/A']
+        yield ['Term:', filters.get('term', 'N/A') if filters else 'N/A']
+        yield ['Total Score:', f"{totals:.2f}"]
+        yield ['Average Score:', f"{averages:.2f}%"]
         pos_str = f"{position}{'st' if position == 1 else 'nd' if position == 2 else 'rd' if position == 3 else 'th'}" if position else 'N/A'
-        writer.writerow(['Class Position:', pos_str])
-        writer.writerow([])
+        yield ['Class Position:', pos_str]
+        yield []
         
         # Subject-wise breakdown
         subject_scores = assessments.get('subject_scores', {})
@@ -816,9 +852,9 @@ def generate_report_card_csv(learners_data, filters=None):
         subject_averages = assessments.get('subject_averages', {})
         
         if subject_scores:
-            writer.writerow(['SUBJECT-WISE PERFORMANCE'])
-            writer.writerow(['-' * 80])
-            writer.writerow(['Subject', 'Assignments', 'Tests', 'Exams', 'Total Score', 'Average', 'Grade'])
+            yield ['SUBJECT-WISE PERFORMANCE']
+            yield ['-' * 80]
+            yield ['Subject', 'Assignments', 'Tests', 'Exams', 'Total Score', 'Average', 'Grade']
             
             for subject_id, scores in subject_scores.items():
                 subject_name = subjects_dict.get(subject_id, 'N/A')
@@ -843,11 +879,203 @@ def generate_report_card_csv(learners_data, filters=None):
                 else:
                     grade = 'F'
                 
-                writer.writerow([subject_name, assignments, tests, exams, f"{total:.2f}", f"{avg:.2f}%", grade])
+                yield [subject_name, assignments, tests, exams, f"{total:.2f}", f"{avg:.2f}%", grade]
             
-            writer.writerow([])
+            yield []
         
-        writer.writerow([])
+        yield []
+
+
+def generate_report_card_csv(learners_data, filters=None):
+    """Generate CSV report cards for learners"""
+    return csv_buffer_from_rows(report_card_csv_rows(learners_data, filters))
+
+
+def _xlsx_sheet_title(title, used_titles):
+    """Make a valid, unique Excel sheet title (max 31 chars, no []:*?/\\)"""
+    clean = re.sub(r'[\[\]:*?/\\]', '-', str(title or 'Sheet')).strip() or 'Sheet'
+    clean = clean[:31]
+    candidate = clean
+    counter = 2
+    while candidate.lower() in used_titles:
+        suffix = f' ({counter})'
+        candidate = clean[:31 - len(suffix)] + suffix
+        counter += 1
+    used_titles.add(candidate.lower())
+    return candidate
+
+
+def build_xlsx_workbook(sheets):
+    """
+    Write sheets to an XLSX file using openpyxl's write-only mode.
+    sheets is an iterable of (title, header, rows, column_formats) where rows is any
+    iterable (e.g. a yield_per query) and column_formats maps column index -> number format.
+    Rows are written as they arrive, so memory stays bounded for term-wide exports.
+    Returns a spooled temporary file positioned at the start.
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font, PatternFill
+    
+    workbook = Workbook(write_only=True)
+    header_font = Font(bold=True, color='FFFFFF')
+    header_fill = PatternFill(start_color='9ACD32', end_color='9ACD32', fill_type='solid')
+    used_titles = set()
+    
+    for title, header, rows, column_formats in sheets:
+        sheet = workbook.create_sheet(title=_xlsx_sheet_title(title, used_titles))
+        column_formats = column_formats or {}
+        
+        header_cells = []
+        for value in header:
+            cell = WriteOnlyCell(sheet, value=value)
+            cell.font = header_font
+            cell.fill = header_fill
+            header_cells.append(cell)
+        sheet.append(header_cells)
+        
+        for row in rows:
+            if column_formats:
+                cells = []
+                for index, value in enumerate(row):
+                    if index in column_formats and value is not None:
+                        cell = WriteOnlyCell(sheet, value=value)
+                        cell.number_format = column_formats[index]
+                        cells.append(cell)
+                    else:
+                        cells.append(value)
+                sheet.append(cells)
+            else:
+                sheet.append(list(row))
+    
+    spooled = tempfile.SpooledTemporaryFile(max_size=XLSX_SPOOL_MAX_SIZE)
+    workbook.save(spooled)
+    spooled.seek(0)
+    return spooled
+
+
+def stream_xlsx_response(sheets, filename):
+    """Build an XLSX workbook from sheets and stream it back in fixed-size chunks"""
+    from flask import Response
     
-    buffer.seek(0)
-    return buffer
+    spooled = build_xlsx_workbook(sheets)
+    spooled.seek(0, os.SEEK_END)
+    size = spooled.tell()
+    spooled.seek(0)
+    
+    def generate():
+        try:
+            while True:
+                chunk = spooled.read(XLSX_STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            spooled.close()
+    
+    return Response(
+        generate(),
+        mimetype=XLSX_MIMETYPE,
+        headers={
+            'Content-Disposition': f'attachment; filename={filename}',
+            'Content-Length': str(size)
+        }
+    )
+
+
+MONEY_FORMAT = '#,##0.00'
+DATE_FORMAT = 'DD/MM/YYYY'
+
+FEE_XLSX_HEADER = ['Learner Name', 'Admission Number', 'Class', 'Fee Type', 'Amount', 'Due Date',
+                   'Paid Date', 'Payment Method', 'Receipt Number', 'Status', 'Session', 'Term']
+FEE_XLSX_FORMATS = {4: MONEY_FORMAT, 5: DATE_FORMAT, 6: DATE_FORMAT}
+
+
+def fee_xlsx_rows(fees):
+    """Yield typed XLSX rows for fees"""
+    for fee in fees:
+        yield [
+            f"{fee.learner.user.first_name} {fee.learner.user.last_name}",
+            fee.learner.admission_number,
+            fee.learner.current_class or '',
+            fee.fee_type,
+            float(fee.amount),
+            fee.due_date,
+            fee.paid_date,
+            fee.payment_method or '',
+            fee.receipt_number or '',
+            fee.status,
+            fee.session or '',
+            fee.term or ''
+        ]
+
+
+EXPENDITURE_XLSX_HEADER = ['Expense Code', 'Title', 'Category', 'Amount', 'Payment Date', 'Payment Method',
+                           'Receipt Number', 'Vendor', 'Status', 'Approved By', 'Session', 'Term']
+EXPENDITURE_XLSX_FORMATS = {3: MONEY_FORMAT, 4: DATE_FORMAT}
+
+
+def expenditure_xlsx_rows(expenditures):
+    """Yield typed XLSX rows for expenditures"""
+    for exp in expenditures:
+        yield [
+            exp.expense_code,
+            exp.title,
+            exp.category,
+            float(exp.amount),
+            exp.payment_date,
+            exp.payment_method or '',
+            exp.receipt_number or '',
+            exp.vendor or '',
+            exp.status,
+            f"{exp.approver.first_name} {exp.approver.last_name}" if exp.approver else '',
+            exp.session or '',
+            exp.term or ''
+        ]
+
+
+SALARY_XLSX_HEADER = ['Staff ID', 'Staff Name', 'Month', 'Year', 'Basic Salary', 'Allowances', 'Deductions',
+                      'Advance Deduction', 'Net Salary', 'Payment Date', 'Payment Method', 'Status']
+SALARY_XLSX_FORMATS = {4: MONEY_FORMAT, 5: MONEY_FORMAT, 6: MONEY_FORMAT, 7: MONEY_FORMAT,
+                       8: MONEY_FORMAT, 9: DATE_FORMAT}
+
+
+def salary_xlsx_rows(salaries):
+    """Yield typed XLSX rows for salaries"""
+    for salary in salaries:
+        yield [
+            salary.staff.staff_id,
+            f"{salary.staff.user.first_name} {salary.staff.user.last_name}",
+            salary.month,
+            salary.year,
+            float(salary.basic_salary or 0),
+            float(salary.allowances or 0),
+            float(salary.deductions or 0),
+            float(salary.advance_deduction or 0),
+            float(salary.net_salary or 0),
+            salary.payment_date,
+            salary.payment_method or '',
+            salary.status
+        ]
+
+
+STORE_XLSX_HEADER = ['Item Code', 'Item Name', 'Category', 'Quantity', 'Unit', 'Unit Price',
+                     'Total Value', 'Min Quantity', 'Location', 'Status']
+STORE_XLSX_FORMATS = {5: MONEY_FORMAT, 6: MONEY_FORMAT}
+
+
+def store_xlsx_rows(items):
+    """Yield typed XLSX rows for store items"""
+    for item in items:
+        yield [
+            item.item_code,
+            item.item_name,
+            item.category,
+            float(item.quantity or 0),
+            item.unit,
+            float(item.unit_price or 0),
+            float(item.total_value),
+            float(item.min_quantity or 0),
+            item.location or '',
+            item.status
+        ]
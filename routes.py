@@ -4,29 +4,66 @@ Routes for Wajina Suite
 
 from app import app, login_manager, mail
 from database import db
-from flask import render_template, request, redirect, url_for, flash, jsonify, send_file, Response
+from flask import render_template, request, redirect, url_for, flash, jsonify, send_file, Response, stream_with_context, abort, make_response, session as flask_session
 from flask_login import login_user, login_required, logout_user, current_user
 from flask_mail import Message
-from models import User, Learner, Staff, Class, Subject, Attendance, Fee, Exam, ExamResult, AcademicRecord, StoreItem, StoreTransaction, Expenditure, Assignment, AssignmentResult, Test, TestResult, AdmissionApplication, PaymentTransaction, Salary, SalaryAdvance, SchoolTimetable, ExamTimetable, EWallet, EWalletTransaction
+from models import User, Learner, Staff, Class, Subject, Attendance, Fee, Exam, ExamResult, AcademicRecord, StoreItem, StoreTransaction, Expenditure, Assignment, AssignmentResult, Test, TestResult, AdmissionApplication, PaymentTransaction, Salary, SalaryAdvance, SchoolTimetable, ExamTimetable, EWallet, EWalletTransaction, ReportJob
 from datetime import datetime, date, timedelta
 from functools import wraps
 from sqlalchemy import case
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import joinedload, contains_eager
 from report_utils import (
     generate_learner_pdf, generate_attendance_pdf, generate_fee_pdf,
     generate_learner_csv, generate_attendance_csv, generate_fee_csv,
     generate_store_pdf, generate_expenditure_pdf, generate_store_csv, generate_expenditure_csv,
-    generate_report_card_pdf, generate_report_card_csv
+    generate_report_card_pdf,
+    iter_query, stream_csv_response, learner_csv_rows, attendance_csv_rows, fee_csv_rows,
+    store_csv_rows, expenditure_csv_rows, parent_csv_rows, report_card_csv_rows,
+    stream_xlsx_response, fee_xlsx_rows, expenditure_xlsx_rows, salary_xlsx_rows, store_xlsx_rows,
+    FEE_XLSX_HEADER, FEE_XLSX_FORMATS, EXPENDITURE_XLSX_HEADER, EXPENDITURE_XLSX_FORMATS,
+    SALARY_XLSX_HEADER, SALARY_XLSX_FORMATS, STORE_XLSX_HEADER, STORE_XLSX_FORMATS, MONEY_FORMAT
+)
+from ewallet_service import (
+    credit_wallet, debit_wallet, complete_pending_deposit, get_wallet_totals_summary,
+    InsufficientFundsError, TransactionAlreadyProcessedError
+)
+from pagination import keyset_paginate
+from file_delivery import send_local_file
+from assets import built_service_worker, precompressed_variant, ASSET_DIST_FOLDER, ASSET_MAX_AGE
+from storage import get_storage, save_upload, delete_upload, file_url
+from image_uploads import save_uploaded_photo, photo_url
+from qr_codes import qr_code_base64, ensure_qr_code, qr_code_path, warm_qr_codes, QR_CODE_MAX_AGE
+from data_versions import versions_etag, code_version
+from fragment_cache import version_key
+from lookups import distinct_values
+from identity import current_learner, current_staff
+from db_engine import pool_metrics
+from replicas import replica_reads, replica_iter
+from login_security import normalize_login, find_login_user, login_retry_after, record_failed_login, clear_failed_logins, rehash_password
+from id_cards import build_learner_cards, build_staff_cards, render_id_card_sheets, sheet_layout
+from report_cards import (
+    build_report_card_data, count_report_card_learners, render_report_card_pdf, render_report_card_pdfs,
+    iter_report_card_zip, start_report_card_job, expire_stale_report_job, REPORT_JOB_FORMATS
 )
 import os
 from io import BytesIO
 import csv
 import json
 import uuid
-import qrcode
+import re
+import mimetypes
+from werkzeug.security import safe_join
 from PIL import Image, ImageDraw, ImageFont
 
 
+# Templates pick downscaled photos with {{ photo_url(learner.passport_photograph, 'thumb') }}
+app.add_template_global(photo_url)
+# Other uploads (logo, backgrounds, documents) with {{ file_url(settings.school_logo) }}
+app.add_template_global(file_url)
+# Fragment cache keys from data versions: {% cache ('grid', version_key('class:' ~ class_obj.id)) %}
+app.add_template_global(version_key)
+
+
 def role_required(*roles):
     """Decorator to require specific roles"""
     def decorator(f):
@@ -41,6 +78,50 @@ def role_required(*roles):
     return decorator
 
 
+def conditional_page(scopes_for):
+    """
+    Decorator answering If-None-Match with 304 for pages whose data is covered by data version scopes.
+    scopes_for(*args, **kwargs) returns the scopes the page reads (a cheap query at most), or None to
+    always render. The ETag also covers the user, the URL, saved settings and the deployed code.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            # Pages that will show pending flash messages must not be cached
+            if request.method != 'GET' or flask_session.get('_flashes'):
+                return f(*args, **kwargs)
+            scopes = scopes_for(*args, **kwargs)
+            if scopes is None:
+                return f(*args, **kwargs)
+            
+            settings_file = get_settings_file_path()
+            settings_stamp = os.stat(settings_file).st_mtime_ns if os.path.exists(settings_file) else 0
+            etag = versions_etag([f'user:{current_user.id}'] + list(scopes),
+                                 code_version(app.root_path), settings_stamp, current_user.id, request.full_path)
+            
+            if request.if_none_match.contains_weak(etag):
+                response = app.response_class(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            # Browsers keep the page but revalidate it on every visit
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        return decorated_function
+    return decorator
+
+
+def own_learner_scopes():
+    """Scopes of the logged-in learner's own pages"""
+    learner = current_learner()
+    if learner is None:
+        return None
+    return [f'learner:{learner.id}', 'academics']
+
+
 def get_settings_file_path():
     """Get path to settings JSON file"""
     return os.path.join('instance', 'settings.json')
@@ -257,6 +338,42 @@ def get_school_settings():
     }
 
 
+def get_id_card_settings():
+    """ID card layout settings shared by the on-screen, print and batch sheet ID cards"""
+    return {
+        'width': app.config.get('ID_CARD_WIDTH', 500),
+        'height': app.config.get('ID_CARD_HEIGHT', 0),
+        'border_radius': app.config.get('ID_CARD_BORDER_RADIUS', 15),
+        'bg_color': app.config.get('ID_CARD_BG_COLOR', '#ffffff'),
+        'header_bg_color': app.config.get('ID_CARD_HEADER_BG_COLOR', '#32CD32'),
+        'footer_bg_color': app.config.get('ID_CARD_FOOTER_BG_COLOR', '#f8f9fa'),
+        'border_color': app.config.get('ID_CARD_BORDER_COLOR', '#32CD32'),
+        'border_width': app.config.get('ID_CARD_BORDER_WIDTH', 3),
+        'logo_position': app.config.get('ID_CARD_LOGO_POSITION', 'top-center'),
+        'logo_height': app.config.get('ID_CARD_LOGO_HEIGHT', 60),
+        'logo_margin_bottom': app.config.get('ID_CARD_LOGO_MARGIN_BOTTOM', 10),
+        'photo_position': app.config.get('ID_CARD_PHOTO_POSITION', 'left'),
+        'photo_width': app.config.get('ID_CARD_PHOTO_WIDTH', 150),
+        'photo_height': app.config.get('ID_CARD_PHOTO_HEIGHT', 180),
+        'photo_border_color': app.config.get('ID_CARD_PHOTO_BORDER_COLOR', '#32CD32'),
+        'photo_border_width': app.config.get('ID_CARD_PHOTO_BORDER_WIDTH', 3),
+        'text_position': app.config.get('ID_CARD_TEXT_POSITION', 'right'),
+        'name_font_size': app.config.get('ID_CARD_NAME_FONT_SIZE', 18),
+        'label_font_size': app.config.get('ID_CARD_LABEL_FONT_SIZE', 14),
+        'value_font_size': app.config.get('ID_CARD_VALUE_FONT_SIZE', 16),
+        'text_color': app.config.get('ID_CARD_TEXT_COLOR', '#000000'),
+        'label_color': app.config.get('ID_CARD_LABEL_COLOR', '#666666'),
+        'qr_position': app.config.get('ID_CARD_QR_POSITION', 'bottom-center'),
+        'qr_size': app.config.get('ID_CARD_QR_SIZE', 120),
+        'show_qr': app.config.get('ID_CARD_SHOW_QR', True),
+        'header_title_size': app.config.get('ID_CARD_HEADER_TITLE_SIZE', 21),
+        'header_subtitle_size': app.config.get('ID_CARD_HEADER_SUBTITLE_SIZE', 14),
+        'header_text_color': app.config.get('ID_CARD_HEADER_TEXT_COLOR', '#ffffff'),
+        'footer_text_color': app.config.get('ID_CARD_FOOTER_TEXT_COLOR', '#666666'),
+        'footer_font_size': app.config.get('ID_CARD_FOOTER_FONT_SIZE', 12),
+    }
+
+
 
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -264,24 +381,23 @@ def login():
     if current_user.is_authenticated:
         return redirect(url_for('dashboard'))
     
+    status = 200
     if request.method == 'POST':
-        username = request.form.get('username', '').strip()
+        username = normalize_login(request.form.get('username'))
         password = request.form.get('password')
         remember = bool(request.form.get('remember'))
         
-        # Try to find user by username, email, or phone number
-        user = None
-        if username:
-            # Try username first
-            user = User.query.filter_by(username=username).first()
-            # If not found, try email
-            if not user:
-                user = User.query.filter_by(email=username).first()
-            # If still not found, try phone number
-            if not user:
-                user = User.query.filter_by(phone=username).first()
-        
-        if user and user.check_password(password) and user.is_active:
+        # One query over username, email and phone number
+        user = find_login_user(username)
+        # Throttled accounts and clients are turned away before any password hash check
+        retry_after = login_retry_after(username, user)
+        
+        if retry_after:
+            flash(f'Too many failed login attempts. Please try again in {(retry_after + 59) // 60} minute(s).', 'danger')
+            status = 429
+        elif user and password and user.check_password(password) and user.is_active:
+            clear_failed_logins(username, user)
+            rehash_password(user, password)
             login_user(user, remember=remember)
             next_page = request.args.get('next')
             if next_page:
@@ -296,6 +412,7 @@ def login():
             else:
                 return redirect(url_for('dashboard'))
         else:
+            record_failed_login(username, user)
             flash('Invalid username or password.', 'danger')
     
     # Get login page settings - always reload from file to get latest
@@ -319,7 +436,7 @@ def login():
         'login_show_default_credentials': bool(app.config.get('LOGIN_SHOW_DEFAULT_CREDENTIALS', True)),
     }
     
-    return render_template('auth/login.html', settings=login_settings)
+    return render_template('auth/login.html', settings=login_settings), status
 
 
 @app.route('/')
@@ -375,15 +492,36 @@ def offline():
 @app.route('/manifest.json')
 def manifest():
     """Serve web app manifest"""
-    from flask import send_from_directory
-    return send_from_directory('static', 'manifest.json', mimetype='application/json')
+    return send_local_file(os.path.join(app.static_folder, 'manifest.json'), mimetype='application/json')
 
 
 @app.route('/service-worker.js')
 def service_worker():
-    """Serve service worker"""
-    from flask import send_from_directory
-    return send_from_directory('static/js', 'service-worker.js', mimetype='application/javascript')
+    """Serve service worker (the built copy carries the precache list of fingerprinted assets)"""
+    return send_local_file(built_service_worker(app.static_folder), mimetype='application/javascript')
+
+
+@app.route('/static/dist/<path:filename>')
+def fingerprinted_asset(filename):
+    """
+    Serve a fingerprinted asset built by build_assets.py. The name changes with the content,
+    so it is cached as immutable for a year; the precompressed .br/.gz variant is sent when
+    the browser accepts it.
+    """
+    dist_folder = os.path.join(app.static_folder, ASSET_DIST_FOLDER)
+    path = safe_join(dist_folder, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    
+    served_path, encoding = precompressed_variant(path)
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    response = send_file(served_path, mimetype=mimetype, max_age=ASSET_MAX_AGE, conditional=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
 
 
 @app.route('/privacy-policy')
@@ -649,31 +787,15 @@ def dashboard():
             total_wallets = EWallet.query.count()
             active_wallets = EWallet.query.filter_by(status='active').count()
             
-            # Total deposits (all time)
-            total_deposits = db.session.query(db.func.sum(EWalletTransaction.amount)).filter(
-                EWalletTransaction.transaction_type == 'deposit',
-                EWalletTransaction.status == 'completed'
-            ).scalar() or 0
-            
-            # Total deposits this month
+            # Deposits, withdrawals and payments come from the maintained daily totals table
+            all_time_totals = get_wallet_totals_summary()
             month_start = date.today().replace(day=1)
-            deposits_this_month = db.session.query(db.func.sum(EWalletTransaction.amount)).filter(
-                EWalletTransaction.transaction_type == 'deposit',
-                EWalletTransaction.status == 'completed',
-                EWalletTransaction.created_at >= month_start
-            ).scalar() or 0
-            
-            # Total withdrawals
-            total_withdrawals = db.session.query(db.func.sum(EWalletTransaction.amount)).filter(
-                EWalletTransaction.transaction_type == 'withdrawal',
-                EWalletTransaction.status == 'completed'
-            ).scalar() or 0
+            month_totals = get_wallet_totals_summary(since=month_start)
             
-            # Total payments from wallets
-            total_wallet_payments = db.session.query(db.func.sum(EWalletTransaction.amount)).filter(
-                EWalletTransaction.transaction_type == 'payment',
-                EWalletTransaction.status == 'completed'
-            ).scalar() or 0
+            total_deposits = all_time_totals.get('deposit', 0)
+            deposits_this_month = month_totals.get('deposit', 0)
+            total_withdrawals = all_time_totals.get('withdrawal', 0)
+            total_wallet_payments = all_time_totals.get('payment', 0)
             
             stats['total_wallet_balance'] = float(total_wallet_balance)
             stats['total_wallets'] = total_wallets
@@ -683,7 +805,7 @@ def dashboard():
             stats['total_withdrawals'] = float(total_withdrawals)
             stats['total_wallet_payments'] = float(total_wallet_payments)
         elif current_user.role == 'teacher':
-            staff = Staff.query.filter_by(user_id=current_user.id).first()
+            staff = current_staff()
             if staff:
                 stats['my_classes'] = Class.query.filter_by(class_teacher_id=staff.id).count()
                 stats['my_subjects'] = Subject.query.filter_by(teacher_id=staff.id).count()
@@ -691,7 +813,7 @@ def dashboard():
                 stats['my_classes'] = 0
                 stats['my_subjects'] = 0
         elif current_user.role == 'learner':
-            learner = Learner.query.filter_by(user_id=current_user.id).first()
+            learner = current_learner()
             if learner:
                 stats['my_attendance'] = Attendance.query.filter_by(learner_id=learner.id).count()
                 stats['pending_fees'] = Fee.query.filter_by(learner_id=learner.id, status='pending').count()
@@ -785,13 +907,10 @@ def add_learner():
                         return render_template('learners/add.html', classes=classes, current_date=date.today())
                     
                     # Generate unique filename using the auto-generated admission number
-                    filename = f"passport_{admission_number}_{datetime.now().strftime('%Y%m%d%H%M%S')}.{file_ext}"
-                    filepath = os.path.join(app.config['UPLOAD_FOLDER'], 'passports', filename)
-                    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+                    filename = f"passport_{admission_number}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
                     
-                    # Save file
-                    file.save(filepath)
-                    passport_photo_path = f"passports/{filename}"
+                    # Save a downscaled, metadata-free copy plus its variants
+                    passport_photo_path = save_uploaded_photo(file, 'passports', filename)
             
             # Create user account
             user = User(
@@ -831,6 +950,9 @@ def add_learner():
             db.session.add(learner)
             db.session.commit()
             
+            # Pre-generate the ID card QR code so the first ID card view is a cache hit
+            warm_qr_codes([learner.admission_number])
+            
             flash('Learner added successfully!', 'success')
             return redirect(url_for('learners'))
         except Exception as e:
@@ -904,13 +1026,10 @@ def add_staff():
                     # Generate unique filename
                     first_name_clean = request.form.get('first_name', 'staff').replace(' ', '_').replace('/', '_')
                     last_name_clean = request.form.get('last_name', 'member').replace(' ', '_').replace('/', '_')
-                    filename = f"staff_{first_name_clean}_{last_name_clean}_{datetime.now().strftime('%Y%m%d%H%M%S')}.{file_ext}"
-                    filepath = os.path.join(app.config['UPLOAD_FOLDER'], 'profiles', filename)
-                    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+                    filename = f"staff_{first_name_clean}_{last_name_clean}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
                     
-                    # Save file
-                    file.save(filepath)
-                    passport_photo_path = f"profiles/{filename}"
+                    # Save a downscaled, metadata-free copy plus its variants
+                    passport_photo_path = save_uploaded_photo(file, 'profiles', filename)
             
             # Auto-generate staff ID
             first_name = request.form.get('first_name', '').upper()
@@ -970,6 +1089,9 @@ def add_staff():
             db.session.add(staff)
             db.session.commit()
             
+            # Pre-generate the ID card QR code so the first ID card view is a cache hit
+            warm_qr_codes([staff.staff_id])
+            
             flash('Staff member added successfully!', 'success')
             return redirect(url_for('staff'))
         except Exception as e:
@@ -1056,7 +1178,7 @@ def mark_attendance():
 @login_required
 @role_required('admin', 'accountant', 'cashier')
 def fees():
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor', '')
     status_filter = request.args.get('status', '')
     
     query = Fee.query
@@ -1064,9 +1186,7 @@ def fees():
     if status_filter:
         query = query.filter_by(status=status_filter)
     
-    fees = query.order_by(Fee.due_date.desc()).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    fees = keyset_paginate(query, Fee.due_date, Fee.id, cursor=cursor, per_page=20, with_total=True)
     
     return render_template('fees/list.html', fees=fees, status_filter=status_filter)
 
@@ -1580,8 +1700,7 @@ def subjects():
     staff = Staff.query.filter_by(status='active').all()
     
     # Get categories for filter
-    categories = db.session.query(Subject.category).distinct().all()
-    categories = [cat[0] for cat in categories if cat[0]]
+    categories = distinct_values(Subject.category)
     
     return render_template('subjects/list.html', 
                          subjects=subjects_list, 
@@ -1756,10 +1875,8 @@ def timetables():
     classes = Class.query.filter_by(status='active').all()
     
     # Get unique sessions and terms
-    sessions = db.session.query(SchoolTimetable.session).distinct().all()
-    sessions = [s[0] for s in sessions if s[0]]
-    terms = db.session.query(SchoolTimetable.term).distinct().all()
-    terms = [t[0] for t in terms if t[0]]
+    sessions = distinct_values(SchoolTimetable.session)
+    terms = distinct_values(SchoolTimetable.term)
     
     return render_template('timetables/list.html',
                          timetables=timetables_list,
@@ -1771,9 +1888,15 @@ def timetables():
                          terms=terms)
 
 
+def timetable_scopes(class_id):
+    """Scopes of a class timetable: its entries, plus subject and teacher names"""
+    return [f'class:{class_id}', 'academics', 'staff']
+
+
 @app.route('/timetables/view/<int:class_id>')
 @login_required
 @role_required('admin', 'teacher', 'learner', 'parent')
+@conditional_page(timetable_scopes)
 def view_timetable(class_id):
     """View timetable for a specific class"""
     class_obj = Class.query.get_or_404(class_id)
@@ -1806,10 +1929,11 @@ def view_timetable(class_id):
                 timetable_grid[day][timetable.period] = timetable
     
     # Get unique sessions and terms
-    sessions = db.session.query(SchoolTimetable.session).filter_by(class_id=class_id).distinct().all()
-    sessions = [s[0] for s in sessions if s[0]]
-    terms = db.session.query(SchoolTimetable.term).filter_by(class_id=class_id).distinct().all()
-    terms = [t[0] for t in terms if t[0]]
+    sessions = distinct_values(SchoolTimetable.session, class_id=class_id)
+    terms = distinct_values(SchoolTimetable.term, class_id=class_id)
+    
+    # The timetable grid is a {% cache %} block, shared by every user of the same role
+    timetable_cache_key = versions_etag(timetable_scopes(class_id), current_user.role, session_filter, term_filter)
     
     return render_template('timetables/view.html',
                          class_obj=class_obj,
@@ -1818,7 +1942,8 @@ def view_timetable(class_id):
                          session_filter=session_filter,
                          term_filter=term_filter,
                          sessions=sessions,
-                         terms=terms)
+                         terms=terms,
+                         timetable_cache_key=timetable_cache_key)
 
 
 @app.route('/timetables/add', methods=['GET', 'POST'])
@@ -2072,12 +2197,9 @@ def exam_timetables():
     classes = Class.query.filter_by(status='active').all()
     
     # Get unique exam types, sessions, and terms
-    exam_types = db.session.query(ExamTimetable.exam_type).distinct().all()
-    exam_types = [et[0] for et in exam_types if et[0]]
-    sessions = db.session.query(ExamTimetable.session).distinct().all()
-    sessions = [s[0] for s in sessions if s[0]]
-    terms = db.session.query(ExamTimetable.term).distinct().all()
-    terms = [t[0] for t in terms if t[0]]
+    exam_types = distinct_values(ExamTimetable.exam_type)
+    sessions = distinct_values(ExamTimetable.session)
+    terms = distinct_values(ExamTimetable.term)
     
     return render_template('exam_timetables/list.html',
                          exam_timetables=exam_timetables_list,
@@ -2116,12 +2238,9 @@ def view_exam_timetable(class_id):
     ).all()
     
     # Get unique exam types, sessions, and terms
-    exam_types = db.session.query(ExamTimetable.exam_type).filter_by(class_id=class_id).distinct().all()
-    exam_types = [et[0] for et in exam_types if et[0]]
-    sessions = db.session.query(ExamTimetable.session).filter_by(class_id=class_id).distinct().all()
-    sessions = [s[0] for s in sessions if s[0]]
-    terms = db.session.query(ExamTimetable.term).filter_by(class_id=class_id).distinct().all()
-    terms = [t[0] for t in terms if t[0]]
+    exam_types = distinct_values(ExamTimetable.exam_type, class_id=class_id)
+    sessions = distinct_values(ExamTimetable.session, class_id=class_id)
+    terms = distinct_values(ExamTimetable.term, class_id=class_id)
     
     return render_template('exam_timetables/view.html',
                          class_obj=class_obj,
@@ -2374,24 +2493,10 @@ def ewallet():
         user_id=current_user.id
     ).order_by(EWalletTransaction.created_at.desc()).limit(10).all()
     
-    # Get transaction statistics
-    total_deposits = db.session.query(db.func.sum(EWalletTransaction.amount)).filter_by(
-        user_id=current_user.id,
-        transaction_type='deposit',
-        status='completed'
-    ).scalar() or 0
-    
-    total_withdrawals = db.session.query(db.func.sum(EWalletTransaction.amount)).filter_by(
-        user_id=current_user.id,
-        transaction_type='withdrawal',
-        status='completed'
-    ).scalar() or 0
-    
-    total_payments = db.session.query(db.func.sum(EWalletTransaction.amount)).filter_by(
-        user_id=current_user.id,
-        transaction_type='payment',
-        status='completed'
-    ).scalar() or 0
+    # Transaction statistics are running totals kept on the wallet by ewallet_service
+    total_deposits = ewallet.total_deposits or 0
+    total_withdrawals = ewallet.total_withdrawals or 0
+    total_payments = ewallet.total_payments or 0
     
     return render_template('ewallet/index.html',
                          ewallet=ewallet,
@@ -2540,23 +2645,20 @@ def ewallet_flutterwave_callback():
             
             if transaction and transaction.status == 'pending':
                 if status == 'successful':
-                    # Update wallet balance
-                    ewallet = transaction.ewallet
-                    transaction.balance_before = ewallet.balance
-                    ewallet.balance += amount
-                    transaction.balance_after = ewallet.balance
-                    transaction.status = 'completed'
-                    transaction.flutterwave_tx_id = str(tx_id)
-                    ewallet.updated_at = datetime.utcnow()
-                    
-                    db.session.commit()
+                    # Credit wallet atomically (no-op if verify-payment already settled it)
+                    try:
+                        complete_pending_deposit(transaction, amount, flutterwave_tx_id=tx_id)
+                        db.session.commit()
+                    except TransactionAlreadyProcessedError:
+                        db.session.rollback()
+                        return jsonify({'status': 'success'}), 200
                     
                     # Send notification email
                     try:
                         msg = Message(
                             subject='E-Wallet Deposit Successful',
                             recipients=[transaction.user.email],
-                            body=f'Your deposit of ₦{amount:,.2f} has been credited to your e-wallet. New balance: ₦{ewallet.balance:,.2f}'
+                            body=f'Your deposit of ₦{amount:,.2f} has been credited to your e-wallet. New balance: ₦{transaction.balance_after:,.2f}'
                         )
                         mail.send(msg)
                     except:
@@ -2617,16 +2719,14 @@ def ewallet_verify_payment(tx_ref):
             if data.get('status') == 'success' and data.get('data', {}).get('status') == 'successful':
                 amount = float(data.get('data', {}).get('amount', 0))
                 
-                # Update wallet balance
-                ewallet = transaction.ewallet
-                transaction.balance_before = ewallet.balance
-                ewallet.balance += amount
-                transaction.balance_after = ewallet.balance
-                transaction.status = 'completed'
-                transaction.flutterwave_tx_id = str(data.get('data', {}).get('id', ''))
-                ewallet.updated_at = datetime.utcnow()
-                
-                db.session.commit()
+                # Credit wallet atomically (no-op if the webhook already settled it)
+                try:
+                    complete_pending_deposit(transaction, amount, flutterwave_tx_id=data.get('data', {}).get('id'))
+                    db.session.commit()
+                except TransactionAlreadyProcessedError:
+                    db.session.rollback()
+                    flash('Payment verified successfully!', 'success')
+                    return redirect(url_for('ewallet'))
                 
                 flash(f'Payment verified successfully! ₦{amount:,.2f} has been credited to your wallet.', 'success')
                 return redirect(url_for('ewallet'))
@@ -2675,30 +2775,26 @@ def ewallet_withdraw():
             # Create withdrawal transaction
             tx_ref = f"WITHDRAW_{current_user.id}_{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8].upper()}"
             
-            transaction = EWalletTransaction(
-                ewallet_id=ewallet.id,
-                user_id=current_user.id,
-                transaction_type='withdrawal',
-                amount=amount,
-                balance_before=ewallet.balance,
-                balance_after=ewallet.balance - amount,
-                currency='NGN',
-                status='pending',
-                payment_method='bank_transfer',
-                transaction_reference=tx_ref,
-                description=f'Withdrawal to {bank_name} - {account_number}',
-                transaction_metadata=json.dumps({
-                    'bank_name': bank_name,
-                    'account_number': account_number,
-                    'account_name': account_name
-                })
-            )
-            
-            # Update wallet balance
-            ewallet.balance -= amount
-            ewallet.updated_at = datetime.utcnow()
+            # Hold the funds now; the balance check is re-applied inside the UPDATE
+            try:
+                debit_wallet(
+                    ewallet, amount,
+                    transaction_type='withdrawal',
+                    status='pending',
+                    payment_method='bank_transfer',
+                    transaction_reference=tx_ref,
+                    description=f'Withdrawal to {bank_name} - {account_number}',
+                    transaction_metadata=json.dumps({
+                        'bank_name': bank_name,
+                        'account_number': account_number,
+                        'account_name': account_name
+                    })
+                )
+            except InsufficientFundsError:
+                db.session.rollback()
+                flash('Insufficient wallet balance', 'danger')
+                return redirect(url_for('ewallet_withdraw'))
             
-            db.session.add(transaction)
             db.session.commit()
             
             flash('Withdrawal request submitted successfully. It will be processed within 24-48 hours.', 'success')
@@ -2724,6 +2820,7 @@ def ewallet_transactions():
     status_filter = request.args.get('status', '')
     date_from = request.args.get('date_from', '')
     date_to = request.args.get('date_to', '')
+    cursor = request.args.get('cursor', '')
     
     query = EWalletTransaction.query.filter_by(user_id=current_user.id)
     
@@ -2744,7 +2841,8 @@ def ewallet_transactions():
         except:
             pass
     
-    transactions = query.order_by(EWalletTransaction.created_at.desc()).all()
+    transactions = keyset_paginate(query, EWalletTransaction.created_at, EWalletTransaction.id,
+                                   cursor=cursor, per_page=20)
     
     return render_template('ewallet/transactions.html',
                          ewallet=ewallet,
@@ -2765,7 +2863,7 @@ def ewallet_pay_fee(fee_id):
         
         # Verify user has permission to pay this fee
         if current_user.role == 'learner':
-            learner = Learner.query.filter_by(user_id=current_user.id).first()
+            learner = current_learner()
             if not learner or fee.learner_id != learner.id:
                 flash('You do not have permission to pay this fee.', 'danger')
                 return redirect(url_for('fees'))
@@ -2792,30 +2890,31 @@ def ewallet_pay_fee(fee_id):
         # Create payment transaction
         tx_ref = f"FEEPAY_{fee.id}_{current_user.id}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
         
-        transaction = EWalletTransaction(
-            ewallet_id=ewallet.id,
-            user_id=current_user.id,
-            transaction_type='payment',
-            amount=fee.amount,
-            balance_before=ewallet.balance,
-            balance_after=ewallet.balance - fee.amount,
-            currency='NGN',
-            status='completed',
-            payment_method='ewallet',
-            transaction_reference=tx_ref,
-            description=f'Fee payment: {fee.fee_type}',
-            related_fee_id=fee.id
+        # Claim the fee first so two concurrent requests cannot both pay it
+        claimed = db.session.execute(
+            db.update(Fee)
+            .where(Fee.id == fee.id, Fee.status != 'paid')
+            .values(status='paid', paid_date=date.today(), payment_method='ewallet', receipt_number=tx_ref)
+            .execution_options(synchronize_session=False)
         )
+        if claimed.rowcount != 1:
+            db.session.rollback()
+            flash('This fee has already been paid.', 'info')
+            return redirect(url_for('fees'))
         
-        # Update wallet balance
-        ewallet.balance -= fee.amount
-        ewallet.updated_at = datetime.utcnow()
-        
-        # Update fee status
-        fee.status = 'paid'
-        fee.paid_date = date.today()
-        fee.payment_method = 'ewallet'
-        fee.receipt_number = tx_ref
+        try:
+            transaction = debit_wallet(
+                ewallet, fee.amount,
+                transaction_type='payment',
+                payment_method='ewallet',
+                transaction_reference=tx_ref,
+                description=f'Fee payment: {fee.fee_type}',
+                related_fee_id=fee.id
+            )
+        except InsufficientFundsError:
+            db.session.rollback()
+            flash(f'Insufficient wallet balance. Required: ₦{fee.amount:,.2f}, Available: ₦{ewallet.balance:,.2f}', 'danger')
+            return redirect(url_for('ewallet'))
         
         # Create payment transaction record
         payment_transaction = PaymentTransaction(
@@ -2833,10 +2932,9 @@ def ewallet_pay_fee(fee_id):
             payment_date=datetime.utcnow()
         )
         
-        transaction.related_payment_transaction_id = payment_transaction.id
-        
-        db.session.add(transaction)
         db.session.add(payment_transaction)
+        db.session.flush()
+        transaction.related_payment_transaction_id = payment_transaction.id
         db.session.commit()
         
         flash(f'Fee paid successfully using e-wallet! Receipt: {tx_ref}', 'success')
@@ -2874,28 +2972,13 @@ def admin_manage_ewallet():
             # Create transaction
             tx_ref = f"ADMIN_FUND_{user_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8].upper()}"
             
-            balance_before = float(ewallet.balance)
-            balance_after = balance_before + amount
-            
-            transaction = EWalletTransaction(
-                ewallet_id=ewallet.id,
-                user_id=user_id,
+            credit_wallet(
+                ewallet, amount,
                 transaction_type='deposit',
-                amount=amount,
-                balance_before=balance_before,
-                balance_after=balance_after,
-                currency='NGN',
-                status='completed',
                 payment_method='admin',
                 transaction_reference=tx_ref,
                 description=description or f'Admin wallet funding: {description}'
             )
-            
-            # Update wallet balance
-            ewallet.balance = balance_after
-            ewallet.updated_at = datetime.utcnow()
-            
-            db.session.add(transaction)
             db.session.commit()
             
             flash(f'Successfully funded wallet for {user.first_name} {user.last_name} with ₦{amount:,.2f}', 'success')
@@ -3089,6 +3172,7 @@ def learner_reports():
 @app.route('/reports/attendance')
 @login_required
 @role_required('admin')
+@replica_reads()
 def attendance_reports():
     """Generate attendance reports with filtering options"""
     class_filter = request.args.get('class', '')
@@ -3185,6 +3269,7 @@ def attendance_reports():
 @app.route('/reports/academic')
 @login_required
 @role_required('admin')
+@replica_reads()
 def academic_reports():
     """Generate academic performance reports"""
     class_filter = request.args.get('class', '')
@@ -3235,12 +3320,9 @@ def academic_reports():
     classes = Class.query.filter_by(status='active').all()
     
     # Get unique sessions and terms
-    sessions = db.session.query(Exam.session).distinct().all()
-    sessions = [s[0] for s in sessions if s[0]]
-    terms = db.session.query(Exam.term).distinct().all()
-    terms = [t[0] for t in terms if t[0]]
-    exam_types = db.session.query(Exam.exam_type).distinct().all()
-    exam_types = [e[0] for e in exam_types if e[0]]
+    sessions = distinct_values(Exam.session)
+    terms = distinct_values(Exam.term)
+    exam_types = distinct_values(Exam.exam_type)
     
     return render_template('reports/academic.html', exams=exams, exam_results=exam_results,
                           classes=classes, class_filter=class_filter, session_filter=session_filter,
@@ -3252,6 +3334,7 @@ def academic_reports():
 @app.route('/reports/fees')
 @login_required
 @role_required('admin', 'accountant')
+@replica_reads()
 def fee_reports():
     """Generate fee reports with filtering options"""
     page = request.args.get('page', 1, type=int)
@@ -3293,12 +3376,9 @@ def fee_reports():
     ).group_by(Fee.fee_type).all()
     
     # Get unique values for filters
-    fee_types = db.session.query(Fee.fee_type).distinct().all()
-    fee_types = [f[0] for f in fee_types if f[0]]
-    sessions = db.session.query(Fee.session).distinct().all()
-    sessions = [s[0] for s in sessions if s[0]]
-    terms = db.session.query(Fee.term).distinct().all()
-    terms = [t[0] for t in terms if t[0]]
+    fee_types = distinct_values(Fee.fee_type)
+    sessions = distinct_values(Fee.session)
+    terms = distinct_values(Fee.term)
     
     return render_template('reports/fees.html', fees=fees, status_filter=status_filter,
                           fee_type_filter=fee_type_filter, session_filter=session_filter,
@@ -3310,6 +3390,7 @@ def fee_reports():
 @app.route('/reports/analytics')
 @login_required
 @role_required('admin')
+@replica_reads()
 def analytics_dashboard():
     """Analytics dashboard with visual insights"""
     # Overall statistics
@@ -3524,23 +3605,9 @@ def report_cards():
     sessions = set()
     terms = set()
     
-    # From assignments
-    assignment_sessions = db.session.query(Assignment.session).distinct().all()
-    sessions.update([s[0] for s in assignment_sessions if s[0]])
-    assignment_terms = db.session.query(Assignment.term).distinct().all()
-    terms.update([t[0] for t in assignment_terms if t[0]])
-    
-    # From tests
-    test_sessions = db.session.query(Test.session).distinct().all()
-    sessions.update([s[0] for s in test_sessions if s[0]])
-    test_terms = db.session.query(Test.term).distinct().all()
-    terms.update([t[0] for t in test_terms if t[0]])
-    
-    # From exams
-    exam_sessions = db.session.query(Exam.session).distinct().all()
-    sessions.update([s[0] for s in exam_sessions if s[0]])
-    exam_terms = db.session.query(Exam.term).distinct().all()
-    terms.update([t[0] for t in exam_terms if t[0]])
+    for model in (Assignment, Test, Exam):
+        sessions.update(distinct_values(model.session))
+        terms.update(distinct_values(model.term))
     
     sessions = sorted(list(sessions))
     terms = sorted(list(terms))
@@ -3548,17 +3615,48 @@ def report_cards():
     # Get school settings for print header
     school_settings = get_school_settings()
     
+    # The report card grid is a {% cache %} block, shared by every admin viewing the same data
+    report_card_cache_key = versions_etag(
+        [f'learner:{learner.id}' for learner in learners] + ['academics'],
+        current_user.role, class_filter, session_filter, term_filter, learner_id
+    )
+    
     return render_template('reports/report_cards.html', learners=learners, classes=classes,
                           class_filter=class_filter, session_filter=session_filter, term_filter=term_filter,
                           learner_id=learner_id, learner_assessments=learner_assessments,
                           learner_totals=learner_totals, learner_averages=learner_averages,
                           learner_positions=learner_positions, subjects_dict=subjects_dict,
-                          sessions=sessions, terms=terms, settings=school_settings)
+                          sessions=sessions, terms=terms, settings=school_settings,
+                          report_card_cache_key=report_card_cache_key)
+
+
+def get_report_school_info():
+    """School details and logo path for report letterheads"""
+    school_settings = get_school_settings()
+    
+    # Construct logo path (remote storage keeps a local copy for ReportLab)
+    logo_path = ''
+    logo_relative = school_settings.get('school_logo', '')
+    if logo_relative:
+        try:
+            logo_path = get_storage().local_path(logo_relative) or ''
+        except Exception:
+            logo_path = ''
+    
+    return {
+        'school_name': school_settings.get('school_name', 'Wajina International School'),
+        'school_address': school_settings.get('school_address', 'Makurdi, Benue State, Nigeria'),
+        'school_phone': school_settings.get('school_phone', ''),
+        'school_email': school_settings.get('school_email', ''),
+        'school_website': school_settings.get('school_website', ''),
+        'logo_path': logo_path
+    }
 
 
 @app.route('/reports/report-cards/download-pdf')
 @login_required
 @role_required('admin')
+@replica_reads()
 def download_report_card_pdf():
     """Download report cards as PDF"""
     try:
@@ -3567,160 +3665,27 @@ def download_report_card_pdf():
         term_filter = request.args.get('term', '')
         learner_id = request.args.get('learner_id', '', type=int)
         
-        query = Learner.query.filter_by(status='active')
-        
-        if class_filter:
-            query = query.filter_by(current_class=class_filter)
-        
-        if learner_id:
-            query = query.filter_by(id=learner_id)
-        
-        learners = query.all()
-        
-        # Get all subjects
-        all_subjects = Subject.query.all()
-        subjects_dict = {s.id: s.name for s in all_subjects}
-        
-        # Prepare learners data for PDF generation
-        learners_data = []
-        learner_totals = {}
-        learner_averages = {}
-        learner_positions = {}
-        
-        for learner in learners:
-            # Get Assignment Results
-            assignment_results = AssignmentResult.query.join(Assignment).filter(AssignmentResult.learner_id == learner.id).all()
-            assignment_results = [ar for ar in assignment_results 
-                                 if (not session_filter or ar.assignment.session == session_filter) and
-                                    (not term_filter or ar.assignment.term == term_filter)]
-            
-            # Get Test Results
-            test_results = TestResult.query.join(Test).filter(TestResult.learner_id == learner.id).all()
-            test_results = [tr for tr in test_results 
-                           if (not session_filter or tr.test.session == session_filter) and
-                              (not term_filter or tr.test.term == term_filter)]
-            
-            # Get Exam Results
-            exam_results = ExamResult.query.join(Exam).filter(ExamResult.learner_id == learner.id).all()
-            exam_results = [er for er in exam_results 
-                           if (not session_filter or er.exam.session == session_filter) and
-                              (not term_filter or er.exam.term == term_filter)]
-            
-            # Organize by subject
-            subject_scores = {}
-            for ar in assignment_results:
-                subject_id = ar.assignment.subject_id
-                if subject_id not in subject_scores:
-                    subject_scores[subject_id] = {'assignments': [], 'tests': [], 'exams': []}
-                subject_scores[subject_id]['assignments'].append({
-                    'name': ar.assignment.name,
-                    'score': float(ar.score),
-                    'max_score': ar.assignment.max_score,
-                    'grade': ar.grade,
-                })
-            
-            for tr in test_results:
-                subject_id = tr.test.subject_id
-                if subject_id not in subject_scores:
-                    subject_scores[subject_id] = {'assignments': [], 'tests': [], 'exams': []}
-                subject_scores[subject_id]['tests'].append({
-                    'name': tr.test.name,
-                    'score': float(tr.score),
-                    'max_score': tr.test.max_score,
-                    'grade': tr.grade,
-                })
-            
-            for er in exam_results:
-                subject_id = er.exam.subject_id
-                if subject_id not in subject_scores:
-                    subject_scores[subject_id] = {'assignments': [], 'tests': [], 'exams': []}
-                subject_scores[subject_id]['exams'].append({
-                    'name': er.exam.name,
-                    'score': float(er.score),
-                    'max_score': er.exam.max_score,
-                    'grade': er.grade,
-                })
-            
-            # Calculate totals and averages
-            subject_totals = {}
-            subject_averages = {}
-            
-            for subject_id, scores in subject_scores.items():
-                total_score = 0
-                total_max = 0
-                
-                for assignment in scores['assignments']:
-                    total_score += assignment['score']
-                    total_max += assignment['max_score']
-                
-                for test in scores['tests']:
-                    total_score += test['score']
-                    total_max += test['max_score']
-                
-                for exam in scores['exams']:
-                    total_score += exam['score']
-                    total_max += exam['max_score']
-                
-                subject_totals[subject_id] = total_score
-                subject_averages[subject_id] = (total_score / total_max * 100) if total_max > 0 else 0
-            
-            overall_total = sum(subject_totals.values())
-            overall_average = sum(subject_averages.values()) / len(subject_averages) if subject_averages else 0
-            
-            learner_totals[learner.id] = overall_total
-            learner_averages[learner.id] = overall_average
-            
-            learners_data.append({
-                'learner': learner,
-                'assessments': {
-                    'subject_scores': subject_scores,
-                    'subject_totals': subject_totals,
-                    'subject_averages': subject_averages
-                },
-                'totals': overall_total,
-                'averages': overall_average,
-                'position': None,  # Will be calculated below
-                'subjects_dict': subjects_dict
-            })
-        
-        # Calculate positions
-        if class_filter:
-            class_learners = [l for l in learners if l.current_class == class_filter]
-            class_learners_sorted = sorted(class_learners, key=lambda l: learner_totals.get(l.id, 0), reverse=True)
-            for idx, learner in enumerate(class_learners_sorted, start=1):
-                learner_positions[learner.id] = idx
-                # Update position in learners_data
-                for ld in learners_data:
-                    if ld['learner'].id == learner.id:
-                        ld['position'] = idx
-        
-        # Get school settings
-        school_settings = get_school_settings()
-        
-        # Construct logo path
-        logo_path = ''
-        logo_relative = school_settings.get('school_logo', '')
-        if logo_relative:
-            logo_full_path = os.path.join(app.config['UPLOAD_FOLDER'], logo_relative)
-            if os.path.exists(logo_full_path):
-                logo_path = logo_full_path
-        
-        school_info = {
-            'school_name': school_settings.get('school_name', 'Wajina International School'),
-            'school_address': school_settings.get('school_address', 'Makurdi, Benue State, Nigeria'),
-            'school_phone': school_settings.get('school_phone', ''),
-            'school_email': school_settings.get('school_email', ''),
-            'school_website': school_settings.get('school_website', ''),
-            'logo_path': logo_path
-        }
-        
         filters_dict = {
             'session': session_filter,
             'term': term_filter,
             'class': class_filter
         }
+        school_info = get_report_school_info()
         
-        pdf_buffer = generate_report_card_pdf(learners_data, filters_dict, school_info)
+        # Large runs (a whole school at term end) are rendered in the background
+        learner_count = count_report_card_learners(class_filter, learner_id)
+        if learner_count > app.config.get('REPORT_CARD_SYNC_LIMIT', 60):
+            job = start_report_card_job(dict(filters_dict, learner_id=learner_id or None), school_info, current_user.id)
+            flash(f'Report cards for {learner_count} learners are being generated. '
+                  f'The PDF will be ready to download shortly (job #{job.id}).', 'info')
+            return redirect(url_for('report_cards', job_id=job.id))
+        
+        learners_data = build_report_card_data(class_filter, session_filter, term_filter, learner_id)
+        
+        # Unchanged cards come from the rendered-card cache
+        pdf_buffer = BytesIO()
+        render_report_card_pdf(learners_data, filters_dict, school_info, pdf_buffer)
+        pdf_buffer.seek(0)
         
         return send_file(
             pdf_buffer,
@@ -3733,139 +3698,60 @@ def download_report_card_pdf():
         return redirect(url_for('report_cards'))
 
 
-@app.route('/reports/report-cards/download-csv')
+@app.route('/reports/report-cards/download-zip')
 @login_required
 @role_required('admin')
-def download_report_card_csv():
-    """Download report cards as CSV"""
+@replica_reads()
+def download_report_card_zip():
+    """Download a ZIP of individual report card PDFs, one per learner, named by admission number"""
     try:
         class_filter = request.args.get('class', '')
         session_filter = request.args.get('session', '')
         term_filter = request.args.get('term', '')
         learner_id = request.args.get('learner_id', '', type=int)
         
-        query = Learner.query.filter_by(status='active')
-        
-        if class_filter:
-            query = query.filter_by(current_class=class_filter)
-        
-        if learner_id:
-            query = query.filter_by(id=learner_id)
+        filters_dict = {
+            'session': session_filter,
+            'term': term_filter,
+            'class': class_filter
+        }
+        school_info = get_report_school_info()
         
-        learners = query.all()
+        learner_count = count_report_card_learners(class_filter, learner_id)
+        if learner_count > app.config.get('REPORT_CARD_SYNC_LIMIT', 60):
+            job = start_report_card_job(dict(filters_dict, learner_id=learner_id or None), school_info,
+                                        current_user.id, output_format='zip')
+            flash(f'Report cards for {learner_count} learners are being packaged. '
+                  f'The ZIP will be ready to download shortly (job #{job.id}).', 'info')
+            return redirect(url_for('report_cards', job_id=job.id))
         
-        # Get all subjects
-        all_subjects = Subject.query.all()
-        subjects_dict = {s.id: s.name for s in all_subjects}
+        learners_data = build_report_card_data(class_filter, session_filter, term_filter, learner_id)
         
-        # Prepare learners data for CSV generation
-        learners_data = []
-        learner_totals = {}
+        response = Response(
+            stream_with_context(replica_iter(iter_report_card_zip(learners_data, filters_dict, school_info))),
+            mimetype='application/zip'
+        )
+        response.headers['Content-Disposition'] = f'attachment; filename=report_cards_{datetime.now().strftime("%Y%m%d")}.zip'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+    except Exception as e:
+        flash(f'Error generating ZIP: {str(e)}', 'danger')
+        return redirect(url_for('report_cards'))
+
+
+@app.route('/reports/report-cards/download-csv')
+@login_required
+@role_required('admin')
+@replica_reads()
+def download_report_card_csv():
+    """Download report cards as CSV"""
+    try:
+        class_filter = request.args.get('class', '')
+        session_filter = request.args.get('session', '')
+        term_filter = request.args.get('term', '')
+        learner_id = request.args.get('learner_id', '', type=int)
         
-        for learner in learners:
-            # Get Assignment Results
-            assignment_results = AssignmentResult.query.join(Assignment).filter(AssignmentResult.learner_id == learner.id).all()
-            assignment_results = [ar for ar in assignment_results 
-                                 if (not session_filter or ar.assignment.session == session_filter) and
-                                    (not term_filter or ar.assignment.term == term_filter)]
-            
-            # Get Test Results
-            test_results = TestResult.query.join(Test).filter(TestResult.learner_id == learner.id).all()
-            test_results = [tr for tr in test_results 
-                           if (not session_filter or tr.test.session == session_filter) and
-                              (not term_filter or tr.test.term == term_filter)]
-            
-            # Get Exam Results
-            exam_results = ExamResult.query.join(Exam).filter(ExamResult.learner_id == learner.id).all()
-            exam_results = [er for er in exam_results 
-                           if (not session_filter or er.exam.session == session_filter) and
-                              (not term_filter or er.exam.term == term_filter)]
-            
-            # Organize by subject
-            subject_scores = {}
-            for ar in assignment_results:
-                subject_id = ar.assignment.subject_id
-                if subject_id not in subject_scores:
-                    subject_scores[subject_id] = {'assignments': [], 'tests': [], 'exams': []}
-                subject_scores[subject_id]['assignments'].append({
-                    'name': ar.assignment.name,
-                    'score': float(ar.score),
-                    'max_score': ar.assignment.max_score,
-                    'grade': ar.grade,
-                })
-            
-            for tr in test_results:
-                subject_id = tr.test.subject_id
-                if subject_id not in subject_scores:
-                    subject_scores[subject_id] = {'assignments': [], 'tests': [], 'exams': []}
-                subject_scores[subject_id]['tests'].append({
-                    'name': tr.test.name,
-                    'score': float(tr.score),
-                    'max_score': tr.test.max_score,
-                    'grade': tr.grade,
-                })
-            
-            for er in exam_results:
-                subject_id = er.exam.subject_id
-                if subject_id not in subject_scores:
-                    subject_scores[subject_id] = {'assignments': [], 'tests': [], 'exams': []}
-                subject_scores[subject_id]['exams'].append({
-                    'name': er.exam.name,
-                    'score': float(er.score),
-                    'max_score': er.exam.max_score,
-                    'grade': er.grade,
-                })
-            
-            # Calculate totals and averages
-            subject_totals = {}
-            subject_averages = {}
-            
-            for subject_id, scores in subject_scores.items():
-                total_score = 0
-                total_max = 0
-                
-                for assignment in scores['assignments']:
-                    total_score += assignment['score']
-                    total_max += assignment['max_score']
-                
-                for test in scores['tests']:
-                    total_score += test['score']
-                    total_max += test['max_score']
-                
-                for exam in scores['exams']:
-                    total_score += exam['score']
-                    total_max += exam['max_score']
-                
-                subject_totals[subject_id] = total_score
-                subject_averages[subject_id] = (total_score / total_max * 100) if total_max > 0 else 0
-            
-            overall_total = sum(subject_totals.values())
-            overall_average = sum(subject_averages.values()) / len(subject_averages) if subject_averages else 0
-            
-            learner_totals[learner.id] = overall_total
-            
-            # Calculate position
-            position = None
-            if class_filter:
-                class_learners = [l for l in learners if l.current_class == class_filter]
-                class_learners_sorted = sorted(class_learners, key=lambda l: learner_totals.get(l.id, 0), reverse=True)
-                for idx, l in enumerate(class_learners_sorted, start=1):
-                    if l.id == learner.id:
-                        position = idx
-                        break
-            
-            learners_data.append({
-                'learner': learner,
-                'assessments': {
-                    'subject_scores': subject_scores,
-                    'subject_totals': subject_totals,
-                    'subject_averages': subject_averages
-                },
-                'totals': overall_total,
-                'averages': overall_average,
-                'position': position,
-                'subjects_dict': subjects_dict
-            })
+        learners_data = build_report_card_data(class_filter, session_filter, term_filter, learner_id)
         
         filters_dict = {
             'session': session_filter,
@@ -3873,18 +3759,76 @@ def download_report_card_csv():
             'class': class_filter
         }
         
-        csv_buffer = generate_report_card_csv(learners_data, filters_dict)
-        
-        return Response(
-            csv_buffer.getvalue(),
-            mimetype='text/csv',
-            headers={'Content-Disposition': f'attachment; filename=report_cards_{datetime.now().strftime("%Y%m%d")}.csv'}
+        return stream_csv_response(
+            replica_iter(report_card_csv_rows(learners_data, filters_dict)),
+            f'report_cards_{datetime.now().strftime("%Y%m%d")}.csv'
         )
     except Exception as e:
         flash(f'Error generating CSV: {str(e)}', 'danger')
         return redirect(url_for('report_cards'))
 
 
+@app.route('/reports/report-cards/jobs', methods=['POST'])
+@login_required
+@role_required('admin')
+def start_report_card_pdf_job():
+    """Start rendering report cards (combined PDF or ZIP of per-learner PDFs) in the background"""
+    try:
+        filters = {
+            'session': request.values.get('session', ''),
+            'term': request.values.get('term', ''),
+            'class': request.values.get('class', ''),
+            'learner_id': request.values.get('learner_id', None, type=int)
+        }
+        output_format = request.values.get('format', 'pdf')
+        if output_format not in ('pdf', 'zip'):
+            return jsonify({'error': 'format must be pdf or zip'}), 400
+        job = start_report_card_job(filters, get_report_school_info(), current_user.id, output_format)
+        return jsonify({
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': url_for('report_card_job_status', job_id=job.id)
+        }), 202
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/reports/report-cards/jobs/<int:job_id>')
+@login_required
+@role_required('admin')
+def report_card_job_status(job_id):
+    """Progress of a background report card job"""
+    job = expire_stale_report_job(ReportJob.query.get_or_404(job_id))
+    return jsonify({
+        'job_id': job.id,
+        'status': job.status,
+        'progress': job.progress,
+        'total': job.total,
+        'percent': job.percent,
+        'error': job.error_message,
+        'download_url': url_for('download_report_card_job', job_id=job.id) if job.status == 'completed' else None
+    })
+
+
+@app.route('/reports/report-cards/jobs/<int:job_id>/download')
+@login_required
+@role_required('admin')
+def download_report_card_job(job_id):
+    """Download the PDF or ZIP produced by a background report card job"""
+    job = ReportJob.query.get_or_404(job_id)
+    if job.status != 'completed' or not job.file_path or not os.path.exists(job.file_path):
+        flash('These report cards are not ready yet, or have expired. Please try again.', 'warning')
+        return redirect(url_for('report_cards'))
+    
+    extension, mimetype = REPORT_JOB_FORMATS.get(job.job_type, ('pdf', 'application/pdf'))
+    return send_local_file(
+        job.file_path,
+        mimetype=mimetype,
+        as_attachment=True,
+        download_name=job.download_name or f'report_cards_{job.id}.{extension}'
+    )
+
+
 # User Profile Routes
 @app.route('/profile')
 @login_required
@@ -3894,9 +3838,9 @@ def profile():
     staff = None
     
     if current_user.role == 'learner':
-        learner = Learner.query.filter_by(user_id=current_user.id).first()
+        learner = current_learner()
     elif current_user.role == 'teacher':
-        staff = Staff.query.filter_by(user_id=current_user.id).first()
+        staff = current_staff()
     
     return render_template('profile/view.html', learner=learner, staff=staff)
 
@@ -3929,11 +3873,8 @@ def edit_profile():
             if 'profile_picture' in request.files:
                 file = request.files['profile_picture']
                 if file and file.filename:
-                    filename = f"profile_{current_user.id}_{datetime.now().strftime('%Y%m%d%H%M%S')}.{file.filename.rsplit('.', 1)[1].lower()}"
-                    filepath = os.path.join(app.config['UPLOAD_FOLDER'], 'profiles', filename)
-                    os.makedirs(os.path.dirname(filepath), exist_ok=True)
-                    file.save(filepath)
-                    current_user.profile_picture = f"profiles/{filename}"
+                    filename = f"profile_{current_user.id}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+                    current_user.profile_picture = save_uploaded_photo(file, 'profiles', filename)
             
             db.session.commit()
             flash('Profile updated successfully!', 'success')
@@ -3946,9 +3887,9 @@ def edit_profile():
     staff = None
     
     if current_user.role == 'learner':
-        learner = Learner.query.filter_by(user_id=current_user.id).first()
+        learner = current_learner()
     elif current_user.role == 'teacher':
-        staff = Staff.query.filter_by(user_id=current_user.id).first()
+        staff = current_staff()
     
     return render_template('profile/edit.html', learner=learner, staff=staff)
 
@@ -4258,20 +4199,11 @@ def update_settings():
                 allowed_extensions = {'png', 'jpg', 'jpeg', 'gif'}
                 if '.' in logo_file.filename and logo_file.filename.rsplit('.', 1)[1].lower() in allowed_extensions:
                     # Delete old logo if exists
-                    old_logo = app.config.get('SCHOOL_LOGO', '')
-                    if old_logo:
-                        old_logo_path = os.path.join(app.config['UPLOAD_FOLDER'], old_logo)
-                        if os.path.exists(old_logo_path):
-                            try:
-                                os.remove(old_logo_path)
-                            except:
-                                pass
+                    delete_upload(app.config.get('SCHOOL_LOGO', ''))
                     
                     # Generate unique filename
                     filename = f"logo_{datetime.now().strftime('%Y%m%d%H%M%S')}.{logo_file.filename.rsplit('.', 1)[1].lower()}"
-                    logo_path = os.path.join(app.config['UPLOAD_FOLDER'], 'logo', filename)
-                    logo_file.save(logo_path)
-                    app.config['SCHOOL_LOGO'] = f"logo/{filename}"
+                    app.config['SCHOOL_LOGO'] = save_upload(logo_file, f"logo/{filename}")
         
         # Handle login background image upload
         if 'login_background_image' in request.files:
@@ -4280,21 +4212,11 @@ def update_settings():
                 allowed_extensions = {'png', 'jpg', 'jpeg', 'gif'}
                 if '.' in bg_file.filename and bg_file.filename.rsplit('.', 1)[1].lower() in allowed_extensions:
                     # Delete old background if exists
-                    old_bg = app.config.get('LOGIN_BACKGROUND_IMAGE', '')
-                    if old_bg:
-                        old_bg_path = os.path.join(app.config['UPLOAD_FOLDER'], old_bg)
-                        if os.path.exists(old_bg_path):
-                            try:
-                                os.remove(old_bg_path)
-                            except:
-                                pass
+                    delete_upload(app.config.get('LOGIN_BACKGROUND_IMAGE', ''))
                     
                     # Generate unique filename
                     filename = f"login_bg_{datetime.now().strftime('%Y%m%d%H%M%S')}.{bg_file.filename.rsplit('.', 1)[1].lower()}"
-                    bg_path = os.path.join(app.config['UPLOAD_FOLDER'], 'login', filename)
-                    os.makedirs(os.path.dirname(bg_path), exist_ok=True)
-                    bg_file.save(bg_path)
-                    app.config['LOGIN_BACKGROUND_IMAGE'] = f"login/{filename}"
+                    app.config['LOGIN_BACKGROUND_IMAGE'] = save_upload(bg_file, f"login/{filename}")
         
         # Landing Page Settings
         app.config['LANDING_PAGE_TITLE'] = request.form.get('landing_page_title', app.config.get('LANDING_PAGE_TITLE', 'Wajina Suite - School Management System'))
@@ -4314,21 +4236,11 @@ def update_settings():
                 allowed_extensions = {'png', 'jpg', 'jpeg', 'gif'}
                 if '.' in landing_bg_file.filename and landing_bg_file.filename.rsplit('.', 1)[1].lower() in allowed_extensions:
                     # Delete old background if exists
-                    old_landing_bg = app.config.get('LANDING_BACKGROUND_IMAGE', '')
-                    if old_landing_bg:
-                        old_landing_bg_path = os.path.join(app.config['UPLOAD_FOLDER'], old_landing_bg)
-                        if os.path.exists(old_landing_bg_path):
-                            try:
-                                os.remove(old_landing_bg_path)
-                            except:
-                                pass
+                    delete_upload(app.config.get('LANDING_BACKGROUND_IMAGE', ''))
                     
                     # Generate unique filename
                     filename = f"landing_bg_{datetime.now().strftime('%Y%m%d%H%M%S')}.{landing_bg_file.filename.rsplit('.', 1)[1].lower()}"
-                    landing_bg_path = os.path.join(app.config['UPLOAD_FOLDER'], 'login', filename)
-                    os.makedirs(os.path.dirname(landing_bg_path), exist_ok=True)
-                    landing_bg_file.save(landing_bg_path)
-                    app.config['LANDING_BACKGROUND_IMAGE'] = f"login/{filename}"
+                    app.config['LANDING_BACKGROUND_IMAGE'] = save_upload(landing_bg_file, f"login/{filename}")
         
         # ID Card Settings
         app.config['ID_CARD_WIDTH'] = int(request.form.get('id_card_width', 500))
@@ -4380,6 +4292,14 @@ def update_settings():
         return redirect(url_for('settings'))
 
 
+@app.route('/admin/db-pool')
+@login_required
+@role_required('admin')
+def db_pool_status():
+    """Connection pool counters of the worker process that answers (JSON)"""
+    return jsonify(pool_metrics())
+
+
 # Email Report Routes
 @app.route('/reports/<report_type>/send-email', methods=['POST'])
 @login_required
@@ -4695,6 +4615,7 @@ Best regards,
 @app.route('/reports/<report_type>/download-pdf')
 @login_required
 @role_required('admin', 'teacher', 'store_keeper')
+@replica_reads()
 def download_report_pdf(report_type):
     """Download report as PDF"""
     try:
@@ -4961,6 +4882,7 @@ def download_report_pdf(report_type):
 @app.route('/reports/<report_type>/download-csv')
 @login_required
 @role_required('admin', 'teacher', 'store_keeper')
+@replica_reads()
 def download_report_csv(report_type):
     """Download report as CSV"""
     try:
@@ -4983,13 +4905,10 @@ def download_report_csv(report_type):
             if status_filter:
                 query = query.filter(Learner.status == status_filter)
             
-            learners = query.all()
-            csv_buffer = generate_learner_csv(learners)
-            
-            return Response(
-                csv_buffer.getvalue(),
-                mimetype='text/csv',
-                headers={'Content-Disposition': f'attachment; filename=learner_report_{datetime.now().strftime("%Y%m%d")}.csv'}
+            query = query.options(contains_eager(Learner.user)).order_by(Learner.id)
+            return stream_csv_response(
+                replica_iter(learner_csv_rows(iter_query(query))),
+                f'learner_report_{datetime.now().strftime("%Y%m%d")}.csv'
             )
             
         elif report_type == 'attendance':
@@ -5012,37 +4931,40 @@ def download_report_csv(report_type):
             base_query = db.session.query(Learner).join(User, Learner.user_id == User.id)
             if class_filter:
                 base_query = base_query.filter(Learner.current_class == class_filter)
-            learners_list = base_query.filter(Learner.status == 'active').all()
-            
-            attendance_data = []
-            for learner in learners_list:
-                present_days = Attendance.query.filter_by(
-                    learner_id=learner.id, status='present'
-                ).filter(Attendance.date >= start, Attendance.date <= end).count()
-                absent_days = Attendance.query.filter_by(
-                    learner_id=learner.id, status='absent'
-                ).filter(Attendance.date >= start, Attendance.date <= end).count()
-                late_days = Attendance.query.filter_by(
-                    learner_id=learner.id, status='late'
-                ).filter(Attendance.date >= start, Attendance.date <= end).count()
-                
-                attendance_data.append({
-                    'id': learner.id,
-                    'admission_number': learner.admission_number,
-                    'first_name': learner.user.first_name,
-                    'last_name': learner.user.last_name,
-                    'current_class': learner.current_class,
-                    'present_days': present_days,
-                    'absent_days': absent_days,
-                    'late_days': late_days
-                })
+            base_query = base_query.filter(Learner.status == 'active')
             
-            csv_buffer = generate_attendance_csv(attendance_data)
-            
-            return Response(
-                csv_buffer.getvalue(),
-                mimetype='text/csv',
-                headers={'Content-Disposition': f'attachment; filename=attendance_report_{datetime.now().strftime("%Y%m%d")}.csv'}
+            # One grouped count for the whole range instead of three counts per learner
+            count_query = db.session.query(
+                Attendance.learner_id, Attendance.status, db.func.count(Attendance.id)
+            ).filter(
+                Attendance.date >= start, Attendance.date <= end,
+                Attendance.status.in_(['present', 'absent', 'late'])
+            )
+            if class_filter:
+                count_query = count_query.join(Learner, Attendance.learner_id == Learner.id).filter(
+                    Learner.current_class == class_filter
+                )
+            attendance_counts = {}
+            for learner_id, status, count in count_query.group_by(Attendance.learner_id, Attendance.status):
+                attendance_counts[(learner_id, status)] = count
+            
+            def attendance_rows():
+                learners_iter = iter_query(base_query.options(contains_eager(Learner.user)).order_by(Learner.id))
+                for learner in learners_iter:
+                    yield {
+                        'id': learner.id,
+                        'admission_number': learner.admission_number,
+                        'first_name': learner.user.first_name,
+                        'last_name': learner.user.last_name,
+                        'current_class': learner.current_class,
+                        'present_days': attendance_counts.get((learner.id, 'present'), 0),
+                        'absent_days': attendance_counts.get((learner.id, 'absent'), 0),
+                        'late_days': attendance_counts.get((learner.id, 'late'), 0)
+                    }
+            
+            return stream_csv_response(
+                replica_iter(attendance_csv_rows(attendance_rows())),
+                f'attendance_report_{datetime.now().strftime("%Y%m%d")}.csv'
             )
             
         elif report_type == 'fees':
@@ -5061,13 +4983,10 @@ def download_report_csv(report_type):
             if term_filter:
                 query = query.filter_by(term=term_filter)
             
-            fees = query.all()
-            csv_buffer = generate_fee_csv(fees)
-            
-            return Response(
-                csv_buffer.getvalue(),
-                mimetype='text/csv',
-                headers={'Content-Disposition': f'attachment; filename=fee_report_{datetime.now().strftime("%Y%m%d")}.csv'}
+            query = query.options(joinedload(Fee.learner).joinedload(Learner.user)).order_by(Fee.id)
+            return stream_csv_response(
+                replica_iter(fee_csv_rows(iter_query(query))),
+                f'fee_report_{datetime.now().strftime("%Y%m%d")}.csv'
             )
             
         elif report_type == 'store':
@@ -5088,13 +5007,9 @@ def download_report_csv(report_type):
             if status:
                 query = query.filter_by(status=status)
             
-            items = query.order_by(StoreItem.item_name).all()
-            csv_buffer = generate_store_csv(items)
-            
-            return Response(
-                csv_buffer.getvalue(),
-                mimetype='text/csv',
-                headers={'Content-Disposition': f'attachment; filename=store_report_{datetime.now().strftime("%Y%m%d")}.csv'}
+            return stream_csv_response(
+                replica_iter(store_csv_rows(iter_query(query.order_by(StoreItem.item_name)))),
+                f'store_report_{datetime.now().strftime("%Y%m%d")}.csv'
             )
             
         elif report_type == 'expenditures':
@@ -5137,13 +5052,10 @@ def download_report_csv(report_type):
                 except:
                     pass
             
-            expenditures = query.order_by(Expenditure.payment_date.desc()).all()
-            csv_buffer = generate_expenditure_csv(expenditures)
-            
-            return Response(
-                csv_buffer.getvalue(),
-                mimetype='text/csv',
-                headers={'Content-Disposition': f'attachment; filename=expenditure_report_{datetime.now().strftime("%Y%m%d")}.csv'}
+            query = query.options(joinedload(Expenditure.approver)).order_by(Expenditure.payment_date.desc())
+            return stream_csv_response(
+                replica_iter(expenditure_csv_rows(iter_query(query))),
+                f'expenditure_report_{datetime.now().strftime("%Y%m%d")}.csv'
             )
         
         elif report_type == 'parents':
@@ -5176,56 +5088,31 @@ def download_report_csv(report_type):
                 Learner.parent_phone,
                 Learner.parent_email,
                 Learner.parent_address
-            )
-            
-            parent_groups = query.all()
-            
-            # Get all parents with their children details
-            parents_data = []
-            for parent_group in parent_groups:
-                learners = Learner.query.filter(
-                    Learner.status == 'active',
-                    Learner.parent_name == parent_group.parent_name,
-                    Learner.parent_phone == parent_group.parent_phone
-                ).all()
-                
-                children_names = ', '.join([f"{l.user.first_name} {l.user.last_name} ({l.admission_number})" for l in learners])
-                
-                parents_data.append({
-                    'parent_name': parent_group.parent_name,
-                    'parent_phone': parent_group.parent_phone or 'N/A',
-                    'parent_email': parent_group.parent_email or 'N/A',
-                    'parent_address': parent_group.parent_address or 'N/A',
-                    'children_count': parent_group.children_count,
-                    'children_names': children_names
-                })
-            
-            # Sort by children count
-            parents_data.sort(key=lambda x: x['children_count'], reverse=True)
-            
-            # Generate CSV
-            buffer = BytesIO()
-            writer = csv.writer(buffer)
-            
-            # Header
-            writer.writerow(['Parent/Guardian Name', 'Phone', 'Email', 'Address', 'Number of Children', 'Children (Name - Admission Number)'])
-            
-            # Data rows
-            for parent in parents_data:
-                writer.writerow([
-                    parent['parent_name'],
-                    parent['parent_phone'],
-                    parent['parent_email'],
-                    parent['parent_address'],
-                    parent['children_count'],
-                    parent['children_names']
-                ])
-            
-            buffer.seek(0)
-            return Response(
-                buffer.getvalue(),
-                mimetype='text/csv',
-                headers={'Content-Disposition': f'attachment; filename=parent_guardian_report_{datetime.now().strftime("%Y%m%d")}.csv'}
+            ).order_by(db.func.count(Learner.id).desc())
+            
+            # Get all parents with their children details, sorted by children count
+            def parent_rows():
+                for parent_group in iter_query(query):
+                    learners = Learner.query.options(joinedload(Learner.user)).filter(
+                        Learner.status == 'active',
+                        Learner.parent_name == parent_group.parent_name,
+                        Learner.parent_phone == parent_group.parent_phone
+                    ).all()
+                    
+                    children_names = ', '.join([f"{l.user.first_name} {l.user.last_name} ({l.admission_number})" for l in learners])
+                    
+                    yield {
+                        'parent_name': parent_group.parent_name,
+                        'parent_phone': parent_group.parent_phone or 'N/A',
+                        'parent_email': parent_group.parent_email or 'N/A',
+                        'parent_address': parent_group.parent_address or 'N/A',
+                        'children_count': parent_group.children_count,
+                        'children_names': children_names
+                    }
+            
+            return stream_csv_response(
+                replica_iter(parent_csv_rows(parent_rows())),
+                f'parent_guardian_report_{datetime.now().strftime("%Y%m%d")}.csv'
             )
         
         else:
@@ -5237,6 +5124,200 @@ def download_report_csv(report_type):
         return redirect(request.referrer or url_for('reports'))
 
 
+@app.route('/reports/<report_type>/download-xlsx')
+@login_required
+@role_required('admin', 'accountant', 'store_keeper')
+@replica_reads()
+def download_report_xlsx(report_type):
+    """Download report as an Excel workbook (one summary sheet plus a sheet per group)"""
+    try:
+        stamp = datetime.now().strftime("%Y%m%d")
+        
+        if report_type == 'fees':
+            if current_user.role not in ('admin', 'accountant'):
+                flash('You do not have permission to access this page.', 'danger')
+                return redirect(url_for('dashboard'))
+            
+            status_filter = request.args.get('status', '')
+            fee_type_filter = request.args.get('fee_type', '')
+            session_filter = request.args.get('session', '')
+            term_filter = request.args.get('term', '')
+            
+            def filtered(query):
+                if status_filter:
+                    query = query.filter(Fee.status == status_filter)
+                if fee_type_filter:
+                    query = query.filter(Fee.fee_type == fee_type_filter)
+                if session_filter:
+                    query = query.filter(Fee.session == session_filter)
+                if term_filter:
+                    query = query.filter(Fee.term == term_filter)
+                return query
+            
+            summary = filtered(db.session.query(
+                Fee.fee_type,
+                db.func.count(Fee.id),
+                db.func.sum(Fee.amount),
+                db.func.sum(case((Fee.status == 'paid', Fee.amount), else_=0)),
+                db.func.sum(case((Fee.status != 'paid', Fee.amount), else_=0))
+            )).group_by(Fee.fee_type).order_by(Fee.fee_type).all()
+            
+            sheets = [('Summary', ['Fee Type', 'Number of Fees', 'Total Amount', 'Paid', 'Outstanding'],
+                       [[fee_type, count, float(total or 0), float(paid or 0), float(outstanding or 0)]
+                        for fee_type, count, total, paid, outstanding in summary],
+                       {2: MONEY_FORMAT, 3: MONEY_FORMAT, 4: MONEY_FORMAT})]
+            for fee_type, *_ in summary:
+                query = filtered(Fee.query).filter(Fee.fee_type == fee_type).options(
+                    joinedload(Fee.learner).joinedload(Learner.user)
+                ).order_by(Fee.due_date, Fee.id)
+                sheets.append((fee_type, FEE_XLSX_HEADER, fee_xlsx_rows(iter_query(query)), FEE_XLSX_FORMATS))
+            
+            return stream_xlsx_response(sheets, f'fee_report_{stamp}.xlsx')
+        
+        elif report_type == 'expenditures':
+            if current_user.role not in ('admin', 'store_keeper'):
+                flash('You do not have permission to access this page.', 'danger')
+                return redirect(url_for('dashboard'))
+            
+            search = request.args.get('search', '')
+            category = request.args.get('category', '')
+            status = request.args.get('status', '')
+            start_date = request.args.get('start_date', '')
+            end_date = request.args.get('end_date', '')
+            
+            def filtered(query):
+                if search:
+                    query = query.filter(
+                        db.or_(
+                            Expenditure.expense_code.ilike(f'%{search}%'),
+                            Expenditure.title.ilike(f'%{search}%')
+                        )
+                    )
+                if category:
+                    query = query.filter(Expenditure.category == category)
+                if status:
+                    query = query.filter(Expenditure.status == status)
+                if start_date:
+                    try:
+                        query = query.filter(Expenditure.payment_date >= datetime.strptime(start_date, '%Y-%m-%d').date())
+                    except:
+                        pass
+                if end_date:
+                    try:
+                        query = query.filter(Expenditure.payment_date <= datetime.strptime(end_date, '%Y-%m-%d').date())
+                    except:
+                        pass
+                return query
+            
+            summary = filtered(db.session.query(
+                Expenditure.category,
+                db.func.count(Expenditure.id),
+                db.func.sum(Expenditure.amount),
+                db.func.sum(case((Expenditure.status == 'paid', Expenditure.amount), else_=0)),
+                db.func.sum(case((Expenditure.status == 'pending', Expenditure.amount), else_=0))
+            )).group_by(Expenditure.category).order_by(Expenditure.category).all()
+            
+            sheets = [('Summary', ['Category', 'Number of Expenses', 'Total Amount', 'Paid', 'Pending'],
+                       [[cat, count, float(total or 0), float(paid or 0), float(pending or 0)]
+                        for cat, count, total, paid, pending in summary],
+                       {2: MONEY_FORMAT, 3: MONEY_FORMAT, 4: MONEY_FORMAT})]
+            for cat, *_ in summary:
+                query = filtered(Expenditure.query).filter(Expenditure.category == cat).options(
+                    joinedload(Expenditure.approver)
+                ).order_by(Expenditure.payment_date, Expenditure.id)
+                sheets.append((cat, EXPENDITURE_XLSX_HEADER, expenditure_xlsx_rows(iter_query(query)),
+                               EXPENDITURE_XLSX_FORMATS))
+            
+            return stream_xlsx_response(sheets, f'expenditure_report_{stamp}.xlsx')
+        
+        elif report_type == 'salaries':
+            if current_user.role != 'admin':
+                flash('You do not have permission to access this page.', 'danger')
+                return redirect(url_for('dashboard'))
+            
+            month_filter = request.args.get('month', '')
+            year_filter = request.args.get('year', datetime.now().year, type=int)
+            status_filter = request.args.get('status', '')
+            
+            def filtered(query):
+                if month_filter:
+                    query = query.filter(Salary.month == month_filter)
+                if year_filter:
+                    query = query.filter(Salary.year == year_filter)
+                if status_filter:
+                    query = query.filter(Salary.status == status_filter)
+                return query
+            
+            summary = filtered(db.session.query(
+                Salary.year,
+                Salary.month,
+                db.func.count(Salary.id),
+                db.func.sum(Salary.net_salary),
+                db.func.sum(case((Salary.status == 'paid', Salary.net_salary), else_=0)),
+                db.func.sum(case((Salary.status == 'pending', Salary.net_salary), else_=0))
+            )).group_by(Salary.year, Salary.month).order_by(Salary.year, Salary.month).all()
+            
+            sheets = [('Summary', ['Year', 'Month', 'Number of Staff', 'Total Net Salary', 'Paid', 'Pending'],
+                       [[year, month, count, float(total or 0), float(paid or 0), float(pending or 0)]
+                        for year, month, count, total, paid, pending in summary],
+                       {3: MONEY_FORMAT, 4: MONEY_FORMAT, 5: MONEY_FORMAT})]
+            for year, month, *_ in summary:
+                query = filtered(Salary.query).filter(Salary.year == year, Salary.month == month).options(
+                    joinedload(Salary.staff).joinedload(Staff.user)
+                ).order_by(Salary.id)
+                sheets.append((month, SALARY_XLSX_HEADER, salary_xlsx_rows(iter_query(query)),
+                               SALARY_XLSX_FORMATS))
+            
+            return stream_xlsx_response(sheets, f'salary_report_{stamp}.xlsx')
+        
+        elif report_type == 'store':
+            if current_user.role not in ('admin', 'store_keeper'):
+                flash('You do not have permission to access this page.', 'danger')
+                return redirect(url_for('dashboard'))
+            
+            search = request.args.get('search', '')
+            category = request.args.get('category', '')
+            status = request.args.get('status', '')
+            
+            def filtered(query):
+                if search:
+                    query = query.filter(
+                        db.or_(
+                            StoreItem.item_code.ilike(f'%{search}%'),
+                            StoreItem.item_name.ilike(f'%{search}%')
+                        )
+                    )
+                if category:
+                    query = query.filter(StoreItem.category == category)
+                if status:
+                    query = query.filter(StoreItem.status == status)
+                return query
+            
+            summary = filtered(db.session.query(
+                StoreItem.category,
+                db.func.count(StoreItem.id),
+                db.func.sum(StoreItem.quantity * StoreItem.unit_price),
+                db.func.sum(case((StoreItem.quantity <= StoreItem.min_quantity, 1), else_=0))
+            )).group_by(StoreItem.category).order_by(StoreItem.category).all()
+            
+            sheets = [('Summary', ['Category', 'Number of Items', 'Total Value', 'Low Stock Items'],
+                       [[cat, count, float(value or 0), int(low or 0)] for cat, count, value, low in summary],
+                       {2: MONEY_FORMAT})]
+            for cat, *_ in summary:
+                query = filtered(StoreItem.query).filter(StoreItem.category == cat).order_by(StoreItem.item_name)
+                sheets.append((cat, STORE_XLSX_HEADER, store_xlsx_rows(iter_query(query)), STORE_XLSX_FORMATS))
+            
+            return stream_xlsx_response(sheets, f'store_report_{stamp}.xlsx')
+        
+        else:
+            flash('Excel export is available for fees, expenditures, salaries and store reports.', 'warning')
+            return redirect(request.referrer or url_for('reports'))
+    
+    except Exception as e:
+        flash(f'Error generating Excel file: {str(e)}', 'danger')
+        return redirect(request.referrer or url_for('reports'))
+
+
 # Store Management Routes
 @app.route('/store')
 @login_required
@@ -5268,8 +5349,7 @@ def store_list():
     )
     
     # Get categories for filter
-    categories = db.session.query(StoreItem.category).distinct().all()
-    categories = [cat[0] for cat in categories if cat[0]]
+    categories = distinct_values(StoreItem.category)
     
     # Statistics
     total_items = StoreItem.query.count()
@@ -5330,8 +5410,7 @@ def add_store_item():
             flash(f'Error adding store item: {str(e)}', 'danger')
     
     # Get existing categories for suggestions
-    categories = db.session.query(StoreItem.category).distinct().all()
-    existing_categories = [cat[0] for cat in categories if cat[0]]
+    existing_categories = distinct_values(StoreItem.category)
     
     return render_template('store/add.html', existing_categories=existing_categories)
 
@@ -5391,8 +5470,7 @@ def edit_store_item(item_id):
             flash(f'Error updating store item: {str(e)}', 'danger')
     
     # Get existing categories for suggestions
-    categories = db.session.query(StoreItem.category).distinct().all()
-    existing_categories = [cat[0] for cat in categories if cat[0]]
+    existing_categories = distinct_values(StoreItem.category)
     
     return render_template('store/edit.html', item=item, existing_categories=existing_categories)
 
@@ -5495,7 +5573,7 @@ def store_transactions():
     transaction_type = request.args.get('transaction_type', '')
     start_date = request.args.get('start_date', '')
     end_date = request.args.get('end_date', '')
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor', '')
     
     query = StoreTransaction.query.join(StoreItem)
     
@@ -5522,9 +5600,8 @@ def store_transactions():
         except:
             pass
     
-    transactions = query.order_by(
-        StoreTransaction.transaction_date.desc(), StoreTransaction.created_at.desc()
-    ).paginate(page=page, per_page=50, error_out=False)
+    transactions = keyset_paginate(query, StoreTransaction.transaction_date, StoreTransaction.id,
+                                   cursor=cursor, per_page=50, with_total=True)
     
     return render_template('store/transactions.html', transactions=transactions,
                           search=search, transaction_type=transaction_type,
@@ -5558,8 +5635,7 @@ def store_reports():
     items = query.order_by(StoreItem.item_name).all()
     
     # Get categories for filter
-    categories = db.session.query(StoreItem.category).distinct().all()
-    categories = [cat[0] for cat in categories if cat[0]]
+    categories = distinct_values(StoreItem.category)
     
     # Statistics
     total_items = len(items)
@@ -5637,8 +5713,7 @@ def expenditure_reports():
     expenditures = query.order_by(Expenditure.payment_date.desc()).all()
     
     # Get categories for filter
-    categories = db.session.query(Expenditure.category).distinct().all()
-    categories = [cat[0] for cat in categories if cat[0]]
+    categories = distinct_values(Expenditure.category)
     
     # Get staff for filter
     staff_members = Staff.query.join(User).filter(User.is_active == True).all()
@@ -5683,7 +5758,7 @@ def expenditures_list():
     staff_id = request.args.get('staff_id', '')
     start_date = request.args.get('start_date', '')
     end_date = request.args.get('end_date', '')
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor', '')
     
     query = Expenditure.query
     
@@ -5720,13 +5795,11 @@ def expenditures_list():
         except:
             pass
     
-    expenditures = query.order_by(Expenditure.payment_date.desc(), Expenditure.created_at.desc()).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    expenditures = keyset_paginate(query, Expenditure.payment_date, Expenditure.id,
+                                   cursor=cursor, per_page=20, with_total=True)
     
     # Get categories for filter
-    categories = db.session.query(Expenditure.category).distinct().all()
-    categories = [cat[0] for cat in categories if cat[0]]
+    categories = distinct_values(Expenditure.category)
     
     # Get staff for filter
     staff_members = Staff.query.join(User).filter(User.is_active == True).all()
@@ -5777,9 +5850,7 @@ def add_expenditure():
                     if file_ext in allowed_extensions:
                         # Generate unique filename
                         filename = f"receipt_{expense_code}_{datetime.now().strftime('%Y%m%d%H%M%S')}.{file_ext}"
-                        receipt_path = os.path.join(app.config['UPLOAD_FOLDER'], 'receipts', filename)
-                        receipt_file.save(receipt_path)
-                        receipt_file_path = f"receipts/{filename}"
+                        receipt_file_path = save_upload(receipt_file, f"receipts/{filename}")
             
             expenditure = Expenditure(
                 expense_code=expense_code,
@@ -5811,8 +5882,7 @@ def add_expenditure():
             flash(f'Error adding expenditure: {str(e)}', 'danger')
     
     # Get existing categories for suggestions
-    categories = db.session.query(Expenditure.category).distinct().all()
-    existing_categories = [cat[0] for cat in categories if cat[0]]
+    existing_categories = distinct_values(Expenditure.category)
     
     # Get staff members for approval dropdown
     staff_members = Staff.query.join(User).filter(User.is_active == True).all()
@@ -5848,13 +5918,22 @@ def view_expenditure_receipt(expenditure_id):
         flash('No receipt file available for this expenditure.', 'warning')
         return redirect(url_for('view_expenditure', expenditure_id=expenditure_id))
     
-    receipt_path = os.path.join(app.config['UPLOAD_FOLDER'], expenditure.receipt_file)
+    storage = get_storage()
+    
+    # Remote storage: send the browser to a short-lived signed URL instead of proxying the bytes
+    if storage.remote:
+        if not storage.exists(expenditure.receipt_file):
+            flash('Receipt file not found.', 'danger')
+            return redirect(url_for('view_expenditure', expenditure_id=expenditure_id))
+        return redirect(storage.url(expenditure.receipt_file))
     
-    if not os.path.exists(receipt_path):
+    receipt_path = storage.local_path(expenditure.receipt_file)
+    
+    if not receipt_path:
         flash('Receipt file not found.', 'danger')
         return redirect(url_for('view_expenditure', expenditure_id=expenditure_id))
     
-    return send_file(receipt_path, as_attachment=False)
+    return send_local_file(receipt_path, as_attachment=False)
 
 
 @app.route('/expenditures/<int:expenditure_id>/edit', methods=['GET', 'POST'])
@@ -5887,13 +5966,7 @@ def edit_expenditure(expenditure_id):
                 receipt_file = request.files['receipt_file']
                 if receipt_file and receipt_file.filename:
                     # Delete old receipt if exists
-                    if expenditure.receipt_file:
-                        old_receipt_path = os.path.join(app.config['UPLOAD_FOLDER'], expenditure.receipt_file)
-                        if os.path.exists(old_receipt_path):
-                            try:
-                                os.remove(old_receipt_path)
-                            except:
-                                pass
+                    delete_upload(expenditure.receipt_file)
                     
                     # Validate file type
                     allowed_extensions = {'png', 'jpg', 'jpeg', 'gif', 'pdf', 'doc', 'docx'}
@@ -5901,9 +5974,7 @@ def edit_expenditure(expenditure_id):
                     if file_ext in allowed_extensions:
                         # Generate unique filename
                         filename = f"receipt_{expenditure.expense_code}_{datetime.now().strftime('%Y%m%d%H%M%S')}.{file_ext}"
-                        receipt_path = os.path.join(app.config['UPLOAD_FOLDER'], 'receipts', filename)
-                        receipt_file.save(receipt_path)
-                        expenditure.receipt_file = f"receipts/{filename}"
+                        expenditure.receipt_file = save_upload(receipt_file, f"receipts/{filename}")
             
             db.session.commit()
             flash('Expenditure updated successfully!', 'success')
@@ -5913,8 +5984,7 @@ def edit_expenditure(expenditure_id):
             flash(f'Error updating expenditure: {str(e)}', 'danger')
     
     # Get existing categories for suggestions
-    categories = db.session.query(Expenditure.category).distinct().all()
-    existing_categories = [cat[0] for cat in categories if cat[0]]
+    existing_categories = distinct_values(Expenditure.category)
     
     # Get staff members for approval dropdown
     staff_members = Staff.query.join(User).filter(User.is_active == True).all()
@@ -5932,13 +6002,7 @@ def delete_expenditure(expenditure_id):
     
     try:
         # Delete receipt file if exists
-        if expenditure.receipt_file:
-            receipt_path = os.path.join(app.config['UPLOAD_FOLDER'], expenditure.receipt_file)
-            if os.path.exists(receipt_path):
-                try:
-                    os.remove(receipt_path)
-                except:
-                    pass
+        delete_upload(expenditure.receipt_file)
         
         db.session.delete(expenditure)
         db.session.commit()
@@ -5957,7 +6021,7 @@ def delete_expenditure(expenditure_id):
 @role_required('admin')
 def salaries_list():
     """List all staff salaries"""
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor', '')
     month_filter = request.args.get('month', '')
     year_filter = request.args.get('year', datetime.now().year, type=int)
     status_filter = request.args.get('status', '')
@@ -5971,9 +6035,7 @@ def salaries_list():
     if status_filter:
         query = query.filter(Salary.status == status_filter)
     
-    salaries = query.order_by(Salary.created_at.desc()).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    salaries = keyset_paginate(query, Salary.created_at, Salary.id, cursor=cursor, per_page=20, with_total=True)
     
     # Get statistics
     total_paid = db.session.query(db.func.sum(Salary.net_salary)).filter(
@@ -6137,7 +6199,7 @@ def request_salary_advance():
             if current_user.role == 'admin':
                 staff_id = request.form.get('staff_id')
             else:
-                staff = Staff.query.filter_by(user_id=current_user.id).first()
+                staff = current_staff()
                 if not staff:
                     flash('Staff profile not found.', 'danger')
                     return redirect(url_for('dashboard'))
@@ -6185,7 +6247,7 @@ def request_salary_advance():
         staff_list = Staff.query.filter_by(status='active').all()
     else:
         staff_list = None
-        staff = Staff.query.filter_by(user_id=current_user.id).first()
+        staff = current_staff()
         if not staff:
             flash('Staff profile not found.', 'danger')
             return redirect(url_for('dashboard'))
@@ -6263,7 +6325,7 @@ def pay_salary_advance(advance_id):
 @login_required
 def my_salary_advances():
     """View own salary advance requests (for staff)"""
-    staff = Staff.query.filter_by(user_id=current_user.id).first()
+    staff = current_staff()
     
     if not staff:
         flash('Staff profile not found.', 'danger')
@@ -6291,9 +6353,6 @@ def apply_admission():
             app_number = f"APP{datetime.now().strftime('%Y%m%d')}{str(uuid.uuid4())[:8].upper()}"
             
             # Handle file uploads
-            upload_folder = app.config['UPLOAD_FOLDER']
-            os.makedirs(os.path.join(upload_folder, 'admissions'), exist_ok=True)
-            
             passport_path = None
             birth_cert_path = None
             previous_result_path = None
@@ -6304,40 +6363,28 @@ def apply_admission():
                 if file and file.filename:
                     ext = file.filename.rsplit('.', 1)[1].lower()
                     if ext in ['png', 'jpg', 'jpeg', 'gif']:
-                        filename = f"passport_{app_number}.{ext}"
-                        filepath = os.path.join(upload_folder, 'admissions', filename)
-                        file.save(filepath)
-                        passport_path = f"admissions/{filename}"
+                        passport_path = save_uploaded_photo(file, 'admissions', f"passport_{app_number}")
             
             if 'birth_certificate' in request.files:
                 file = request.files['birth_certificate']
                 if file and file.filename:
                     ext = file.filename.rsplit('.', 1)[1].lower()
                     if ext in ['pdf', 'png', 'jpg', 'jpeg']:
-                        filename = f"birth_cert_{app_number}.{ext}"
-                        filepath = os.path.join(upload_folder, 'admissions', filename)
-                        file.save(filepath)
-                        birth_cert_path = f"admissions/{filename}"
+                        birth_cert_path = save_upload(file, f"admissions/birth_cert_{app_number}.{ext}")
             
             if 'previous_result' in request.files:
                 file = request.files['previous_result']
                 if file and file.filename:
                     ext = file.filename.rsplit('.', 1)[1].lower()
                     if ext in ['pdf', 'png', 'jpg', 'jpeg']:
-                        filename = f"result_{app_number}.{ext}"
-                        filepath = os.path.join(upload_folder, 'admissions', filename)
-                        file.save(filepath)
-                        previous_result_path = f"admissions/{filename}"
+                        previous_result_path = save_upload(file, f"admissions/result_{app_number}.{ext}")
             
             if 'medical_report' in request.files:
                 file = request.files['medical_report']
                 if file and file.filename:
                     ext = file.filename.rsplit('.', 1)[1].lower()
                     if ext in ['pdf', 'png', 'jpg', 'jpeg']:
-                        filename = f"medical_{app_number}.{ext}"
-                        filepath = os.path.join(upload_folder, 'admissions', filename)
-                        file.save(filepath)
-                        medical_report_path = f"admissions/{filename}"
+                        medical_report_path = save_upload(file, f"admissions/medical_{app_number}.{ext}")
             
             # Create application
             application = AdmissionApplication(
@@ -6393,9 +6440,19 @@ def check_application_status(app_number):
 
 # ==================== PARENT PORTAL ====================
 
+def parent_portal_scopes():
+    """Scopes of the parent dashboard: every matched child and their user accounts"""
+    children = db.session.query(Learner.id, Learner.user_id).filter(
+        (Learner.parent_email == current_user.email) |
+        (Learner.parent_phone == current_user.phone)
+    ).all()
+    return [f'learner:{learner_id}' for learner_id, _ in children] + [f'user:{user_id}' for _, user_id in children]
+
+
 @app.route('/parent')
 @login_required
 @role_required('parent')
+@conditional_page(parent_portal_scopes)
 def parent_portal():
     """Parent portal dashboard"""
     # Get parent's children (learners)
@@ -6665,16 +6722,36 @@ def parent_download_report_card(learner_id):
         flash('You do not have access to this learner\'s report card.', 'danger')
         return redirect(url_for('parent_portal'))
     
-    # Similar logic to download_report_card_pdf route
     # Get filters
     session_filter = request.args.get('session', learner.current_session)
     term_filter = request.args.get('term', 'First Term')
     
-    # Get results and generate PDF (simplified version)
-    # In production, use the same logic as download_report_card_pdf
-    
-    flash('PDF download feature coming soon!', 'info')
-    return redirect(url_for('parent_report_card', learner_id=learner_id))
+    try:
+        # Build the whole class so the card shows the learner's class position
+        class_data = build_report_card_data(learner.current_class, session_filter, term_filter)
+        learners_data = [ld for ld in class_data if ld['learner']['id'] == learner.id]
+        if not learners_data:
+            learners_data = build_report_card_data('', session_filter, term_filter, learner.id)
+        if not learners_data:
+            flash('No report card is available for this learner.', 'warning')
+            return redirect(url_for('parent_report_card', learner_id=learner_id))
+        
+        filters_dict = {
+            'session': session_filter,
+            'term': term_filter,
+            'class': learner.current_class
+        }
+        pdf_bytes = render_report_card_pdfs(learners_data, filters_dict, get_report_school_info())[0]
+        
+        return send_file(
+            BytesIO(pdf_bytes),
+            mimetype='application/pdf',
+            as_attachment=True,
+            download_name=f'report_card_{learner.admission_number}.pdf'
+        )
+    except Exception as e:
+        flash(f'Error generating PDF: {str(e)}', 'danger')
+        return redirect(url_for('parent_report_card', learner_id=learner_id))
 
 
 # ==================== LEARNER PORTAL ====================
@@ -6684,7 +6761,7 @@ def parent_download_report_card(learner_id):
 @role_required('learner')
 def learner_portal():
     """Learner portal dashboard"""
-    learner = Learner.query.filter_by(user_id=current_user.id).first()
+    learner = current_learner()
     
     if not learner:
         flash('Learner profile not found. Please contact administrator.', 'danger')
@@ -6714,7 +6791,7 @@ def learner_portal():
 @role_required('learner')
 def learner_fees():
     """View fees"""
-    learner = Learner.query.filter_by(user_id=current_user.id).first_or_404()
+    learner = current_learner() or abort(404)
     fees = Fee.query.filter_by(learner_id=learner.id).order_by(Fee.created_at.desc()).all()
     ewallet = get_or_create_ewallet(current_user.id)
     return render_template('portals/learner/fees.html', learner=learner, fees=fees, ewallet=ewallet)
@@ -6723,9 +6800,10 @@ def learner_fees():
 @app.route('/learner/results')
 @login_required
 @role_required('learner')
+@conditional_page(own_learner_scopes)
 def learner_results():
     """View own results"""
-    learner = Learner.query.filter_by(user_id=current_user.id).first_or_404()
+    learner = current_learner() or abort(404)
     
     # Get filters
     session_filter = request.args.get('session', learner.current_session)
@@ -6762,9 +6840,10 @@ def learner_results():
 @app.route('/learner/report-card')
 @login_required
 @role_required('learner')
+@conditional_page(own_learner_scopes)
 def learner_report_card():
     """View own report card"""
-    learner = Learner.query.filter_by(user_id=current_user.id).first_or_404()
+    learner = current_learner() or abort(404)
     
     # Similar logic to parent_report_card
     session_filter = request.args.get('session', learner.current_session)
@@ -6840,7 +6919,7 @@ def learner_report_card():
 @role_required('learner')
 def learner_attendance():
     """View own attendance"""
-    learner = Learner.query.filter_by(user_id=current_user.id).first_or_404()
+    learner = current_learner() or abort(404)
     
     # Get filters
     start_date = request.args.get('start_date')
@@ -6877,7 +6956,7 @@ def learner_attendance():
 @role_required('teacher')
 def teacher_portal():
     """Teacher portal dashboard"""
-    staff = Staff.query.filter_by(user_id=current_user.id).first()
+    staff = current_staff()
     
     if not staff:
         flash('Staff profile not found. Please contact administrator.', 'danger')
@@ -6908,7 +6987,7 @@ def teacher_portal():
 @role_required('teacher')
 def teacher_classes():
     """View assigned classes"""
-    staff = Staff.query.filter_by(user_id=current_user.id).first_or_404()
+    staff = current_staff() or abort(404)
     classes = Class.query.filter_by(class_teacher_id=staff.id).all()
     
     # Get learner count for each class
@@ -6931,7 +7010,7 @@ def teacher_classes():
 def teacher_class_learners(class_id):
     """View learners in a class"""
     cls = Class.query.get_or_404(class_id)
-    staff = Staff.query.filter_by(user_id=current_user.id).first()
+    staff = current_staff()
     
     if cls.class_teacher_id != staff.id:
         flash('You are not assigned to this class.', 'danger')
@@ -6946,7 +7025,7 @@ def teacher_class_learners(class_id):
 @role_required('teacher')
 def teacher_results():
     """View and manage results"""
-    staff = Staff.query.filter_by(user_id=current_user.id).first_or_404()
+    staff = current_staff() or abort(404)
     
     # Get teacher's subjects
     subjects = Subject.query.filter_by(teacher_id=staff.id).all()
@@ -7074,8 +7153,7 @@ def cashier_payments():
     )
     
     # Get payment methods for filter
-    payment_methods = db.session.query(Fee.payment_method).distinct().all()
-    payment_methods = [pm[0] for pm in payment_methods if pm[0]]
+    payment_methods = distinct_values(Fee.payment_method)
     
     return render_template('portals/cashier/payments.html', 
                          fees=fees, 
@@ -7318,7 +7396,7 @@ def cashier_print_receipt(fee_id):
 @role_required('cashier')
 def cashier_transactions():
     """View all payment transactions"""
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor', '')
     status_filter = request.args.get('status', '')
     payment_type = request.args.get('payment_type', '')
     start_date = request.args.get('start_date', '')
@@ -7343,9 +7421,9 @@ def cashier_transactions():
         except:
             pass
     
-    transactions = query.order_by(PaymentTransaction.payment_date.desc()).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    # Pending transactions have no payment_date yet, so fall back to when they were created
+    transactions = keyset_paginate(query, db.func.coalesce(PaymentTransaction.payment_date, PaymentTransaction.created_at),
+                                   PaymentTransaction.id, cursor=cursor, per_page=20, with_total=True)
     
     # Calculate totals
     total_amount = db.session.query(db.func.sum(PaymentTransaction.amount)).filter(
@@ -7455,65 +7533,19 @@ def learner_id_card(id):
     # Get school settings
     settings = get_school_settings()
     
-    # Generate QR code
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(learner.admission_number)
-    qr.make(fit=True)
-    
-    # Create QR code image
-    qr_img = qr.make_image(fill_color="black", back_color="white")
-    
-    # Convert to base64 for embedding in HTML
-    from base64 import b64encode
-    qr_buffer = BytesIO()
-    qr_img.save(qr_buffer, format='PNG')
-    qr_buffer.seek(0)
-    qr_base64 = b64encode(qr_buffer.getvalue()).decode()
+    # QR code from the QR code cache (base64 for embedding, or a cacheable image URL)
+    qr_base64 = qr_code_base64(learner.admission_number)
+    qr_code_url = url_for('qr_code_image', key=ensure_qr_code(learner.admission_number))
     
     # Get ID card settings
-    id_card_settings = {
-        'width': app.config.get('ID_CARD_WIDTH', 500),
-        'height': app.config.get('ID_CARD_HEIGHT', 0),
-        'border_radius': app.config.get('ID_CARD_BORDER_RADIUS', 15),
-        'bg_color': app.config.get('ID_CARD_BG_COLOR', '#ffffff'),
-        'header_bg_color': app.config.get('ID_CARD_HEADER_BG_COLOR', '#32CD32'),
-        'footer_bg_color': app.config.get('ID_CARD_FOOTER_BG_COLOR', '#f8f9fa'),
-        'border_color': app.config.get('ID_CARD_BORDER_COLOR', '#32CD32'),
-        'border_width': app.config.get('ID_CARD_BORDER_WIDTH', 3),
-        'logo_position': app.config.get('ID_CARD_LOGO_POSITION', 'top-center'),
-        'logo_height': app.config.get('ID_CARD_LOGO_HEIGHT', 60),
-        'logo_margin_bottom': app.config.get('ID_CARD_LOGO_MARGIN_BOTTOM', 10),
-        'photo_position': app.config.get('ID_CARD_PHOTO_POSITION', 'left'),
-        'photo_width': app.config.get('ID_CARD_PHOTO_WIDTH', 150),
-        'photo_height': app.config.get('ID_CARD_PHOTO_HEIGHT', 180),
-        'photo_border_color': app.config.get('ID_CARD_PHOTO_BORDER_COLOR', '#32CD32'),
-        'photo_border_width': app.config.get('ID_CARD_PHOTO_BORDER_WIDTH', 3),
-        'text_position': app.config.get('ID_CARD_TEXT_POSITION', 'right'),
-        'name_font_size': app.config.get('ID_CARD_NAME_FONT_SIZE', 18),
-        'label_font_size': app.config.get('ID_CARD_LABEL_FONT_SIZE', 14),
-        'value_font_size': app.config.get('ID_CARD_VALUE_FONT_SIZE', 16),
-        'text_color': app.config.get('ID_CARD_TEXT_COLOR', '#000000'),
-        'label_color': app.config.get('ID_CARD_LABEL_COLOR', '#666666'),
-        'qr_position': app.config.get('ID_CARD_QR_POSITION', 'bottom-center'),
-        'qr_size': app.config.get('ID_CARD_QR_SIZE', 120),
-        'show_qr': app.config.get('ID_CARD_SHOW_QR', True),
-        'header_title_size': app.config.get('ID_CARD_HEADER_TITLE_SIZE', 21),
-        'header_subtitle_size': app.config.get('ID_CARD_HEADER_SUBTITLE_SIZE', 14),
-        'header_text_color': app.config.get('ID_CARD_HEADER_TEXT_COLOR', '#ffffff'),
-        'footer_text_color': app.config.get('ID_CARD_FOOTER_TEXT_COLOR', '#666666'),
-        'footer_font_size': app.config.get('ID_CARD_FOOTER_FONT_SIZE', 12),
-    }
+    id_card_settings = get_id_card_settings()
     
     return render_template('id_cards/learner.html', 
                          learner=learner, 
                          settings=settings,
                          id_card=id_card_settings,
-                         qr_code=qr_base64)
+                         qr_code=qr_base64,
+                         qr_code_url=qr_code_url)
 
 
 @app.route('/staff/<int:id>/id-card')
@@ -7530,65 +7562,19 @@ def staff_id_card(id):
     # Get school settings
     settings = get_school_settings()
     
-    # Generate QR code
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(staff.staff_id)
-    qr.make(fit=True)
-    
-    # Create QR code image
-    qr_img = qr.make_image(fill_color="black", back_color="white")
-    
-    # Convert to base64 for embedding in HTML
-    from base64 import b64encode
-    qr_buffer = BytesIO()
-    qr_img.save(qr_buffer, format='PNG')
-    qr_buffer.seek(0)
-    qr_base64 = b64encode(qr_buffer.getvalue()).decode()
+    # QR code from the QR code cache (base64 for embedding, or a cacheable image URL)
+    qr_base64 = qr_code_base64(staff.staff_id)
+    qr_code_url = url_for('qr_code_image', key=ensure_qr_code(staff.staff_id))
     
     # Get ID card settings
-    id_card_settings = {
-        'width': app.config.get('ID_CARD_WIDTH', 500),
-        'height': app.config.get('ID_CARD_HEIGHT', 0),
-        'border_radius': app.config.get('ID_CARD_BORDER_RADIUS', 15),
-        'bg_color': app.config.get('ID_CARD_BG_COLOR', '#ffffff'),
-        'header_bg_color': app.config.get('ID_CARD_HEADER_BG_COLOR', '#32CD32'),
-        'footer_bg_color': app.config.get('ID_CARD_FOOTER_BG_COLOR', '#f8f9fa'),
-        'border_color': app.config.get('ID_CARD_BORDER_COLOR', '#32CD32'),
-        'border_width': app.config.get('ID_CARD_BORDER_WIDTH', 3),
-        'logo_position': app.config.get('ID_CARD_LOGO_POSITION', 'top-center'),
-        'logo_height': app.config.get('ID_CARD_LOGO_HEIGHT', 60),
-        'logo_margin_bottom': app.config.get('ID_CARD_LOGO_MARGIN_BOTTOM', 10),
-        'photo_position': app.config.get('ID_CARD_PHOTO_POSITION', 'left'),
-        'photo_width': app.config.get('ID_CARD_PHOTO_WIDTH', 150),
-        'photo_height': app.config.get('ID_CARD_PHOTO_HEIGHT', 180),
-        'photo_border_color': app.config.get('ID_CARD_PHOTO_BORDER_COLOR', '#32CD32'),
-        'photo_border_width': app.config.get('ID_CARD_PHOTO_BORDER_WIDTH', 3),
-        'text_position': app.config.get('ID_CARD_TEXT_POSITION', 'right'),
-        'name_font_size': app.config.get('ID_CARD_NAME_FONT_SIZE', 18),
-        'label_font_size': app.config.get('ID_CARD_LABEL_FONT_SIZE', 14),
-        'value_font_size': app.config.get('ID_CARD_VALUE_FONT_SIZE', 16),
-        'text_color': app.config.get('ID_CARD_TEXT_COLOR', '#000000'),
-        'label_color': app.config.get('ID_CARD_LABEL_COLOR', '#666666'),
-        'qr_position': app.config.get('ID_CARD_QR_POSITION', 'bottom-center'),
-        'qr_size': app.config.get('ID_CARD_QR_SIZE', 120),
-        'show_qr': app.config.get('ID_CARD_SHOW_QR', True),
-        'header_title_size': app.config.get('ID_CARD_HEADER_TITLE_SIZE', 21),
-        'header_subtitle_size': app.config.get('ID_CARD_HEADER_SUBTITLE_SIZE', 14),
-        'header_text_color': app.config.get('ID_CARD_HEADER_TEXT_COLOR', '#ffffff'),
-        'footer_text_color': app.config.get('ID_CARD_FOOTER_TEXT_COLOR', '#666666'),
-        'footer_font_size': app.config.get('ID_CARD_FOOTER_FONT_SIZE', 12),
-    }
+    id_card_settings = get_id_card_settings()
     
     return render_template('id_cards/staff.html', 
                          staff=staff, 
                          settings=settings,
                          id_card=id_card_settings,
-                         qr_code=qr_base64)
+                         qr_code=qr_base64,
+                         qr_code_url=qr_code_url)
 
 
 @app.route('/learners/<int:id>/id-card/print')
@@ -7605,65 +7591,19 @@ def print_learner_id_card(id):
     # Get school settings
     settings = get_school_settings()
     
-    # Generate QR code
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(learner.admission_number)
-    qr.make(fit=True)
-    
-    # Create QR code image
-    qr_img = qr.make_image(fill_color="black", back_color="white")
-    
-    # Convert to base64 for embedding in HTML
-    from base64 import b64encode
-    qr_buffer = BytesIO()
-    qr_img.save(qr_buffer, format='PNG')
-    qr_buffer.seek(0)
-    qr_base64 = b64encode(qr_buffer.getvalue()).decode()
+    # QR code from the QR code cache (base64 for embedding, or a cacheable image URL)
+    qr_base64 = qr_code_base64(learner.admission_number)
+    qr_code_url = url_for('qr_code_image', key=ensure_qr_code(learner.admission_number))
     
     # Get ID card settings
-    id_card_settings = {
-        'width': app.config.get('ID_CARD_WIDTH', 500),
-        'height': app.config.get('ID_CARD_HEIGHT', 0),
-        'border_radius': app.config.get('ID_CARD_BORDER_RADIUS', 15),
-        'bg_color': app.config.get('ID_CARD_BG_COLOR', '#ffffff'),
-        'header_bg_color': app.config.get('ID_CARD_HEADER_BG_COLOR', '#32CD32'),
-        'footer_bg_color': app.config.get('ID_CARD_FOOTER_BG_COLOR', '#f8f9fa'),
-        'border_color': app.config.get('ID_CARD_BORDER_COLOR', '#32CD32'),
-        'border_width': app.config.get('ID_CARD_BORDER_WIDTH', 3),
-        'logo_position': app.config.get('ID_CARD_LOGO_POSITION', 'top-center'),
-        'logo_height': app.config.get('ID_CARD_LOGO_HEIGHT', 60),
-        'logo_margin_bottom': app.config.get('ID_CARD_LOGO_MARGIN_BOTTOM', 10),
-        'photo_position': app.config.get('ID_CARD_PHOTO_POSITION', 'left'),
-        'photo_width': app.config.get('ID_CARD_PHOTO_WIDTH', 150),
-        'photo_height': app.config.get('ID_CARD_PHOTO_HEIGHT', 180),
-        'photo_border_color': app.config.get('ID_CARD_PHOTO_BORDER_COLOR', '#32CD32'),
-        'photo_border_width': app.config.get('ID_CARD_PHOTO_BORDER_WIDTH', 3),
-        'text_position': app.config.get('ID_CARD_TEXT_POSITION', 'right'),
-        'name_font_size': app.config.get('ID_CARD_NAME_FONT_SIZE', 18),
-        'label_font_size': app.config.get('ID_CARD_LABEL_FONT_SIZE', 14),
-        'value_font_size': app.config.get('ID_CARD_VALUE_FONT_SIZE', 16),
-        'text_color': app.config.get('ID_CARD_TEXT_COLOR', '#000000'),
-        'label_color': app.config.get('ID_CARD_LABEL_COLOR', '#666666'),
-        'qr_position': app.config.get('ID_CARD_QR_POSITION', 'bottom-center'),
-        'qr_size': app.config.get('ID_CARD_QR_SIZE', 120),
-        'show_qr': app.config.get('ID_CARD_SHOW_QR', True),
-        'header_title_size': app.config.get('ID_CARD_HEADER_TITLE_SIZE', 21),
-        'header_subtitle_size': app.config.get('ID_CARD_HEADER_SUBTITLE_SIZE', 14),
-        'header_text_color': app.config.get('ID_CARD_HEADER_TEXT_COLOR', '#ffffff'),
-        'footer_text_color': app.config.get('ID_CARD_FOOTER_TEXT_COLOR', '#666666'),
-        'footer_font_size': app.config.get('ID_CARD_FOOTER_FONT_SIZE', 12),
-    }
+    id_card_settings = get_id_card_settings()
     
     return render_template('id_cards/learner_print.html', 
                          learner=learner, 
                          settings=settings,
                          id_card=id_card_settings,
-                         qr_code=qr_base64)
+                         qr_code=qr_base64,
+                         qr_code_url=qr_code_url)
 
 
 @app.route('/staff/<int:id>/id-card/print')
@@ -7680,63 +7620,94 @@ def print_staff_id_card(id):
     # Get school settings
     settings = get_school_settings()
     
-    # Generate QR code
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(staff.staff_id)
-    qr.make(fit=True)
-    
-    # Create QR code image
-    qr_img = qr.make_image(fill_color="black", back_color="white")
-    
-    # Convert to base64 for embedding in HTML
-    from base64 import b64encode
-    qr_buffer = BytesIO()
-    qr_img.save(qr_buffer, format='PNG')
-    qr_buffer.seek(0)
-    qr_base64 = b64encode(qr_buffer.getvalue()).decode()
+    # QR code from the QR code cache (base64 for embedding, or a cacheable image URL)
+    qr_base64 = qr_code_base64(staff.staff_id)
+    qr_code_url = url_for('qr_code_image', key=ensure_qr_code(staff.staff_id))
     
     # Get ID card settings
-    id_card_settings = {
-        'width': app.config.get('ID_CARD_WIDTH', 500),
-        'height': app.config.get('ID_CARD_HEIGHT', 0),
-        'border_radius': app.config.get('ID_CARD_BORDER_RADIUS', 15),
-        'bg_color': app.config.get('ID_CARD_BG_COLOR', '#ffffff'),
-        'header_bg_color': app.config.get('ID_CARD_HEADER_BG_COLOR', '#32CD32'),
-        'footer_bg_color': app.config.get('ID_CARD_FOOTER_BG_COLOR', '#f8f9fa'),
-        'border_color': app.config.get('ID_CARD_BORDER_COLOR', '#32CD32'),
-        'border_width': app.config.get('ID_CARD_BORDER_WIDTH', 3),
-        'logo_position': app.config.get('ID_CARD_LOGO_POSITION', 'top-center'),
-        'logo_height': app.config.get('ID_CARD_LOGO_HEIGHT', 60),
-        'logo_margin_bottom': app.config.get('ID_CARD_LOGO_MARGIN_BOTTOM', 10),
-        'photo_position': app.config.get('ID_CARD_PHOTO_POSITION', 'left'),
-        'photo_width': app.config.get('ID_CARD_PHOTO_WIDTH', 150),
-        'photo_height': app.config.get('ID_CARD_PHOTO_HEIGHT', 180),
-        'photo_border_color': app.config.get('ID_CARD_PHOTO_BORDER_COLOR', '#32CD32'),
-        'photo_border_width': app.config.get('ID_CARD_PHOTO_BORDER_WIDTH', 3),
-        'text_position': app.config.get('ID_CARD_TEXT_POSITION', 'right'),
-        'name_font_size': app.config.get('ID_CARD_NAME_FONT_SIZE', 18),
-        'label_font_size': app.config.get('ID_CARD_LABEL_FONT_SIZE', 14),
-        'value_font_size': app.config.get('ID_CARD_VALUE_FONT_SIZE', 16),
-        'text_color': app.config.get('ID_CARD_TEXT_COLOR', '#000000'),
-        'label_color': app.config.get('ID_CARD_LABEL_COLOR', '#666666'),
-        'qr_position': app.config.get('ID_CARD_QR_POSITION', 'bottom-center'),
-        'qr_size': app.config.get('ID_CARD_QR_SIZE', 120),
-        'show_qr': app.config.get('ID_CARD_SHOW_QR', True),
-        'header_title_size': app.config.get('ID_CARD_HEADER_TITLE_SIZE', 21),
-        'header_subtitle_size': app.config.get('ID_CARD_HEADER_SUBTITLE_SIZE', 14),
-        'header_text_color': app.config.get('ID_CARD_HEADER_TEXT_COLOR', '#ffffff'),
-        'footer_text_color': app.config.get('ID_CARD_FOOTER_TEXT_COLOR', '#666666'),
-        'footer_font_size': app.config.get('ID_CARD_FOOTER_FONT_SIZE', 12),
-    }
+    id_card_settings = get_id_card_settings()
     
     return render_template('id_cards/staff_print.html', 
                          staff=staff, 
                          settings=settings,
                          id_card=id_card_settings,
-                         qr_code=qr_base64)
+                         qr_code=qr_base64,
+                         qr_code_url=qr_code_url)
+
+
+@app.route('/qr-codes/<key>.png')
+@login_required
+def qr_code_image(key):
+    """Serve a cached QR code by its content address; the image behind a key never changes"""
+    if not re.fullmatch(r'[0-9a-f]{32}', key):
+        return Response(status=404)
+    
+    path = qr_code_path(app.config['QR_CODE_CACHE_FOLDER'], key)
+    if not os.path.exists(path):
+        return Response(status=404)
+    
+    response = send_file(os.path.abspath(path), mimetype='image/png', etag=key, max_age=QR_CODE_MAX_AGE,
+                         conditional=True)
+    response.cache_control.immutable = True
+    response.cache_control.private = True
+    response.cache_control.public = False
+    return response
+
+
+def send_id_card_sheets(cards, title, download_name):
+    """Render ID cards onto A4 sheets and send them as one PDF"""
+    layout = sheet_layout(app.config.get('ID_CARD_SHEET_COLUMNS', 2), app.config.get('ID_CARD_SHEET_ROWS', 5))
+    pdf_buffer = BytesIO()
+    render_id_card_sheets(cards, get_report_school_info(), get_id_card_settings(), title, pdf_buffer,
+                          layout=layout, max_workers=app.config.get('REPORT_CARD_WORKERS'),
+                          qr_folder=app.config['QR_CODE_CACHE_FOLDER'], storage=get_storage())
+    pdf_buffer.seek(0)
+    
+    return send_file(
+        pdf_buffer,
+        mimetype='application/pdf',
+        as_attachment=True,
+        download_name=download_name
+    )
 
+
+@app.route('/learners/id-cards/print-sheet')
+@login_required
+@role_required('admin')
+def print_learner_id_card_sheet():
+    """Print-ready A4 sheets of ID cards for a class (or all active learners)"""
+    try:
+        class_filter = request.args.get('class', '')
+        cards = build_learner_cards(class_filter)
+        if not cards:
+            flash('No active learners found for the selected class.', 'warning')
+            return redirect(url_for('learners'))
+        
+        name = re.sub(r'[^A-Za-z0-9]+', '_', class_filter).strip('_') or 'all'
+        return send_id_card_sheets(
+            cards, 'LEARNER ID CARD', f'learner_id_cards_{name}_{datetime.now().strftime("%Y%m%d")}.pdf'
+        )
+    except Exception as e:
+        flash(f'Error generating ID cards: {str(e)}', 'danger')
+        return redirect(url_for('learners'))
+
+
+@app.route('/staff/id-cards/print-sheet')
+@login_required
+@role_required('admin')
+def print_staff_id_card_sheet():
+    """Print-ready A4 sheets of ID cards for a department (or all active staff)"""
+    try:
+        department = request.args.get('department', '')
+        cards = build_staff_cards(department)
+        if not cards:
+            flash('No active staff found for the selected department.', 'warning')
+            return redirect(url_for('staff'))
+        
+        name = re.sub(r'[^A-Za-z0-9]+', '_', department).strip('_') or 'all'
+        return send_id_card_sheets(
+            cards, 'STAFF ID CARD', f'staff_id_cards_{name}_{datetime.now().strftime("%Y%m%d")}.pdf'
+        )
+    except Exception as e:
+        flash(f'Error generating ID cards: {str(e)}', 'danger')
+        return redirect(url_for('staff'))
@@ -0,0 +1,253 @@
+"""
+File Storage for Wajina Suite
+Uploaded files are stored through one interface (put/open/stream/url/delete) backed either by
+the local upload folder or by an S3-compatible bucket (AWS S3, MinIO, Cloudflare R2, ...)
+"""
+
+from flask import current_app, url_for
+import mimetypes
+import os
+import posixpath
+import shutil
+import tempfile
+
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def normalise_key(key):
+    """Validate a storage key (a relative path such as 'receipts/receipt_1.pdf')"""
+    key = (key or '').replace('\\', '/').lstrip('/')
+    normalised = posixpath.normpath(key)
+    if not key or normalised.startswith('..') or normalised == '.':
+        raise ValueError(f'Invalid storage key: {key!r}')
+    return normalised
+
+
+def guess_content_type(key):
+    return mimetypes.guess_type(key)[0] or 'application/octet-stream'
+
+
+class LocalStorage:
+    """Files under a local folder (UPLOAD_FOLDER); the default, and fine for a single instance"""
+    
+    remote = False
+    
+    def __init__(self, root, static_folder=None):
+        self.root = os.path.abspath(root)
+        self.static_folder = os.path.abspath(static_folder) if static_folder else None
+    
+    def path(self, key):
+        return os.path.join(self.root, *normalise_key(key).split('/'))
+    
+    def put(self, key, fileobj, content_type=None):
+        """Store a file object (read in chunks, never fully in memory) atomically under key"""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(fileobj, f, STREAM_CHUNK_SIZE)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return normalise_key(key)
+    
+    def open(self, key):
+        return open(self.path(key), 'rb')
+    
+    def stream(self, key, chunk_size=STREAM_CHUNK_SIZE):
+        with self.open(key) as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    
+    def exists(self, key):
+        return os.path.isfile(self.path(key))
+    
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+    
+    def local_path(self, key):
+        """Path of the file on this machine, or None if it does not exist"""
+        path = self.path(key)
+        return path if os.path.isfile(path) else None
+    
+    def url(self, key, expires_in=None, download_name=None):
+        """Static URL when the folder is inside the static folder, otherwise None"""
+        if not self.static_folder or os.path.commonpath([self.root, self.static_folder]) != self.static_folder:
+            return None
+        relative = os.path.relpath(self.path(key), self.static_folder).replace(os.sep, '/')
+        return url_for('static', filename=relative)
+
+
+class S3Storage:
+    """
+    Files in an S3-compatible bucket. Uploads and downloads are streamed in parts, and
+    url() returns a presigned GET URL so browsers fetch the file from the bucket directly.
+    Set endpoint_url for MinIO or other S3-compatible services.
+    """
+    
+    remote = True
+    
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None, access_key_id=None,
+                 secret_access_key=None, url_expiry=3600, cache_folder='storage_cache'):
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.endpoint_url = endpoint_url or None
+        self.region = region or None
+        self.access_key_id = access_key_id or None
+        self.secret_access_key = secret_access_key or None
+        self.url_expiry = url_expiry
+        self.cache_folder = cache_folder
+        self._client = None
+    
+    def __getstate__(self):
+        # boto3 clients cannot be pickled; rendering worker processes build their own
+        state = self.__dict__.copy()
+        state['_client'] = None
+        return state
+    
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+            from botocore.config import Config
+            
+            self._client = boto3.client(
+                's3',
+                endpoint_url=self.endpoint_url,
+                region_name=self.region,
+                aws_access_key_id=self.access_key_id,
+                aws_secret_access_key=self.secret_access_key,
+                config=Config(signature_version='s3v4',
+                              s3={'addressing_style': 'path' if self.endpoint_url else 'auto'}),
+            )
+        return self._client
+    
+    def object_key(self, key):
+        key = normalise_key(key)
+        return f'{self.prefix}/{key}' if self.prefix else key
+    
+    def put(self, key, fileobj, content_type=None):
+        """Multipart upload straight from the file object"""
+        self.client.upload_fileobj(
+            fileobj, self.bucket, self.object_key(key),
+            ExtraArgs={'ContentType': content_type or guess_content_type(key)}
+        )
+        return normalise_key(key)
+    
+    def open(self, key):
+        """Streaming body of the object (a file-like object with read())"""
+        return self.client.get_object(Bucket=self.bucket, Key=self.object_key(key))['Body']
+    
+    def stream(self, key, chunk_size=STREAM_CHUNK_SIZE):
+        body = self.open(key)
+        try:
+            for chunk in body.iter_chunks(chunk_size):
+                yield chunk
+        finally:
+            body.close()
+    
+    def exists(self, key):
+        from botocore.exceptions import ClientError
+        
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+    
+    def delete(self, key):
+        try:
+            self.client.delete_object(Bucket=self.bucket, Key=self.object_key(key))
+        except Exception:
+            pass
+    
+    def local_path(self, key):
+        """
+        Download the object once into cache_folder and return the local path (for ReportLab and
+        Pillow, which need real files), or None if it does not exist. Keys are never rewritten,
+        since every upload gets a new timestamped name, so cached copies do not go stale.
+        """
+        from botocore.exceptions import ClientError
+        
+        path = os.path.join(self.cache_folder, *normalise_key(key).split('/'))
+        if os.path.isfile(path):
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                self.client.download_fileobj(self.bucket, self.object_key(key), f)
+            os.replace(temp_path, path)
+            return path
+        except ClientError:
+            return None
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    
+    def url(self, key, expires_in=None, download_name=None):
+        """Presigned GET URL, valid for url_expiry seconds"""
+        params = {'Bucket': self.bucket, 'Key': self.object_key(key)}
+        if download_name:
+            params['ResponseContentDisposition'] = f'attachment; filename="{download_name}"'
+        return self.client.generate_presigned_url(
+            'get_object', Params=params, ExpiresIn=expires_in or self.url_expiry
+        )
+
+
+def create_storage(config, static_folder=None):
+    """Storage backend for an app config (STORAGE_BACKEND = 'local' or 's3')"""
+    if config.get('STORAGE_BACKEND', 'local') == 's3':
+        return S3Storage(
+            config['S3_BUCKET'],
+            prefix=config.get('S3_PREFIX', ''),
+            endpoint_url=config.get('S3_ENDPOINT_URL'),
+            region=config.get('S3_REGION'),
+            access_key_id=config.get('S3_ACCESS_KEY_ID'),
+            secret_access_key=config.get('S3_SECRET_ACCESS_KEY'),
+            url_expiry=config.get('S3_URL_EXPIRY', 3600),
+            cache_folder=config.get('STORAGE_CACHE_FOLDER', 'storage_cache'),
+        )
+    return LocalStorage(config['UPLOAD_FOLDER'], static_folder)
+
+
+def get_storage():
+    """Storage backend of the current app, created once"""
+    storage = current_app.extensions.get('storage')
+    if storage is None:
+        storage = create_storage(current_app.config, current_app.static_folder)
+        current_app.extensions['storage'] = storage
+    return storage
+
+
+def save_upload(file, key):
+    """Store an uploaded file (a FileStorage) under key and return the key"""
+    return get_storage().put(key, file.stream, content_type=file.mimetype or guess_content_type(key))
+
+
+def delete_upload(key):
+    """Remove a stored upload, ignoring missing files"""
+    if key:
+        try:
+            get_storage().delete(key)
+        except ValueError:
+            pass
+
+
+def file_url(key, download_name=None):
+    """URL of a stored upload for templates: a static URL locally, a presigned URL on S3"""
+    if not key:
+        return None
+    return get_storage().url(key, download_name=download_name)
@@ -0,0 +1,141 @@
+"""
+E-Wallet concurrency stress check
+Runs many threads crediting and debiting one throwaway wallet at the same time through
+ewallet_service and checks that no update was lost: the final balance equals the opening
+deposit plus every committed credit minus every committed debit, matches the ledger, and never
+went below zero. Any operation that fails other than a refused debit (a lock timeout, a deadlock)
+fails the check. Point DATABASE_URL at a PostgreSQL test database to check row locking there.
+The wallet, its user and its transactions are deleted afterwards and the totals rebuilt.
+
+Usage:
+    python stress_ewallet.py                        # 12 threads x 50 operations
+    python stress_ewallet.py --threads 24 --ops 200
+    python stress_ewallet.py --keep                 # leave the test wallet in place
+"""
+import sys
+import random
+import threading
+import uuid
+from decimal import Decimal
+from app import app, db
+from models import User, EWallet, EWalletTransaction
+from ewallet_service import (credit_wallet, debit_wallet, to_amount, InsufficientFundsError,
+                             rebuild_wallet_totals, verify_wallet_totals)
+
+
+OPENING_BALANCE = Decimal('500.00')
+
+
+def option(argv, name, default):
+    if name in argv:
+        return int(argv[argv.index(name) + 1])
+    return default
+
+
+def worker(ewallet_id, seed, ops, results, lock):
+    """Alternate random credits and debits, each in its own database transaction"""
+    rng = random.Random(seed)
+    credited = debited = Decimal('0.00')
+    refused = failed = 0
+    first_error = None
+    with app.app_context():
+        for i in range(ops):
+            amount = to_amount(rng.randint(100, 5000) / 100)
+            ewallet = db.session.get(EWallet, ewallet_id)
+            try:
+                if i % 2 == 0:
+                    credit_wallet(ewallet, amount, 'deposit', transaction_reference=f'STRESS-{uuid.uuid4().hex}')
+                    db.session.commit()
+                    credited += amount
+                else:
+                    debit_wallet(ewallet, amount, 'payment', transaction_reference=f'STRESS-{uuid.uuid4().hex}')
+                    db.session.commit()
+                    debited += amount
+            except InsufficientFundsError:
+                db.session.rollback()
+                refused += 1
+            except Exception as e:
+                # e.g. a lock timeout; nothing was committed for this operation
+                db.session.rollback()
+                failed += 1
+                if first_error is None:
+                    first_error = f'{type(e).__name__}: {e}'
+        db.session.remove()
+    with lock:
+        results.append((credited, debited, refused, failed, first_error))
+
+
+def main(argv):
+    threads = option(argv, '--threads', 12)
+    ops = option(argv, '--ops', 50)
+    keep = '--keep' in argv
+    
+    with app.app_context():
+        name = f'stress_{uuid.uuid4().hex[:8]}'
+        user = User(username=name, email=f'{name}@example.invalid', role='parent',
+                    first_name='Stress', last_name='Test', is_active=False)
+        user.set_password(uuid.uuid4().hex)
+        db.session.add(user)
+        db.session.flush()
+        ewallet = EWallet(user_id=user.id, balance=0)
+        db.session.add(ewallet)
+        db.session.flush()
+        credit_wallet(ewallet, OPENING_BALANCE, 'deposit', transaction_reference=f'STRESS-{uuid.uuid4().hex}')
+        db.session.commit()
+        ewallet_id, user_id = ewallet.id, user.id
+        print(f"{threads} threads x {ops} operations on wallet {ewallet_id} ({db.engine.dialect.name})")
+    
+    results = []
+    lock = threading.Lock()
+    pool = [threading.Thread(target=worker, args=(ewallet_id, seed, ops, results, lock)) for seed in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    
+    credited = sum(r[0] for r in results)
+    debited = sum(r[1] for r in results)
+    refused = sum(r[2] for r in results)
+    failed = sum(r[3] for r in results)
+    first_error = next((r[4] for r in results if r[4]), None)
+    expected = OPENING_BALANCE + credited - debited
+    
+    with app.app_context():
+        balance = to_amount(db.session.get(EWallet, ewallet_id).balance)
+        rows = EWalletTransaction.query.filter_by(ewallet_id=ewallet_id, status='completed').all()
+        ledger = sum((r.amount if r.transaction_type == 'deposit' else -r.amount for r in rows), Decimal('0.00'))
+        negative = [r.id for r in rows if r.balance_after < 0]
+        total_mismatches = [m for m in verify_wallet_totals() if m.startswith(f'EWallet {ewallet_id} ')]
+        
+        print(f"Committed: {credited} credited, {debited} debited; {refused} debits refused, {failed} failed")
+        print(f"Balance {balance}, expected {expected}, ledger {to_amount(ledger)}")
+        problems = []
+        if failed:
+            # Lock timeouts, deadlocks or a broken conditional UPDATE; none of these should happen
+            problems.append(f'{failed} of {threads * ops} operation(s) failed, first: {first_error}')
+        if balance != expected:
+            problems.append(f'lost updates: balance differs from expected by {balance - expected}')
+        if balance != to_amount(ledger):
+            problems.append('balance differs from the ledger')
+        if negative:
+            problems.append(f'{len(negative)} transaction(s) left the balance below zero')
+        if total_mismatches:
+            problems.append(f'running totals differ: {total_mismatches}')
+        
+        if not keep:
+            EWalletTransaction.query.filter_by(ewallet_id=ewallet_id).delete(synchronize_session=False)
+            EWallet.query.filter_by(id=ewallet_id).delete(synchronize_session=False)
+            User.query.filter_by(id=user_id).delete(synchronize_session=False)
+            rebuild_wallet_totals()
+            db.session.commit()
+    
+    if problems:
+        for problem in problems:
+            print(f"FAILED: {problem}")
+        return 1
+    print("OK: no lost updates")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
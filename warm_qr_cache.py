@@ -0,0 +1,29 @@
+"""
+ID card QR code cache warm-up script
+Generates the QR codes for every active learner and staff member into the QR code cache,
+e.g. after importing a new intake, so ID card pages and print sheets never generate them inline.
+
+Usage:
+    python warm_qr_cache.py
+"""
+import sys
+from app import app, db
+from models import Learner, Staff
+from qr_codes import warm_qr_codes
+
+
+def main(argv):
+    with app.app_context():
+        admission_numbers = [row[0] for row in db.session.query(Learner.admission_number)
+                             .filter(Learner.status == 'active')]
+        staff_ids = [row[0] for row in db.session.query(Staff.staff_id).filter(Staff.status == 'active')]
+        
+        print(f"Warming QR codes for {len(admission_numbers)} learner(s) and {len(staff_ids)} staff...")
+        created = warm_qr_codes(admission_numbers + staff_ids)
+        print(f"Done: {created} new QR code(s) generated, the rest were already cached.")
+        
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))